@@ -1,43 +1,117 @@
-from django.contrib import admin
-from .models import Patient, PatientCase, TreatmentStep, BudgetItem, MedicalRecord
+from django.contrib import admin, messages
+from django.db import transaction
+from rhci_platform.admin_search import IndexedAutocompleteMixin
+from rhci_platform.cache_tags import HOME, case_tag, tagged_cache
+from rhci_platform.changelists import FastChangeListMixin
+from rhci_platform.lazy_inlines import LazyInline, LazyInlinesMixin
+from . import lifecycle
+from .models import Patient, PatientCase, TreatmentStep, BudgetItem, MedicalRecord, UploadSession
 
-class PatientCaseInline(admin.TabularInline):
+# The lazy inlines write a page of rows in bulk, without post_save (see
+# apps.beneficiaries.signals); their saved() hooks invalidate the caches once,
+# after the page commits
+
+class PatientCaseInline(LazyInline):
     model = PatientCase
-    extra = 0
 
-class BudgetItemInline(admin.TabularInline):
+    def get_queryset(self, request):
+        # str() of each row shows the patient
+        return super().get_queryset(request).select_related('patient')
+
+    def saved(self, request, parent, added, changed, deleted):
+        tags = [case_tag(case.pk) for case in [*added, *(obj for obj, fields in changed), *deleted]]
+        transaction.on_commit(lambda: tagged_cache.invalidate(*tags, HOME))
+
+class BudgetItemInline(LazyInline):
     model = BudgetItem
-    extra = 0
+    autocomplete_fields = ('patient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('case__patient')
 
-class TreatmentStepInline(admin.TabularInline):
+    def saved(self, request, parent, added, changed, deleted):
+        tag = case_tag(parent.pk)
+        transaction.on_commit(lambda: tagged_cache.invalidate(tag))
+
+class TreatmentStepInline(LazyInline):
     model = TreatmentStep
-    extra = 0
+
+    def saved(self, request, parent, added, changed, deleted):
+        for step, fields in changed:
+            if 'status' in fields:
+                step.publish_status_change(step._saved_status)
+                step._saved_status = step.status
+        tag = case_tag(parent.pk)
+        transaction.on_commit(lambda: tagged_cache.invalidate(tag))
+
+def transition_action(status, verb):
+    """Admin action moving the selected cases to `status` in bulk (apps.beneficiaries.lifecycle)"""
+    @admin.action(description=f'{verb} selected cases', permissions=['change'])
+    def action(modeladmin, request, queryset):
+        moved = lifecycle.transition(queryset, status)
+        allowed = ' or '.join(lifecycle.TRANSITIONS[status])
+        modeladmin.message_user(
+            request, f'{moved} cases {status}. Selected cases that were not {allowed} were left as they were.',
+            messages.SUCCESS if moved else messages.WARNING)
+    action.__name__ = f'{status}_cases'
+    return action
 
 @admin.register(Patient)
-class PatientAdmin(admin.ModelAdmin):
+class PatientAdmin(LazyInlinesMixin, IndexedAutocompleteMixin, FastChangeListMixin, admin.ModelAdmin):
     list_display = ('id', 'first_name', 'last_name', 'dob', 'gender', 'city', 'region', 'created_at')
     search_fields = ('first_name', 'last_name', 'city', 'region')
-    inlines = [PatientCaseInline]
+    # Patient widgets match these by prefix through patient_last_name_lower_idx and patient_first_name_lower_idx
+    autocomplete_search_fields = ('last_name', 'first_name')
+    # Newest first through the primary key; autocomplete pages need a stable order
+    ordering = ('-id',)
+    lazy_inlines = [PatientCaseInline]
 
 @admin.register(PatientCase)
-class PatientCaseAdmin(admin.ModelAdmin):
+class PatientCaseAdmin(LazyInlinesMixin, IndexedAutocompleteMixin, FastChangeListMixin, admin.ModelAdmin):
     list_display = ('id', 'patient', 'title', 'diagnosis', 'status', 'created_at')
+    list_select_related = ('patient',)
     list_filter = ('status',)
     search_fields = ('title', 'diagnosis')
-    inlines = [TreatmentStepInline, BudgetItemInline]
+    # Case widgets match the title or the patient's names (case_title_lower_idx and the patient indexes)
+    autocomplete_search_fields = ('title', 'patient__last_name', 'patient__first_name')
+    # str() shows the patient
+    autocomplete_select_related = ('patient',)
+    autocomplete_fields = ('patient',)
+    lazy_inlines = [TreatmentStepInline, BudgetItemInline]
+    actions = [
+        transition_action('published', 'Publish'),
+        transition_action('paused', 'Pause'),
+        transition_action('completed', 'Complete'),
+        transition_action('archived', 'Archive'),
+    ]
 
 @admin.register(TreatmentStep)
 class TreatmentStepAdmin(admin.ModelAdmin):
     list_display = ('id', 'case', 'title', 'status', 'planned_date', 'actual_date', 'order_index')
+    list_select_related = ('case__patient',)
+    autocomplete_fields = ('case',)
     list_filter = ('status',)
     search_fields = ('title',)
 
 @admin.register(BudgetItem)
 class BudgetItemAdmin(admin.ModelAdmin):
     list_display = ('id', 'category', 'patient', 'case', 'cost', 'expected_date')  # Remove 'diagnostics'
+    list_select_related = ('patient', 'case__patient')
+    autocomplete_fields = ('patient', 'case')
 
 @admin.register(MedicalRecord)
 class MedicalRecordAdmin(admin.ModelAdmin):
     list_display = ('id', 'case', 'record_type', 'uploaded_by', 'created_at')
+    list_select_related = ('case__patient', 'uploaded_by')
     list_filter = ('record_type',)
     search_fields = ('case__title',)
+    autocomplete_fields = ('case', 'uploaded_by')
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'filename', 'target', 'case', 'user', 'received_bytes', 'total_size', 'status', 'updated_at')
+    list_filter = ('status', 'target')
+    search_fields = ('filename', 'sha256')
+    list_select_related = ('case__patient', 'user')
+    autocomplete_fields = ('case', 'user')
+    readonly_fields = ('received_bytes', 'sha256', 'medical_record', 'error_message')
@@ -0,0 +1,53 @@
+"""
+Bulk status changes for cases: publish, pause, complete and archive.
+
+transition() moves every selected case that may make the move with one
+UPDATE, however many there are. It bypasses save() and post_save; instead it
+publishes a single `case.status_changed` event listing the cases, and
+invalidates their cached pages together once the transaction commits.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.outbox import publish
+from rhci_platform.cache_tags import HOME, case_tag, tagged_cache
+from rhci_platform.transactions import write_transaction
+
+from .models import PatientCase
+
+STATUS_CHANGED = 'case.status_changed'
+
+# For each status, the statuses a case may move to it from
+TRANSITIONS = {
+    'published': ('draft', 'pending', 'paused'),
+    'paused': ('published',),
+    'completed': ('published', 'paused'),
+    'archived': ('draft', 'pending', 'published', 'paused', 'completed'),
+}
+
+
+def transition(cases, status):
+    """
+    Move the cases of queryset `cases` that may go to `status` there;
+    returns how many moved. Publishing sets published_at on cases never
+    published before.
+    """
+    allowed = TRANSITIONS[status]
+    now = timezone.now()
+    with write_transaction():
+        moving = list(cases.filter(status__in=allowed).order_by('pk')
+                      .select_for_update().values_list('pk', 'status'))
+        if not moving:
+            return 0
+        ids = [pk for pk, previous in moving]
+        changes = {'status': status, 'updated_at': now}
+        if status == 'published':
+            changes['published_at'] = Coalesce(F('published_at'), now)
+        PatientCase.objects.filter(pk__in=ids).update(**changes)
+        # Keyed by the new status: one event covers every case moved
+        publish(STATUS_CHANGED, status, {'to': status, 'cases': moving})
+        tags = [case_tag(pk) for pk in ids]
+        transaction.on_commit(lambda: tagged_cache.invalidate(*tags, HOME))
+    return len(moving)
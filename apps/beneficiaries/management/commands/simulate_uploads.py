@@ -0,0 +1,138 @@
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from apps.beneficiaries.models import PatientCase
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Upload files through the chunked upload API over a simulated lossy link "
+        "and report peak Python memory per upload and the success rate. "
+        "All database changes are rolled back and files go to a temp directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uploads', type=int, default=20)
+        parser.add_argument('--size-mb', type=float, default=20)
+        parser.add_argument('--chunk-kb', type=int, default=1024)
+        parser.add_argument('--loss', type=float, default=0.1,
+                            help='Probability that a chunk request is lost or truncated')
+        parser.add_argument('--max-retries', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        case = PatientCase.objects.first()
+        if case is None:
+            raise CommandError("At least one PatientCase is required")
+
+        self.rng = random.Random(options['seed'])
+        tmpdir = tempfile.mkdtemp(prefix='rhci_uploads_')
+        try:
+            with override_settings(
+                MEDIA_ROOT=os.path.join(tmpdir, 'media'),
+                CHUNKED_UPLOAD_DIR=os.path.join(tmpdir, 'parts'),
+                ALLOWED_HOSTS=['testserver'],
+            ):
+                try:
+                    with transaction.atomic():
+                        self.run(case, tmpdir, options)
+                        raise Rollback
+                except Rollback:
+                    pass
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def run(self, case, tmpdir, options):
+        user = User.objects.create_superuser('upload-bench', 'upload-bench@example.com', 'x')
+        client = Client()
+        client.force_login(user)
+
+        size = int(options['size_mb'] * 1024 * 1024)
+        chunk_size = options['chunk_kb'] * 1024
+        succeeded = 0
+        peaks = []
+        lost = 0
+
+        for n in range(options['uploads']):
+            source = os.path.join(tmpdir, f'source_{n}.pdf')
+            digest = hashlib.sha256()
+            with open(source, 'wb') as fh:
+                remaining = size
+                while remaining:
+                    block = os.urandom(min(remaining, 1024 * 1024))
+                    digest.update(block)
+                    fh.write(block)
+                    remaining -= len(block)
+
+            tracemalloc.start()
+            ok, dropped = self.upload(client, case, source, size, digest.hexdigest(), chunk_size, options)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            os.remove(source)
+            succeeded += ok
+            lost += dropped
+
+        total = options['uploads']
+        self.stdout.write(f"File size:          {size / 1024 / 1024:.1f} MiB, chunk {chunk_size // 1024} KiB")
+        self.stdout.write(f"Simulated loss:     {options['loss']:.0%} ({lost} chunk requests dropped)")
+        self.stdout.write(f"Success rate:       {succeeded}/{total} ({succeeded / total:.0%})")
+        self.stdout.write(f"Peak memory/upload: max {max(peaks) / 1024 / 1024:.2f} MiB, "
+                          f"avg {sum(peaks) / len(peaks) / 1024 / 1024:.2f} MiB")
+
+    def upload(self, client, case, source, size, sha256, chunk_size, options):
+        """Return (completed, dropped_requests) for one simulated upload"""
+        response = client.post(reverse('upload_create'), {
+            'target': 'medical_record',
+            'case_id': case.id,
+            'record_type': 'lab_result',
+            'filename': os.path.basename(source),
+            'total_size': size,
+            'sha256': sha256,
+        }, content_type='application/json')
+        upload_id = response.json()['upload_id']
+        upload_url = reverse('upload_chunk', args=[upload_id])
+        offset = 0
+        dropped = 0
+        retries = 0
+
+        with open(source, 'rb') as fh:
+            while offset < size:
+                if retries > options['max_retries']:
+                    return False, dropped
+                fh.seek(offset)
+                chunk = fh.read(chunk_size)
+                end = offset + len(chunk) - 1
+                headers = {'HTTP_CONTENT_RANGE': f'bytes {offset}-{end}/{size}'}
+                roll = self.rng.random()
+
+                if roll < options['loss'] / 2:
+                    # Connection dropped mid-body: the server sees a short chunk
+                    dropped += 1
+                    retries += 1
+                    client.put(upload_url, chunk[:len(chunk) // 2], content_type='application/octet-stream', **headers)
+                elif roll < options['loss']:
+                    # Chunk arrived but the response was lost: ask where to resume
+                    dropped += 1
+                    retries += 1
+                    client.put(upload_url, chunk, content_type='application/octet-stream', **headers)
+                else:
+                    client.put(upload_url, chunk, content_type='application/octet-stream', **headers)
+                    retries = 0
+                offset = client.get(upload_url).json()['offset']
+
+        response = client.post(reverse('upload_complete', args=[upload_id]))
+        return response.status_code == 200, dropped
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.24 on 2026-10-19 05:06
+
+from django.db import migrations, models
+
+from rhci_platform.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('beneficiaries', '0008_uploadsession'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='patientcase',
+            index=models.Index(condition=models.Q(('status', 'published')), fields=['-created_at'], name='case_published_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.24 on 2026-10-19 06:33
+
+from django.db import migrations, models
+
+
+def mark_funded_cases(apps, schema_editor):
+    # Cases already at their target were funded before this field existed;
+    # don't announce them again on their next donation
+    PatientCase = apps.get_model('beneficiaries', 'PatientCase')
+    PatientCase.objects.filter(amount_raised__gte=models.F('target_amount')).update(
+        funded_at=models.F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beneficiaries', '0009_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientcase',
+            name='funded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_funded_cases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.24 on 2026-10-19 09:12
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+from rhci_platform.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('beneficiaries', '0010_patientcase_funded_at'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='patient',
+            index=models.Index(django.db.models.functions.text.Lower('last_name'), name='patient_last_name_lower_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='patient',
+            index=models.Index(django.db.models.functions.text.Lower('first_name'), name='patient_first_name_lower_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='patientcase',
+            index=models.Index(fields=['-created_at'], name='case_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='patientcase',
+            index=models.Index(django.db.models.functions.text.Lower('title'), name='case_title_lower_idx'),
+        ),
+    ]
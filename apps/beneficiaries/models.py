@@ -1,8 +1,11 @@
 import uuid
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Lower
 from django.contrib.auth import get_user_model
 
+from core.outbox import publish
+
 User = get_user_model()
 
 class Patient(models.Model):
@@ -22,9 +25,19 @@ class Patient(models.Model):
     photo = models.ImageField(upload_to='patients/photos/', blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Admin autocomplete matches names by case-insensitive prefix (rhci_platform.admin_search)
+            models.Index(Lower('last_name'), name='patient_last_name_lower_idx'),
+            models.Index(Lower('first_name'), name='patient_first_name_lower_idx'),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    def get_full_name(self):
+        return f"{self.first_name} {self.last_name}"
+
 class PatientCase(models.Model):
     # No need to explicitly define id field - Django will create an AutoField
     patient = models.ForeignKey('Patient', on_delete=models.PROTECT)
@@ -52,9 +65,22 @@ class PatientCase(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     amount_raised = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    # Set once, when amount_raised first reaches the target (donors are notified then)
+    funded_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Home and discovery list the newest published cases
+            models.Index(
+                fields=['-created_at'],
+                condition=models.Q(status='published'),
+                name='case_published_recent_idx',
+            ),
+            # The admin's case list and autocomplete, newest first
+            models.Index(fields=['-created_at'], name='case_created_idx'),
+            models.Index(Lower('title'), name='case_title_lower_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient}'s case - {self.diagnosis}"
@@ -98,6 +124,31 @@ class TreatmentStep(models.Model):
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        previous = getattr(self, '_saved_status', None)
+        changed = not self._state.adding and self.status != previous
+        # Donors of the case hear about status changes (apps.donations.subscribers)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if changed:
+                self.publish_status_change(previous)
+        self._saved_status = self.status
+
+    def publish_status_change(self, previous):
+        """Tell the case's donors about a status change; call inside the transaction that saves it"""
+        publish('case.step_changed', self.case_id, {
+            'step_id': self.pk,
+            'title': self.title,
+            'from': previous,
+            'to': self.status,
+        })
+
 class BudgetItem(models.Model):
     CATEGORY_CHOICES = [
         ('hospital_fees', 'Hospital Fees'),
@@ -133,3 +184,40 @@ class MedicalRecord(models.Model):
 
 # Example usage in your view
 # budget_items = BudgetItem.objects.filter(case=selected_case, patient=selected_patient)
+
+class UploadSession(models.Model):
+    """Resumable, chunked upload that is attached to a record or case when complete"""
+    TARGET_CHOICES = [
+        ('medical_record', 'Medical Record'),
+        ('case_image', 'Case Image'),
+        ('case_photo', 'Case Photo'),
+    ]
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    case = models.ForeignKey(PatientCase, on_delete=models.CASCADE, related_name='upload_sessions')
+    record_type = models.CharField(max_length=20, choices=MedicalRecord.RECORD_TYPE_CHOICES, blank=True)
+    notes = models.TextField(blank=True, null=True)
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    received_bytes = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    medical_record = models.ForeignKey(MedicalRecord, on_delete=models.SET_NULL, null=True, blank=True)
+    error_message = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.filename} ({self.received_bytes}/{self.total_size})"
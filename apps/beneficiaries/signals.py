@@ -0,0 +1,33 @@
+"""
+Drop cached case pages when the data they show changes. Invalidation waits
+for the commit: done earlier, a concurrent request could cache the old rows
+again under the new tag version.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rhci_platform.cache_tags import HOME, case_tag, tagged_cache
+
+from .models import BudgetItem, Patient, PatientCase, TreatmentStep
+
+
+@receiver([post_save, post_delete], sender=PatientCase)
+def invalidate_case(sender, instance, using, **kwargs):
+    tag = case_tag(instance.pk)
+    transaction.on_commit(lambda: tagged_cache.invalidate(tag, HOME), using=using)
+
+
+@receiver([post_save, post_delete], sender=Patient)
+def invalidate_patient_cases(sender, instance, using, **kwargs):
+    case_ids = PatientCase.objects.using(using).filter(patient_id=instance.pk).values_list('pk', flat=True)
+    tags = [case_tag(pk) for pk in case_ids]
+    transaction.on_commit(lambda: tagged_cache.invalidate(*tags, HOME), using=using)
+
+
+@receiver([post_save, post_delete], sender=TreatmentStep)
+@receiver([post_save, post_delete], sender=BudgetItem)
+def invalidate_case_details(sender, instance, using, **kwargs):
+    if instance.case_id:
+        tag = case_tag(instance.case_id)
+        transaction.on_commit(lambda: tagged_cache.invalidate(tag), using=using)
@@ -1,3 +1,498 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.donations.models import Donation
+from core.models import OutboxEvent
+from rhci_platform.cache_tags import HOME, case_tag, tagged_cache
+
+from . import lifecycle
+from .models import MedicalRecord, Patient, PatientCase, TreatmentStep, UploadSession
+
+
+class CaseLifecycleTests(TestCase):
+    """Bulk status changes must cost the same few queries for 10 cases or 1,000"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser('staff', 'staff@example.com', 'pass')
+        cls.patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+
+    def create_cases(self, count, status='draft'):
+        cases = PatientCase.objects.bulk_create([
+            PatientCase(
+                patient=self.patient, title=f'Case {n}', story='-', diagnosis='-',
+                hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+                start_date=date.today(), end_date=date.today() + timedelta(days=30),
+                status=status,
+            )
+            for n in range(count)
+        ])
+        return PatientCase.objects.filter(pk__in=[case.pk for case in cases])
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as ctx:
+            func()
+        return len(ctx.captured_queries)
+
+    def test_publish_issues_constant_queries(self):
+        few, many = self.create_cases(10), self.create_cases(1000)
+        expected = self.count_queries(lambda: lifecycle.transition(few, 'published'))
+        with self.assertNumQueries(expected):
+            moved = lifecycle.transition(many, 'published')
+
+        self.assertEqual(moved, 1000)
+        self.assertFalse(many.exclude(status='published').exists())
+        self.assertFalse(many.filter(published_at__isnull=True).exists())
+        events = OutboxEvent.objects.filter(topic=lifecycle.STATUS_CHANGED)
+        self.assertEqual(events.count(), 2)
+        self.assertEqual(len(events.last().payload['cases']), 1000)
+
+    def test_admin_action_issues_constant_queries(self):
+        self.client.force_login(self.staff)
+        few, many = self.create_cases(10, status='pending'), self.create_cases(1000)
+
+        def publish(status, cases):
+            # "Select all" on the changelist filtered by status
+            data = {'action': 'published_cases', 'select_across': '1', 'index': '0',
+                    '_selected_action': [cases.first().pk]}
+            return lambda: self.client.post(f'/admin/beneficiaries/patientcase/?status__exact={status}', data)
+
+        self.assertEqual(self.count_queries(publish('pending', few)), self.count_queries(publish('draft', many)))
+        self.assertFalse(few.exclude(status='published').exists())
+        self.assertFalse(many.exclude(status='published').exists())
+
+    def test_only_allowed_transitions(self):
+        drafts = self.create_cases(3)
+        archived = self.create_cases(2, status='archived')
+        self.assertEqual(lifecycle.transition(drafts, 'paused'), 0)
+        self.assertEqual(lifecycle.transition(drafts | archived, 'published'), 3)
+        self.assertEqual(set(archived.values_list('status', flat=True)), {'archived'})
+
+    def test_republishing_keeps_published_at(self):
+        cases = self.create_cases(2)
+        lifecycle.transition(cases, 'published')
+        first = dict(cases.values_list('pk', 'published_at'))
+        lifecycle.transition(cases, 'paused')
+        lifecycle.transition(cases, 'published')
+        self.assertEqual(dict(cases.values_list('pk', 'published_at')), first)
+
+
+class CaseAutocompleteTests(TestCase):
+    """Case widgets match the title or the patient's names by prefix, or the id"""
+
+    URL = '/admin/autocomplete/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser('staff', 'staff@example.com', 'pass')
+        juma = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        mrisho = Patient.objects.create(
+            first_name='Baraka', last_name='Mrisho', dob=date(2012, 5, 1), gender='M',
+            city='Arusha', region='Arusha',
+        )
+        cls.cases = {}
+        for patient, title in [(juma, 'Heart surgery'), (mrisho, 'Hip replacement'), (mrisho, 'Cleft lip')]:
+            cls.cases[title] = PatientCase.objects.create(
+                patient=patient, title=title, story='-', diagnosis='-',
+                hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+                start_date=date.today(), end_date=date.today() + timedelta(days=30),
+                status='published',
+            )
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def search(self, term):
+        response = self.client.get(self.URL, {
+            'app_label': 'donations', 'model_name': 'donation', 'field_name': 'case', 'term': term})
+        self.assertEqual(response.status_code, 200)
+        return {int(result['id']) for result in response.json()['results']}
+
+    def ids(self, *titles):
+        return {self.cases[title].pk for title in titles}
+
+    def test_title_prefix_in_any_case(self):
+        self.assertEqual(self.search('HI'), self.ids('Hip replacement'))
+        self.assertEqual(self.search('h'), self.ids('Heart surgery', 'Hip replacement'))
+
+    def test_prefix_not_substring(self):
+        self.assertEqual(self.search('surgery'), set())
+
+    def test_patient_names(self):
+        self.assertEqual(self.search('mris'), self.ids('Hip replacement', 'Cleft lip'))
+        self.assertEqual(self.search('asha'), self.ids('Heart surgery'))
+
+    def test_numeric_term_matches_id(self):
+        case = self.cases['Cleft lip']
+        self.assertIn(case.pk, self.search(str(case.pk)))
+
+    def test_non_ascii_and_oversized_digits(self):
+        for term in ['\u00b2', '\u0663', '9' * 30]:
+            with self.subTest(term=term):
+                self.assertEqual(self.search(term), set())
+
+
+class MedicalRecordDeliveryTests(TestCase):
+    """Medical records reach staff, their uploader and the case's donors, and nobody else"""
+
+    CONTENT = bytes(range(256)) * 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pass', is_staff=True)
+        cls.uploader = User.objects.create_user('uploader', 'uploader@example.com', 'pass')
+        cls.donor = User.objects.create_user('donor', 'donor@example.com', 'pass')
+        cls.stranger = User.objects.create_user('stranger', 'stranger@example.com', 'pass')
+        patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        cls.case = PatientCase.objects.create(
+            patient=patient, title='Heart surgery', story='-', diagnosis='-',
+            hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            status='published',
+        )
+        Donation.objects.create(case=cls.case, donor=cls.donor, amount=Decimal('5000'),
+                                external_id='records', status='completed')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=directory.name, SENDFILE_BACKEND=''))
+        self.record = self.create_record('letter.pdf', self.CONTENT)
+
+    def create_record(self, name, content):
+        record = MedicalRecord(case=self.case, record_type='doctor_letter', uploaded_by=self.uploader)
+        record.file.save(name, ContentFile(content))
+        return record
+
+    def get(self, user, record=None, **headers):
+        if user:
+            self.client.force_login(user)
+        record = record or self.record
+        return self.client.get(reverse('medical_record_download', args=[record.pk]), **headers)
+
+    def test_allowed_users_get_the_file(self):
+        for user in [self.staff, self.uploader, self.donor]:
+            with self.subTest(user=user.username):
+                response = self.get(user)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+                self.assertEqual(response['Content-Type'], 'application/pdf')
+                self.assertEqual(response['Cache-Control'], 'private, no-store')
+                self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_others_cannot_tell_it_exists(self):
+        self.assertEqual(self.get(self.stranger).status_code, 404)
+        missing = reverse('medical_record_download', args=[self.record.pk + 100])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_anonymous_users_are_sent_to_login(self):
+        response = self.get(None)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login/', response['Location'])
+
+    def test_missing_file(self):
+        self.record.file.delete(save=False)
+        self.assertEqual(self.get(self.staff).status_code, 404)
+
+    def test_range_requests(self):
+        response = self.get(self.staff, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.CONTENT)}')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[10:20])
+
+        response = self.get(self.staff, HTTP_RANGE='bytes=-16')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-16:])
+
+        response = self.get(self.staff, HTTP_RANGE='bytes=1000-')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[1000:])
+
+        response = self.get(self.staff, HTTP_RANGE=f'bytes={len(self.CONTENT)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.CONTENT)}')
+
+        # Malformed ranges are ignored
+        response = self.get(self.staff, HTTP_RANGE='bytes=20-10')
+        self.assertEqual(response.status_code, 200)
+
+    def test_compressed_file_is_downloaded_as_is(self):
+        record = self.create_record('scans.tar.gz', b'\x1f\x8b compressed')
+        response = self.get(self.staff, record)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+
+    def test_legacy_media_path(self):
+        url = f'/media/{self.record.file.name}'
+        self.client.force_login(self.stranger)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get('/media/medical_records/missing.pdf').status_code, 404)
+
+        # Two records pointing at the same file
+        MedicalRecord.objects.create(case=self.case, record_type='id', file=self.record.file.name)
+        self.client.force_login(self.donor)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+@override_settings(CHUNKED_UPLOAD_MAX_CHUNK_SIZE=16, CHUNKED_UPLOAD_MAX_FILE_SIZE=64)
+class ChunkedUploadTests(TestCase):
+    """Uploads arrive in order, resume from the stored offset and are checked before use"""
+
+    CONTENT = b'0123456789abcdefghijklmnopqrstuvwxyz'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser('staff', 'staff@example.com', 'pass')
+        patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        cls.case = PatientCase.objects.create(
+            patient=patient, title='Heart surgery', story='-', diagnosis='-',
+            hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            status='published',
+        )
+
+    def setUp(self):
+        for setting in ('MEDIA_ROOT', 'CHUNKED_UPLOAD_DIR'):
+            directory = tempfile.TemporaryDirectory()
+            self.addCleanup(directory.cleanup)
+            self.enterContext(override_settings(**{setting: directory.name}))
+        self.client.force_login(self.staff)
+
+    def create(self, content=CONTENT, **overrides):
+        data = {'filename': 'letter.pdf', 'total_size': len(content), 'case_id': self.case.pk,
+                'sha256': hashlib.sha256(content).hexdigest(), 'record_type': 'doctor_letter', **overrides}
+        return self.client.post(reverse('upload_create'), json.dumps(data), content_type='application/json')
+
+    def start(self, content=CONTENT, **overrides):
+        response = self.create(content, **overrides)
+        self.assertEqual(response.status_code, 201)
+        return response.json()['upload_id']
+
+    def put(self, upload_id, start, chunk, total=len(CONTENT), end=None):
+        end = start + len(chunk) - 1 if end is None else end
+        return self.client.put(
+            reverse('upload_chunk', args=[upload_id]), chunk, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{total}')
+
+    def complete(self, upload_id):
+        return self.client.post(reverse('upload_complete', args=[upload_id]))
+
+    def test_upload_in_chunks(self):
+        upload_id = self.start()
+        for start in range(0, len(self.CONTENT), 16):
+            response = self.put(upload_id, start, self.CONTENT[start:start + 16])
+            self.assertEqual(response.json()['offset'], min(start + 16, len(self.CONTENT)))
+        response = self.complete(upload_id)
+        self.assertEqual(response.json()['status'], 'completed')
+        record = MedicalRecord.objects.get(pk=response.json()['medical_record_id'])
+        with record.file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.CONTENT)
+        self.assertEqual(record.uploaded_by, self.staff)
+
+    def test_chunks_must_not_leave_a_gap(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.CONTENT[:10])
+        response = self.put(upload_id, 20, self.CONTENT[20:30])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 10)
+
+    def test_resume_from_reported_offset(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.CONTENT[:10])
+        status = self.client.get(reverse('upload_chunk', args=[upload_id])).json()
+        self.assertEqual(status['offset'], 10)
+        # A retried chunk overlapping what was received only adds its new tail
+        self.assertEqual(self.put(upload_id, 4, self.CONTENT[4:20]).json()['offset'], 20)
+        self.put(upload_id, 20, self.CONTENT[20:])
+        self.assertEqual(self.complete(upload_id).json()['status'], 'completed')
+
+    def test_complete_before_all_bytes_arrive(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.CONTENT[:10])
+        self.assertEqual(self.complete(upload_id).status_code, 409)
+
+    def test_size_limits(self):
+        self.assertEqual(self.create(b'x' * 65).status_code, 413)
+        upload_id = self.start()
+        self.assertEqual(self.put(upload_id, 0, self.CONTENT[:17]).status_code, 413)
+        self.assertEqual(self.put(upload_id, 0, self.CONTENT[:16], total=40).status_code, 400)
+        self.put(upload_id, 0, self.CONTENT[:16])
+        self.put(upload_id, 16, self.CONTENT[16:32])
+        self.assertEqual(self.put(upload_id, 32, b'xyz!-', end=36).status_code, 400)
+        self.assertEqual(self.client.get(reverse('upload_chunk', args=[upload_id])).json()['offset'], 32)
+
+    def test_checksum_mismatch_fails_the_upload(self):
+        upload_id = self.start(sha256=hashlib.sha256(b'something else').hexdigest())
+        for start in range(0, len(self.CONTENT), 16):
+            self.put(upload_id, start, self.CONTENT[start:start + 16])
+        response = self.complete(upload_id)
+        self.assertEqual(response.status_code, 422)
+        session = UploadSession.objects.get(pk=upload_id)
+        self.assertEqual((session.status, session.error_message), ('failed', 'Checksum mismatch'))
+        # The assembled file is thrown away and the session cannot continue
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_DIR), [])
+        self.assertFalse(MedicalRecord.objects.exists())
+        self.assertEqual(self.put(upload_id, 0, self.CONTENT[:16]).status_code, 409)
+
+    def test_invalid_case_id(self):
+        for case_id in ['abc', None, [1]]:
+            with self.subTest(case_id=case_id):
+                self.assertEqual(self.create(case_id=case_id).status_code, 400)
+        self.assertEqual(self.create(case_id=self.case.pk + 100).status_code, 404)
+
+    def test_body_must_be_a_json_object(self):
+        for body in [b'[]', b'"x"', b'3', b'null', b'{', b'\xff']:
+            with self.subTest(body=body):
+                response = self.client.post(reverse('upload_create'), body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_permission_required(self):
+        self.client.force_login(User.objects.create_user('donor', 'donor@example.com', 'pass'))
+        self.assertEqual(self.create().status_code, 403)
+
+
+class CacheInvalidationTests(TestCase):
+    """Cached case pages are dropped when the change commits, not before"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        cls.case = PatientCase.objects.create(
+            patient=cls.patient, title='Heart surgery', story='-', diagnosis='-',
+            hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+        )
+        cls.step = TreatmentStep.objects.create(
+            case=cls.case, title='Admission', description='-', planned_date=date(2026, 1, 1), order_index=0)
+
+    def assertInvalidatedOnCommit(self, change, tags):
+        tagged_cache.set('page', 'old', tags)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+            self.assertEqual(tagged_cache.get('page', tags), 'old')
+        self.assertIsNone(tagged_cache.get('page', tags))
+
+    def test_case_patient_and_step_changes(self):
+        case_page = [case_tag(self.case.pk)]
+        changes = {
+            'case': (lambda: self.case.save(), case_page + [HOME]),
+            'patient': (lambda: self.patient.save(), case_page + [HOME]),
+            'step': (lambda: self.step.save(), case_page),
+            'step deleted': (lambda: TreatmentStep.objects.filter(pk=self.step.pk).get().delete(), case_page),
+        }
+        for name, (change, tags) in changes.items():
+            with self.subTest(change=name):
+                self.assertInvalidatedOnCommit(change, tags)
+
+
+class LazyInlineSaveTests(TestCase):
+    """A page of treatment steps is written in bulk but still invalidates and publishes like save()"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser('staff', 'staff@example.com', 'pass')
+        patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        cls.case, cls.other_case = PatientCase.objects.bulk_create([
+            PatientCase(
+                patient=patient, title=title, story='-', diagnosis='-',
+                hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+                start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            )
+            for title in ('Heart surgery', 'Hip surgery')
+        ])
+        cls.steps = TreatmentStep.objects.bulk_create([
+            TreatmentStep(case=cls.case, title=f'Step {n}', description='-',
+                          planned_date=date(2026, 1, n + 1), order_index=n)
+            for n in range(3)
+        ])
+        cls.other_step = TreatmentStep.objects.create(
+            case=cls.other_case, title='Other', description='-', planned_date=date(2026, 1, 1), order_index=0)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+        self.url = reverse('admin:beneficiaries_patientcase_inline', args=[self.case.pk, 'treatmentstep'])
+
+    def post(self, rows):
+        """Post (step, {field: value}) rows as the page's formset"""
+        data = {
+            'treatment_steps-TOTAL_FORMS': len(rows),
+            'treatment_steps-INITIAL_FORMS': len(rows),
+            'treatment_steps-MIN_NUM_FORMS': 0,
+            'treatment_steps-MAX_NUM_FORMS': 1000,
+        }
+        for n, (step, changes) in enumerate(rows):
+            fields = {
+                'id': step.pk, 'case': self.case.pk, 'title': step.title, 'description': step.description,
+                'planned_date': step.planned_date, 'actual_date': '', 'status': step.status,
+                'order_index': step.order_index, **changes,
+            }
+            data.update({f'treatment_steps-{n}-{name}': value for name, value in fields.items()})
+        return self.client.post(self.url, data)
+
+    def step_events(self):
+        return list(OutboxEvent.objects.filter(topic='case.step_changed').values_list('payload', flat=True))
+
+    def test_saving_a_page_invalidates_the_case(self):
+        tagged_cache.set('case-page', 'cached', [case_tag(self.case.pk)])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post([(step, {'title': f'{step.title}!'}) for step in self.steps])
+            self.assertEqual(response.status_code, 302)
+            # Not before the page's transaction commits
+            self.assertEqual(tagged_cache.get('case-page', [case_tag(self.case.pk)]), 'cached')
+        self.assertIsNone(tagged_cache.get('case-page', [case_tag(self.case.pk)]))
+        self.assertEqual(TreatmentStep.objects.filter(title__endswith='!').count(), 3)
+
+    def test_one_event_per_changed_status(self):
+        first, second, third = self.steps
+        response = self.post([
+            (first, {'status': 'in_progress'}),
+            (second, {'title': 'Renamed'}),
+            (third, {'status': 'delayed'}),
+        ])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.step_events(), [
+            {'step_id': first.pk, 'title': first.title, 'from': 'planned', 'to': 'in_progress'},
+            {'step_id': third.pk, 'title': third.title, 'from': 'planned', 'to': 'delayed'},
+        ])
+
+    def test_unchanged_page_publishes_nothing(self):
+        response = self.post([(step, {}) for step in self.steps])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.step_events(), [])
+
+    def test_rows_of_another_case_are_rejected(self):
+        response = self.post([(self.steps[0], {}), (self.other_step, {'title': 'Hijacked', 'status': 'completed'})])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['inline_admin_formset'].formset.errors[1])
+        self.other_step.refresh_from_db()
+        self.assertEqual((self.other_step.title, self.other_step.status), ('Other', 'planned'))
+        self.assertEqual(self.step_events(), [])
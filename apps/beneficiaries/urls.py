@@ -4,4 +4,8 @@ from . import views
 urlpatterns = [
     path('patients/<int:patient_id>/', views.patient_detail, name='patient_detail'),
     path('cases/<int:case_id>/', views.case_detail, name='case_detail'),
+    path('records/<int:record_id>/file/', views.medical_record_download, name='medical_record_download'),
+    path('uploads/', views.upload_create, name='upload_create'),
+    path('uploads/<uuid:upload_id>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/complete/', views.upload_complete, name='upload_complete'),
 ]
\ No newline at end of file
@@ -1,9 +1,20 @@
+import json
+import logging
+import re
 from django.shortcuts import render, get_object_or_404
+from django.http import Http404, JsonResponse
+from django.db import transaction
+from django.views.decorators.http import require_http_methods
 from django.views.generic import ListView, CreateView
 from django.urls import reverse_lazy
 from django.contrib.auth.decorators import login_required
-from .models import MedicalRecord, PatientCase, Patient
+from django.conf import settings
+from .models import MedicalRecord, PatientCase, Patient, UploadSession
 from collections import defaultdict
+from services import chunked_upload
+from services.file_delivery import serve_file
+
+logger = logging.getLogger(__name__)
 
 class MedicalRecordListView(ListView):
     model = MedicalRecord
@@ -16,6 +27,164 @@ class MedicalRecordCreateView(CreateView):
     template_name = 'beneficiaries/medicalrecord_form.html'
     success_url = reverse_lazy('medicalrecord-list')
 
+def can_view_medical_record(user, record):
+    """Staff, the uploader and donors to the case may read a medical record"""
+    if not user.is_authenticated:
+        return False
+    if user.is_staff or user.has_perm('beneficiaries.view_medicalrecord'):
+        return True
+    if record.uploaded_by_id == user.id:
+        return True
+    return record.case.donations.filter(donor=user).exists()
+
+@login_required
+def medical_record_download(request, record_id):
+    """Permission-checked, streamed download of a medical record file"""
+    record = get_object_or_404(MedicalRecord.objects.select_related('case'), id=record_id)
+    if not can_view_medical_record(request.user, record):
+        # Do not reveal that the record exists
+        raise Http404("Medical record not found")
+    return serve_file(request, record.file, as_attachment=request.GET.get('download') == '1')
+
+@login_required
+def medical_record_media(request, name):
+    """Route legacy /media/medical_records/ links through the permission check"""
+    # Nothing stops two records sharing a path; access is checked against the oldest
+    record = MedicalRecord.objects.filter(file=f'medical_records/{name}').order_by('id').first()
+    if record is None:
+        raise Http404("Medical record not found")
+    return medical_record_download(request, record.id)
+
+UPLOAD_TARGET_PERMISSIONS = {
+    'medical_record': 'beneficiaries.add_medicalrecord',
+    'case_image': 'beneficiaries.change_patientcase',
+    'case_photo': 'beneficiaries.change_patientcase',
+}
+
+def _upload_status(session):
+    return {
+        'success': True,
+        'upload_id': str(session.id),
+        'status': session.status,
+        'offset': session.received_bytes,
+        'total_size': session.total_size,
+        'medical_record_id': session.medical_record_id,
+    }
+
+@login_required
+@require_http_methods(["POST"])
+def upload_create(request):
+    """Open a resumable upload session for a medical record or case image"""
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        # JSONDecodeError, or UnicodeDecodeError for a body that is not UTF-8
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'success': False, 'error': 'Expected a JSON object'}, status=400)
+
+    target = data.get('target', 'medical_record')
+    permission = UPLOAD_TARGET_PERMISSIONS.get(target)
+    if permission is None:
+        return JsonResponse({'success': False, 'error': 'Unknown upload target'}, status=400)
+    if not request.user.has_perm(permission):
+        return JsonResponse({'success': False, 'error': 'Permission denied'}, status=403)
+
+    filename = str(data.get('filename') or '').rsplit('/', 1)[-1].rsplit('\\', 1)[-1]
+    sha256 = str(data.get('sha256') or '').lower()
+    try:
+        total_size = int(data.get('total_size'))
+    except (TypeError, ValueError):
+        total_size = 0
+    if not filename or total_size <= 0 or not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        return JsonResponse({
+            'success': False,
+            'error': 'filename, total_size and sha256 are required'
+        }, status=400)
+    if total_size > settings.CHUNKED_UPLOAD_MAX_FILE_SIZE:
+        return JsonResponse({'success': False, 'error': 'File too large'}, status=413)
+
+    record_type = data.get('record_type', '')
+    if target == 'medical_record' and record_type not in dict(MedicalRecord.RECORD_TYPE_CHOICES):
+        return JsonResponse({'success': False, 'error': 'Invalid record type'}, status=400)
+
+    try:
+        case_id = int(data.get('case_id'))
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'case_id must be a case id'}, status=400)
+    case = get_object_or_404(PatientCase, id=case_id)
+    session = UploadSession.objects.create(
+        user=request.user,
+        target=target,
+        case=case,
+        record_type=record_type if target == 'medical_record' else '',
+        notes=data.get('notes'),
+        filename=filename,
+        total_size=total_size,
+        sha256=sha256,
+    )
+    return JsonResponse({
+        **_upload_status(session),
+        'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+    }, status=201)
+
+@login_required
+@require_http_methods(["GET", "PUT"])
+def upload_chunk(request, upload_id):
+    """GET reports the resume offset; PUT appends one chunk (Content-Range required)"""
+    if request.method == 'GET':
+        session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+        return JsonResponse(_upload_status(session))
+
+    with transaction.atomic():
+        session = get_object_or_404(
+            UploadSession.objects.select_for_update(), id=upload_id, user=request.user
+        )
+        if session.status != 'active':
+            return JsonResponse({'success': False, 'error': f'Upload is {session.status}'}, status=409)
+        try:
+            start, end, total = chunked_upload.parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+            session.received_bytes = chunked_upload.write_chunk(session, request, start, end, total)
+        except chunked_upload.UploadError as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e),
+                'offset': session.received_bytes,
+            }, status=e.status)
+        session.save(update_fields=['received_bytes', 'updated_at'])
+    return JsonResponse(_upload_status(session))
+
+@login_required
+@require_http_methods(["POST"])
+def upload_complete(request, upload_id):
+    """Verify the checksum and attach the assembled file to its record or case"""
+    with transaction.atomic():
+        session = get_object_or_404(
+            UploadSession.objects.select_for_update().select_related('case'),
+            id=upload_id, user=request.user
+        )
+        if session.status == 'completed':
+            return JsonResponse(_upload_status(session))
+        try:
+            path = chunked_upload.verify(session)
+        except chunked_upload.UploadError as e:
+            if e.status == 422:
+                # Corrupt assembly cannot be resumed; the client must start over
+                chunked_upload.discard(session)
+                session.status = 'failed'
+                session.error_message = str(e)
+                session.save(update_fields=['status', 'error_message', 'updated_at'])
+            return JsonResponse({
+                'success': False,
+                'error': str(e),
+                'offset': session.received_bytes,
+            }, status=e.status)
+        chunked_upload.attach(session, path)
+        session.status = 'completed'
+        session.save(update_fields=['status', 'medical_record', 'updated_at'])
+    logger.info(f"Upload {session.id} completed ({session.total_size} bytes)")
+    return JsonResponse(_upload_status(session))
+
 def home(request):
     cases = PatientCase.objects.filter(status='published')
     print("DEBUG: Published cases count:", cases.count())
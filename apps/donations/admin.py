@@ -1,10 +1,11 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
+from rhci_platform.changelists import FastChangeListMixin, IndexedValuesListFilter
 from .models import Donation, Receipt, PaymentCallback
 
 @admin.register(Donation)
-class DonationAdmin(admin.ModelAdmin):
+class DonationAdmin(FastChangeListMixin, admin.ModelAdmin):
     list_display = [
         'external_id', 
         'donor_name_display',
@@ -14,13 +15,19 @@ class DonationAdmin(admin.ModelAdmin):
         'status',
         'created_at'
     ]
+    # donor_name_display and patient_link read these on every row
+    list_select_related = ['donor', 'case__patient']
     
+    # Each filter has an index on (field, created_at) matching the list order
     list_filter = [
         'status',
         'payment_channel',
         'created_at',
-        'currency'
+        ('currency', IndexedValuesListFilter)
     ]
+    date_hierarchy = 'created_at'
+    # Donor and case widgets search by prefix instead of listing every user and case
+    autocomplete_fields = ['donor', 'case']
     
     search_fields = [
         'external_id',
@@ -97,6 +104,7 @@ class DonationAdmin(admin.ModelAdmin):
 @admin.register(Receipt)
 class ReceiptAdmin(admin.ModelAdmin):
     list_display = ['receipt_number', 'donation_link', 'amount', 'currency', 'generated_at']
+    list_select_related = ['donation']
     search_fields = ['receipt_number', 'donation__external_id']
     readonly_fields = ['receipt_number', 'generated_at', 'donation', 'amount', 'currency']
     
@@ -108,15 +116,22 @@ class ReceiptAdmin(admin.ModelAdmin):
     donation_link.short_description = "Donation"
 
 @admin.register(PaymentCallback)
-class PaymentCallbackAdmin(admin.ModelAdmin):
+class PaymentCallbackAdmin(FastChangeListMixin, admin.ModelAdmin):
     list_display = [
-        'donation',
+        'donation_link',
         'transaction_status',
         'amount',
         'operator',
         'received_at'
     ]
-    list_filter = ['transaction_status', 'operator', 'received_at']
+    list_select_related = ['donation']
+    # Each filter has an index on (field, received_at) matching the list order
+    list_filter = [
+        ('transaction_status', IndexedValuesListFilter),
+        ('operator', IndexedValuesListFilter),
+        'received_at'
+    ]
+    date_hierarchy = 'received_at'
     search_fields = [
         'donation__external_id',
         'msisdn',
@@ -137,4 +152,9 @@ class PaymentCallbackAdmin(admin.ModelAdmin):
         'fsp_reference_id',
         'raw_payload',
         'received_at'
-    ]
\ No newline at end of file
+    ]
+
+    def donation_link(self, obj):
+        url = reverse('admin:donations_donation_change', args=[obj.donation_id])
+        return format_html('<a href="{}">{}</a>', url, obj.donation.external_id)
+    donation_link.short_description = "Donation"
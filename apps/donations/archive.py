@@ -0,0 +1,167 @@
+"""
+Archival of old payment callbacks and donation payloads.
+
+PaymentCallback rows, and the payment_data and callback_data of finished
+donations, stay in the database for CALLBACK_RETENTION_DAYS. archive() then
+moves them into gzip-compressed JSONL segment files in CALLBACK_ARCHIVE_DIR:
+
+- A segment is written once, under a temporary name that is then renamed,
+  and never changed. It is a run of gzip members of up to SEGMENT_BLOCK
+  lines each, so `zcat` reads a whole segment and a lookup decompresses one
+  member.
+- Once a segment is in place, one transaction inserts an ArchivedRecord per
+  record (utility_ref -> segment, offset, length), deletes the archived
+  callbacks and empties the archived payloads. A run that stops in between
+  leaves an unreferenced segment and the rows still in the database; the
+  next run archives them again.
+
+callbacks_for() and donation_payloads() read database and archived records
+alike.
+"""
+import gzip
+import json
+import os
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from rhci_platform.transactions import write_transaction
+
+from .models import ArchivedRecord, Donation, PaymentCallback
+
+# Lines per gzip member: a lookup decompresses one member of this many records
+SEGMENT_BLOCK = 256
+ARCHIVE_BATCH = 10_000
+# Donations still waiting for a callback keep their payloads
+FINISHED_STATUSES = ('completed', 'failed', 'refunded')
+
+ArchiveResult = namedtuple('ArchiveResult', 'callbacks donations segments bytes')
+
+
+def _archive_dir():
+    return settings.CALLBACK_ARCHIVE_DIR
+
+
+def write_segment(kind, records):
+    """
+    Write a new segment of `records` (dicts); returns its file name, its
+    size and the (offset, length) of the gzip member holding each record
+    """
+    name = f"{kind}-{timezone.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+    os.makedirs(_archive_dir(), exist_ok=True)
+    path = os.path.join(_archive_dir(), name)
+    locations = []
+    with open(f'{path}.tmp', 'wb') as f:
+        for start in range(0, len(records), SEGMENT_BLOCK):
+            block = records[start:start + SEGMENT_BLOCK]
+            data = gzip.compress(''.join(json.dumps(record, default=str) + '\n' for record in block).encode())
+            locations.extend([(f.tell(), len(data))] * len(block))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(f'{path}.tmp', path)
+    return name, size, locations
+
+
+def read_block(segment, offset, length):
+    """The records of one gzip member of a segment"""
+    with open(os.path.join(_archive_dir(), segment), 'rb') as f:
+        f.seek(offset)
+        data = gzip.decompress(f.read(length))
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+
+def _callback_record(callback):
+    return {field.attname: getattr(callback, field.attname) for field in PaymentCallback._meta.concrete_fields}
+
+
+def archive_callbacks(cutoff, batch_size=ARCHIVE_BATCH):
+    """Move callbacks received before `cutoff` to segments; returns (callbacks, segments, bytes)"""
+    old = PaymentCallback.objects.filter(received_at__lt=cutoff).order_by('received_at', 'pk')
+    archived = segments = written = 0
+    while batch := list(old[:batch_size]):
+        records = [_callback_record(callback) for callback in batch]
+        segment, size, locations = write_segment('callback', records)
+        with write_transaction():
+            ArchivedRecord.objects.bulk_create([
+                ArchivedRecord(kind='callback', utility_ref=callback.utility_ref, recorded_at=callback.received_at,
+                               segment=segment, offset=offset, length=length)
+                for callback, (offset, length) in zip(batch, locations)
+            ])
+            PaymentCallback.objects.filter(pk__in=[callback.pk for callback in batch]).delete()
+        archived, segments, written = archived + len(batch), segments + 1, written + size
+    return archived, segments, written
+
+
+def archive_donation_payloads(cutoff, batch_size=ARCHIVE_BATCH):
+    """
+    Move payment_data and callback_data of finished donations created
+    before `cutoff` to segments; returns (donations, segments, bytes)
+    """
+    old = (Donation.objects.filter(created_at__lt=cutoff, status__in=FINISHED_STATUSES)
+           .exclude(payment_data={}, callback_data={}).order_by('created_at', 'pk')
+           .values('pk', 'external_id', 'created_at', 'payment_data', 'callback_data'))
+    archived = segments = written = 0
+    after = Q()
+    while batch := list(old.filter(after)[:batch_size]):
+        segment, size, locations = write_segment('donation', batch)
+        with write_transaction():
+            ArchivedRecord.objects.bulk_create([
+                ArchivedRecord(kind='donation', utility_ref=row['external_id'], recorded_at=row['created_at'],
+                               segment=segment, offset=offset, length=length)
+                for row, (offset, length) in zip(batch, locations)
+            ])
+            # update() leaves updated_at alone: archiving is not a change to the donation
+            Donation.objects.filter(pk__in=[row['pk'] for row in batch]).update(payment_data={}, callback_data={})
+        last = batch[-1]
+        after = Q(created_at__gt=last['created_at']) | Q(created_at=last['created_at'], pk__gt=last['pk'])
+        archived, segments, written = archived + len(batch), segments + 1, written + size
+    return archived, segments, written
+
+
+def archive(days=None, batch_size=ARCHIVE_BATCH):
+    """Archive everything older than `days` (default CALLBACK_RETENTION_DAYS)"""
+    days = days if days is not None else settings.CALLBACK_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    callbacks, callback_segments, callback_bytes = archive_callbacks(cutoff, batch_size)
+    donations, donation_segments, donation_bytes = archive_donation_payloads(cutoff, batch_size)
+    return ArchiveResult(callbacks, donations, callback_segments + donation_segments, callback_bytes + donation_bytes)
+
+
+def _archived(kind, utility_ref):
+    """Archived records of `kind` for `utility_ref`, one read per gzip member holding any"""
+    blocks = (ArchivedRecord.objects.filter(utility_ref=utility_ref, kind=kind)
+              .values_list('segment', 'offset', 'length').distinct())
+    key = 'utility_ref' if kind == 'callback' else 'external_id'
+    return [record for block in blocks for record in read_block(*block) if record[key] == utility_ref]
+
+
+def callbacks_for(utility_ref):
+    """
+    Every callback for `utility_ref` (a donation's external_id), newest
+    first, whether in the database or archived. Archived ones are
+    PaymentCallback instances with `archived` set; they are not to be saved.
+    """
+    callbacks = list(PaymentCallback.objects.filter(utility_ref=utility_ref))
+    for record in _archived('callback', utility_ref):
+        callback = PaymentCallback(**{
+            field.attname: field.to_python(record[field.attname])
+            for field in PaymentCallback._meta.concrete_fields
+        })
+        callback.archived = True
+        callbacks.append(callback)
+    return sorted(callbacks, key=lambda callback: callback.received_at, reverse=True)
+
+
+def donation_payloads(donation):
+    """(payment_data, callback_data) of `donation`, from the archive once moved there"""
+    if donation.payment_data or donation.callback_data:
+        return donation.payment_data, donation.callback_data
+    for record in _archived('donation', donation.external_id):
+        return record['payment_data'], record['callback_data']
+    return donation.payment_data, donation.callback_data
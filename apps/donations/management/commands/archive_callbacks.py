@@ -0,0 +1,69 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.donations import archive
+from apps.donations.models import Donation, PaymentCallback
+
+
+def table_bytes(model):
+    """On-disk size of a model's table and its indexes"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                'SELECT SUM(pgsize) FROM dbstat WHERE name = %s '
+                'OR name IN (SELECT name FROM sqlite_master WHERE type = %s AND tbl_name = %s)',
+                [table, 'index', table])
+        else:
+            return None
+        return cursor.fetchone()[0] or 0
+
+
+def scan_seconds():
+    """A search of every callback and donation payload, as the admin's would do"""
+    started = time.perf_counter()
+    PaymentCallback.objects.filter(raw_payload__icontains='"success"').count()
+    Donation.objects.filter(payment_data__icontains='"success"').count()
+    return time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        "Move payment callbacks, and the payment_data and callback_data of "
+        "finished donations, older than CALLBACK_RETENTION_DAYS into "
+        "compressed segment files in CALLBACK_ARCHIVE_DIR. Run it from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help=f'Retention in days (default {settings.CALLBACK_RETENTION_DAYS})')
+        parser.add_argument('--batch-size', type=int, default=archive.ARCHIVE_BATCH)
+        parser.add_argument('--measure', action='store_true',
+                            help='Report table sizes and a full payload scan before and after')
+
+    def handle(self, *args, **options):
+        if options['measure']:
+            before = self.measure()
+        started = time.perf_counter()
+        result = archive.archive(options['days'], options['batch_size'])
+        self.stdout.write(
+            f"Archived {result.callbacks} callbacks and {result.donations} donation payloads "
+            f"into {result.segments} segments ({result.bytes / 1024 / 1024:.1f} MB, "
+            f"{time.perf_counter() - started:.1f}s)"
+        )
+        if options['measure']:
+            after = self.measure()
+            for label, old, new in zip(('Callback table', 'Donation table'), before[:2], after[:2]):
+                if old is not None:
+                    self.stdout.write(f"{label + ':':16}{old / 1024 / 1024:.1f} MB -> {new / 1024 / 1024:.1f} MB")
+            self.stdout.write(f"{'Payload scan:':16}{before[2] * 1000:.0f} ms -> {after[2] * 1000:.0f} ms")
+            if connection.vendor == 'sqlite':
+                self.stdout.write("SQLite keeps freed pages in the file until VACUUM.")
+
+    def measure(self):
+        return table_bytes(PaymentCallback), table_bytes(Donation), scan_seconds()
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from apps.beneficiaries.models import Patient, PatientCase
+from apps.donations.models import Donation, PaymentCallback, Receipt
+from core import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure write throughput of the AzamPay callback path "
+        "(PaymentCallback insert + Donation completion + outbox event) "
+        "against the configured default database. Creates its own fixture rows "
+        "and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--callbacks', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--cases', type=int, default=1,
+                            help='Spread donations over this many cases (1 = hot counter row)')
+        parser.add_argument('--readers', type=int, default=0,
+                            help='Reader threads running dashboard-style queries during the run')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        donor, patient, cases, refs = self.setup(tag, options)
+        try:
+            elapsed, errors, reads, read_errors = self.run(refs, options['threads'], options['readers'], cases)
+        finally:
+            self.teardown(donor, patient, cases)
+
+        total = len(refs)
+        vendor = connection.vendor
+        self.stdout.write(f"Backend:    {vendor} ({connection.settings_dict['NAME']})")
+        self.stdout.write(f"Callbacks:  {total} over {options['threads']} threads, {len(cases)} case(s)")
+        self.stdout.write(f"Elapsed:    {elapsed:.2f}s")
+        self.stdout.write(f"Throughput: {(total - errors) / elapsed:.1f} callbacks/s")
+        self.stdout.write(f"Errors:     {errors}")
+        if options['readers']:
+            self.stdout.write(f"Reads:      {reads / elapsed:.1f} queries/s over {options['readers']} threads, "
+                              f"{read_errors} errors")
+
+    def setup(self, tag, options):
+        donor = User.objects.create_user(f'bench-{tag}', f'bench-{tag}@example.com')
+        patient = Patient.objects.create(
+            first_name='Bench', last_name=tag, dob=date(2015, 1, 1), gender='O',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        cases = [
+            PatientCase.objects.create(
+                patient=patient, title=f'Benchmark {tag} #{n}', story='-', diagnosis='-',
+                hospital_name='-', doctor_name='-', target_amount=Decimal('100000000'),
+                start_date=date.today(), end_date=date.today() + timedelta(days=30),
+                status='published',
+            )
+            for n in range(max(options['cases'], 1))
+        ]
+        donations = [
+            Donation(
+                case=cases[n % len(cases)], donor=donor, amount=Decimal('1000'),
+                external_id=f'bench_{tag}_{n}', status='pending',
+            )
+            for n in range(options['callbacks'])
+        ]
+        Donation.objects.bulk_create(donations, batch_size=500)
+        return donor, patient, cases, [d.external_id for d in donations]
+
+    def run(self, refs, threads, readers, cases):
+        url = reverse('donations:callback')
+        errors = []
+        reads = []
+        read_errors = []
+        done = threading.Event()
+        case_ids = [c.id for c in cases]
+
+        def reader():
+            count = failed = 0
+            while not done.is_set():
+                try:
+                    list(PatientCase.objects.filter(status='published').select_related('patient')[:8])
+                    Donation.objects.filter(case_id__in=case_ids, status='completed').aggregate(Sum('amount'))
+                    count += 2
+                except OperationalError:
+                    failed += 1
+            reads.append(count)
+            read_errors.append(failed)
+            connections.close_all()
+
+        def worker(chunk):
+            client = Client()
+            failed = 0
+            for ref in chunk:
+                payload = {
+                    'utilityref': ref, 'msisdn': '255700000000', 'amount': '1000',
+                    'message': 'Success', 'operator': 'Mpesa', 'reference': ref,
+                    'transactionstatus': 'success', 'submerchantAcc': None,
+                    'fspReferenceId': ref,
+                }
+                response = client.post(url, json.dumps(payload), content_type='application/json')
+                if response.status_code != 200:
+                    failed += 1
+            errors.append(failed)
+            connections.close_all()
+
+        chunks = [refs[i::threads] for i in range(threads)]
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+            background = [threading.Thread(target=reader) for _ in range(readers)]
+            started = time.perf_counter()
+            for t in background + workers:
+                t.start()
+            for t in workers:
+                t.join()
+            elapsed = time.perf_counter() - started
+            done.set()
+            for t in background:
+                t.join()
+        return elapsed, sum(errors), sum(reads), sum(read_errors)
+
+    def teardown(self, donor, patient, cases):
+        # Deliver the run's events before their donor and cases go; the
+        # events stay, as the subscribers' cursors read the log in order
+        outbox.drain(settle=0)
+        donations = Donation.objects.filter(donor=donor)
+        PaymentCallback.objects.filter(donation__in=donations).delete()
+        Receipt.objects.filter(donation__in=donations).delete()
+        donations.delete()
+        PatientCase.objects.filter(id__in=[c.id for c in cases]).delete()
+        patient.delete()
+        donor.delete()
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.24 on 2026-10-19 05:06
+
+from django.db import migrations, models
+
+from rhci_platform.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('donations', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            index=models.Index(condition=models.Q(('status', 'completed')), fields=['case'], name='donation_case_completed_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.24 on 2026-10-19 05:09
+
+from django.db import migrations, models
+
+from rhci_platform.migration_operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('donations', '0002_partial_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            index=models.Index(fields=['donor', 'status', '-created_at'], name='donation_donor_status_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            index=models.Index(fields=['case', 'status'], name='donation_case_status_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            index=models.Index(fields=['currency'], name='donation_currency_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            index=models.Index(condition=models.Q(('status__in', ['initiated', 'pending'])), fields=['created_at'], name='donation_open_created_idx'),
+        ),
+    ]
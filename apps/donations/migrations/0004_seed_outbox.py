@@ -0,0 +1,48 @@
+from django.db import migrations
+
+SUBSCRIBERS = ['donations.case_totals', 'donations.receipts', 'donations.caches']
+BATCH_SIZE = 5000
+
+
+def seed_outbox(apps, schema_editor):
+    """
+    Start the event log with each existing donation's current status, so a
+    subscriber replayed from the beginning sees every donation. The current
+    subscribers already reflect these donations and start after them.
+    """
+    Donation = apps.get_model('donations', 'Donation')
+    OutboxEvent = apps.get_model('core', 'OutboxEvent')
+    OutboxCursor = apps.get_model('core', 'OutboxCursor')
+
+    rows = Donation.objects.order_by('created_at', 'id').values_list(
+        'id', 'status', 'case_id', 'donor_id', 'amount', 'currency')
+    batch = []
+    for donation_id, status, case_id, donor_id, amount, currency in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(OutboxEvent(topic='donation.status_changed', key=str(donation_id), payload={
+            'from': None, 'to': status, 'case_id': case_id, 'donor_id': donor_id,
+            'amount': str(amount), 'currency': currency,
+        }))
+        if len(batch) == BATCH_SIZE:
+            OutboxEvent.objects.bulk_create(batch)
+            batch = []
+    OutboxEvent.objects.bulk_create(batch)
+
+    head = OutboxEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    OutboxCursor.objects.bulk_create([OutboxCursor(subscriber=name, position=head) for name in SUBSCRIBERS])
+
+
+def unseed_outbox(apps, schema_editor):
+    apps.get_model('core', 'OutboxCursor').objects.filter(subscriber__in=SUBSCRIBERS).delete()
+    apps.get_model('core', 'OutboxEvent').objects.filter(topic='donation.status_changed').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_outbox'),
+        ('donations', '0003_donor_view_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_outbox, unseed_outbox),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def start_at_head(apps, schema_editor):
+    # Notify about payments from now on, not about every donation in the log
+    OutboxEvent = apps.get_model('core', 'OutboxEvent')
+    OutboxCursor = apps.get_model('core', 'OutboxCursor')
+    head = OutboxEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    OutboxCursor.objects.update_or_create(subscriber='donations.notifications', defaults={'position': head})
+
+
+def remove_cursor(apps, schema_editor):
+    apps.get_model('core', 'OutboxCursor').objects.filter(subscriber='donations.notifications').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('donations', '0004_seed_outbox'),
+        ('users', '0006_notifications'),
+    ]
+
+    operations = [
+        migrations.RunPython(start_at_head, remove_cursor),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.24 on 2026-10-19 06:56
+
+from django.db import migrations, models
+
+from rhci_platform.migration_operations import AddIndexConcurrentlyOnPostgres, RemoveIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('donations', '0005_start_notifications_subscriber'),
+    ]
+
+    # The replacements are built before the indexes they supersede are dropped
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            index=models.Index(fields=['status', '-created_at'], name='donation_status_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            index=models.Index(fields=['payment_channel', '-created_at'], name='donation_channel_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            index=models.Index(fields=['currency', '-created_at'], name='donation_currency_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='paymentcallback',
+            index=models.Index(fields=['received_at'], name='callback_received_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='paymentcallback',
+            index=models.Index(fields=['transaction_status', '-received_at'], name='callback_status_received_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='paymentcallback',
+            index=models.Index(fields=['operator', '-received_at'], name='callback_operator_received_idx'),
+        ),
+        RemoveIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            name='donations_d_status_73ca83_idx',
+        ),
+        RemoveIndexConcurrentlyOnPostgres(
+            model_name='donation',
+            name='donation_currency_idx',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.24 on 2026-10-19 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('donations', '0006_admin_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('callback', 'Payment callback'), ('donation', 'Donation payloads')], max_length=10)),
+                ('utility_ref', models.CharField(max_length=128)),
+                ('recorded_at', models.DateTimeField()),
+                ('segment', models.CharField(max_length=100)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['utility_ref', 'kind'], name='archived_ref_idx')],
+            },
+        ),
+    ]
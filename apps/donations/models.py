@@ -1,10 +1,13 @@
 from decimal import Decimal
-from django.db import models
+from django.db import models, router
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.conf import settings
 import uuid
 
+from core.outbox import publish
+from rhci_platform.transactions import write_transaction
+
 User = get_user_model()
 
 class Donation(models.Model):
@@ -73,8 +76,31 @@ class Donation(models.Model):
         indexes = [
             models.Index(fields=['external_id']),
             models.Index(fields=['azampay_transaction_id']),
-            models.Index(fields=['status']),
             models.Index(fields=['created_at']),
+            # Admin status and channel filters, newest first (also serve status-only lookups)
+            models.Index(fields=['status', '-created_at'], name='donation_status_created_idx'),
+            models.Index(fields=['payment_channel', '-created_at'], name='donation_channel_created_idx'),
+            # Donor dashboards: donor + status, newest first
+            models.Index(
+                fields=['donor', 'status', '-created_at'],
+                name='donation_donor_status_idx',
+            ),
+            # Per-case totals and supporter lists filtered by status
+            models.Index(fields=['case', 'status'], name='donation_case_status_idx'),
+            # Admin currency filter: distinct values, then newest first within one
+            models.Index(fields=['currency', '-created_at'], name='donation_currency_created_idx'),
+            # Reconciliation of payments still waiting for a callback
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(status__in=['initiated', 'pending']),
+                name='donation_open_created_idx',
+            ),
+            # Funded totals and supporter counts only look at completed donations
+            models.Index(
+                fields=['case'],
+                condition=models.Q(status='completed'),
+                name='donation_case_completed_idx',
+            ),
         ]
 
     def __str__(self):
@@ -86,19 +112,32 @@ class Donation(models.Model):
         
         if self.status == 'completed' and not self.completed_at:
             self.completed_at = timezone.now()
-            self.case.increment_amount_raised(self.amount)
-            
-        super().save(*args, **kwargs)
-
-        if self.status == 'completed':
-            Receipt.objects.get_or_create(
-                donation=self,
-                defaults={
-                    'receipt_number': f"RCP{self.created_at.strftime('%Y%m%d')}{str(self.id)[:8]}",
-                    'amount': self.amount,
-                    'currency': self.currency
-                }
-            )
+
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        update_fields = kwargs.get('update_fields')
+        writes_status = update_fields is None or 'status' in update_fields
+        # The status change and its outbox event commit together; the case
+        # counter, receipt and caches follow from the event
+        # (apps.donations.subscribers)
+        with write_transaction(using=using):
+            previous = None
+            if not self._state.adding and writes_status:
+                # Read the stored status under a row lock, so two concurrent
+                # callbacks cannot both see `pending` and both publish the
+                # same transition
+                previous = (type(self)._default_manager.using(using).select_for_update()
+                            .filter(pk=self.pk).values_list('status', flat=True).first())
+            changed = writes_status and self.status != previous
+            super().save(*args, **kwargs)
+            if changed:
+                publish('donation.status_changed', self.pk, {
+                    'from': previous,
+                    'to': self.status,
+                    'case_id': self.case_id,
+                    'donor_id': self.donor_id,
+                    'amount': str(self.amount),
+                    'currency': self.currency,
+                })
 
     def get_azampay_payload(self):
         """Generate AzamPay API payload based on payment channel"""
@@ -164,16 +203,49 @@ class PaymentCallback(models.Model):
             models.Index(fields=['utility_ref']),
             models.Index(fields=['reference']),
             models.Index(fields=['fsp_reference_id']),
+            # Admin changelist: newest first, date hierarchy, and its two filters
+            models.Index(fields=['received_at'], name='callback_received_idx'),
+            models.Index(fields=['transaction_status', '-received_at'], name='callback_status_received_idx'),
+            models.Index(fields=['operator', '-received_at'], name='callback_operator_received_idx'),
         ]
 
     def __str__(self):
         return f"Callback for {self.donation} - {self.transaction_status}"
 
     def save(self, *args, **kwargs):
-        if self.donation and self.transaction_status:
-            if self.transaction_status.lower() == 'success':
-                self.donation.status = 'completed'
-            elif self.transaction_status.lower() == 'failed':
-                self.donation.status = 'failed'
-            self.donation.save()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        # The callback row and the donation's status change commit together
+        with write_transaction(using=kwargs.get('using')):
+            if self.donation and self.transaction_status:
+                if self.transaction_status.lower() == 'success':
+                    self.donation.status = 'completed'
+                elif self.transaction_status.lower() == 'failed':
+                    self.donation.status = 'failed'
+                self.donation.save()
+            super().save(*args, **kwargs)
+
+class ArchivedRecord(models.Model):
+    """
+    Where an archived payment callback or donation's payloads are kept
+    (apps.donations.archive): the gzip member of `length` bytes at `offset`
+    in segment file `segment`, shared with the records archived beside it
+    """
+    KIND_CHOICES = [
+        ('callback', 'Payment callback'),
+        ('donation', 'Donation payloads'),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # PaymentCallback.utility_ref, or the donation's external_id
+    utility_ref = models.CharField(max_length=128)
+    # When the callback was received, or the donation created
+    recorded_at = models.DateTimeField()
+    segment = models.CharField(max_length=100)
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['utility_ref', 'kind'], name='archived_ref_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived {self.kind} {self.utility_ref} in {self.segment}"
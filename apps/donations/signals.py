@@ -0,0 +1,16 @@
+"""Drop cached donor dashboards and case pages once a donation change commits"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rhci_platform.cache_tags import case_tag, donor_tag, tagged_cache
+
+from .models import Donation
+
+
+@receiver([post_save, post_delete], sender=Donation)
+def invalidate_donation(sender, instance, using, **kwargs):
+    tags = [case_tag(instance.case_id)]
+    if instance.donor_id:
+        tags.append(donor_tag(instance.donor_id))
+    transaction.on_commit(lambda: tagged_cache.invalidate(*tags), using=using)
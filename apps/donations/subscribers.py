@@ -0,0 +1,160 @@
+"""
+Outbox subscribers for `donation.status_changed` events (see core.outbox).
+
+Each event carries the donation's previous and new status, so consumers
+work from the batch alone. They run in the dispatcher's transaction, never
+in the payment request's.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.beneficiaries.models import PatientCase, TreatmentStep
+from apps.users.models import Notification
+from apps.users.notifications import send
+from core.outbox import publish, subscriber
+from core.tasks import enqueue
+from rhci_platform.cache_tags import HOME, case_tag, donor_tag, tagged_cache
+
+from .models import Donation, Receipt
+
+STATUS_CHANGED = 'donation.status_changed'
+CASE_FUNDED = 'case.funded'
+STEP_CHANGED = 'case.step_changed'
+STEP_LEVELS = {'completed': 'success', 'delayed': 'warning'}
+
+
+def completion_delta(event):
+    """What the event adds to its case's amount_raised"""
+    was_completed = event.payload['from'] == 'completed'
+    is_completed = event.payload['to'] == 'completed'
+    if is_completed == was_completed:
+        return Decimal('0')
+    amount = Decimal(event.payload['amount'])
+    return amount if is_completed else -amount
+
+
+def reset_case_totals():
+    """
+    Zero the totals for a replay. Cases whose completed donations no longer
+    reach the target lose funded_at, so they announce it again if they get
+    there; the rest keep it and are not announced twice.
+    """
+    raised = (Donation.objects.filter(case=OuterRef('pk'), status='completed').values('case')
+              .annotate(total=Sum('amount')).values('total'))
+    PatientCase.objects.filter(funded_at__isnull=False).annotate(
+        raised=Coalesce(Subquery(raised), Value(Decimal('0')),
+                        output_field=DecimalField(max_digits=12, decimal_places=2)),
+    ).filter(raised__lt=F('target_amount')).update(funded_at=None)
+    PatientCase.objects.update(amount_raised=Decimal('0'))
+
+
+@subscriber('donations.case_totals', topics=[STATUS_CHANGED], reset=reset_case_totals)
+def case_totals(events):
+    """
+    Keep PatientCase.amount_raised in step with completed donations, and
+    publish case.funded when a case reaches its target. Refunds that take a
+    case back below target clear funded_at, so reaching it again is news.
+    """
+    deltas = defaultdict(Decimal)
+    for event in events:
+        deltas[event.payload['case_id']] += completion_delta(event)
+    for case_id, delta in deltas.items():
+        if delta:
+            PatientCase.objects.filter(pk=case_id).update(amount_raised=F('amount_raised') + delta)
+    PatientCase.objects.filter(
+        pk__in=[case_id for case_id, delta in deltas.items() if delta < 0],
+        funded_at__isnull=False, amount_raised__lt=F('target_amount'),
+    ).update(funded_at=None)
+
+    funded = list(PatientCase.objects.filter(
+        pk__in=[case_id for case_id, delta in deltas.items() if delta > 0],
+        funded_at__isnull=True, amount_raised__gte=F('target_amount'),
+    ).values_list('pk', 'title'))
+    if funded:
+        PatientCase.objects.filter(pk__in=[pk for pk, title in funded]).update(funded_at=timezone.now())
+        for pk, title in funded:
+            publish(CASE_FUNDED, pk, {'title': title})
+
+
+@subscriber('donations.receipts', topics=[STATUS_CHANGED])
+def receipts(events):
+    """Issue a receipt for each donation that is still completed; safe to replay"""
+    ids = {event.key for event in events if event.payload['to'] == 'completed'}
+    if not ids:
+        return
+    issued = set(Receipt.objects.filter(donation_id__in=ids).values_list('donation_id', flat=True))
+    Receipt.objects.bulk_create([
+        Receipt(
+            donation=donation,
+            receipt_number=f"RCP{donation.created_at.strftime('%Y%m%d')}{str(donation.id)[:8]}",
+            amount=donation.amount,
+            currency=donation.currency,
+        )
+        for donation in Donation.objects.filter(pk__in=ids, status='completed')
+        if donation.pk not in issued
+    ])
+
+
+@subscriber('donations.caches', topics=[STATUS_CHANGED])
+def caches(events):
+    """Drop cached pages that show the new totals once the batch commits"""
+    tags = set()
+    for event in events:
+        tags.add(case_tag(event.payload['case_id']))
+        if event.payload['donor_id']:
+            tags.add(donor_tag(event.payload['donor_id']))
+        if completion_delta(event):
+            tags.add(HOME)
+    transaction.on_commit(lambda: tagged_cache.invalidate(*tags))
+
+
+def payment_notification(event, titles):
+    amount = f"{Decimal(event.payload['amount']):,.0f} {event.payload['currency']}"
+    title = titles.get(event.payload['case_id'], 'the case')
+    if event.payload['to'] == 'completed':
+        message, level = f"Thank you! Your donation of {amount} to {title} was received.", 'success'
+    else:
+        message, level = f"Your payment of {amount} for {title} did not go through.", 'danger'
+    return Notification(
+        user_id=event.payload['donor_id'], kind='payment', level=level, message=message,
+        url=reverse('core:patient_detail', args=[event.payload['case_id']]),
+    )
+
+
+@subscriber('donations.notifications', topics=[STATUS_CHANGED, CASE_FUNDED, STEP_CHANGED])
+def notifications(events):
+    """
+    Tell the donor how their payment went. News about a case goes to all
+    of its donors, in the app and by email, through the task queue, so a
+    case with thousands of them does not hold up the outbox.
+    """
+    payments = [event for event in events if event.topic == STATUS_CHANGED
+                and event.payload['to'] in ('completed', 'failed') and event.payload['donor_id']]
+    case_ids = {event.payload['case_id'] for event in payments}
+    case_ids.update(int(event.key) for event in events if event.topic == STEP_CHANGED)
+    titles = dict(PatientCase.objects.filter(pk__in=case_ids).values_list('pk', 'title')) if case_ids else {}
+    send([payment_notification(event, titles) for event in payments])
+
+    step_statuses = dict(TreatmentStep.STATUS_CHOICES)
+    for event in events:
+        if event.topic == CASE_FUNDED:
+            enqueue('donations.notify_case_donors', {
+                'case_id': int(event.key), 'kind': 'case_funded', 'level': 'success',
+                'message': f"{event.payload['title']} is fully funded. Thank you for making it happen!",
+                'subject': f"{event.payload['title']} is fully funded",
+            })
+        elif event.topic == STEP_CHANGED:
+            title = titles.get(int(event.key), 'A case you support')
+            enqueue('donations.notify_case_donors', {
+                'case_id': int(event.key), 'kind': 'case_update',
+                'level': STEP_LEVELS.get(event.payload['to'], 'info'),
+                'message': f"{title}: {event.payload['title']} "
+                           f"is now {step_statuses.get(event.payload['to'], event.payload['to']).lower()}.",
+                'subject': f"Treatment update: {title}",
+            })
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import F
+from django.urls import reverse
+
+from apps.beneficiaries.models import PatientCase
+from apps.users.notifications import FAN_OUT_BATCH, notify_many
+from core import mail
+from core.models import OutboundEmail
+from core.tasks import enqueue, task
+from rhci_platform.cache_tags import HOME, case_tag, tagged_cache
+
+from .models import Donation, Receipt
+
+
+@task('donations.donation_completed')
+def donation_completed(donation_id):
+    """
+    Tasks of this name are no longer queued: the outbox subscribers in
+    apps.donations.subscribers took over. The handler stays for one release
+    so tasks queued before the upgrade still run. Their donations completed
+    before the outbox was seeded, so case_totals starts after them and
+    this task is what counts them; the receipt marks a donation as counted.
+    Remove it once no such tasks are queued.
+    """
+    donation = Donation.objects.filter(pk=donation_id, status='completed').first()
+    if donation is None:
+        return
+    receipt, created = Receipt.objects.get_or_create(
+        donation=donation,
+        defaults={
+            'receipt_number': f"RCP{donation.created_at.strftime('%Y%m%d')}{str(donation.id)[:8]}",
+            'amount': donation.amount,
+            'currency': donation.currency,
+        },
+    )
+    if created:
+        PatientCase.objects.filter(pk=donation.case_id).update(amount_raised=F('amount_raised') + donation.amount)
+        transaction.on_commit(lambda: tagged_cache.invalidate(case_tag(donation.case_id), HOME))
+
+
+@task('donations.notify_case_donors')
+def notify_case_donors(case_id, kind, message, level='info', after=0, subject=None):
+    """
+    Notify the next FAN_OUT_BATCH donors of a case (by user id, after
+    `after`) and queue a task for the rest, so each transaction stays short
+    and a retry repeats only its own batch. With a `subject` the update is
+    also queued as email to those donors, at bulk priority.
+    """
+    donors = list(
+        Donation.objects.filter(case_id=case_id, status='completed', donor_id__gt=after)
+        .order_by('donor_id').values_list('donor_id', flat=True).distinct()[:FAN_OUT_BATCH]
+    )
+    url = reverse('core:patient_detail', args=[case_id])
+    notify_many(donors, kind, message, level, url=url)
+    if subject and donors:
+        body = f"{message}\n\n{settings.SITE_URL}{url}\n"
+        mail.queue(
+            [EmailMessage(subject, body, to=[email])
+             for email in User.objects.filter(pk__in=donors).exclude(email='').values_list('email', flat=True)],
+            priority=OutboundEmail.PRIORITY_BULK,
+        )
+    if len(donors) == FAN_OUT_BATCH:
+        enqueue('donations.notify_case_donors', {
+            'case_id': case_id, 'kind': kind, 'message': message, 'level': level,
+            'after': donors[-1], 'subject': subject,
+        })
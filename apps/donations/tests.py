@@ -1,3 +1,420 @@
-from django.test import TestCase
+import asyncio
+import logging
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.beneficiaries.models import Patient, PatientCase
+from apps.users.models import Notification, Profile
+from core import outbox, tasks
+from core.models import OutboxEvent, Task
+from rhci_platform import asgi
+from rhci_platform.cache_tags import case_tag, donor_tag, tagged_cache
+from rhci_platform.testing import AzamPayStub, QueryBudgetTestMixin, full_scans
+
+from . import archive, views
+from . import tasks as donation_tasks
+from .models import ArchivedRecord, Donation, PaymentCallback, Receipt
+
+
+class DonorViewQueryPlanTests(TestCase):
+    """Donor and admin views must reach donations through an index, never a full scan"""
+
+    DONOR_VIEWS = ['donations:dashboard', 'donations:patients', 'donations:donations',
+                   'donations:payments', 'donations:notifications']
+    ADMIN_URLS = ['/admin/donations/donation/', '/admin/donations/paymentcallback/']
+    TABLES = {'donations_donation'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.donor = User.objects.create_user('donor', 'donor@example.com', 'pass')
+        Profile.objects.create(user=cls.donor, is_donor=True, donor_type='Individual')
+        cls.staff = User.objects.create_superuser('staff', 'staff@example.com', 'pass')
+        patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        case = PatientCase.objects.create(
+            patient=patient, title='Heart surgery', story='-', diagnosis='-',
+            hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            status='published',
+        )
+        for n, status in enumerate(['completed', 'pending', 'failed']):
+            Donation.objects.create(case=case, donor=cls.donor, amount=Decimal('5000'),
+                                    external_id=f'plan_{n}', status=status)
+
+    def assertNoFullScans(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        offenders = full_scans(ctx.captured_queries, self.TABLES)
+        self.assertFalse(offenders, '\n\n'.join(
+            f"{sql}\n  -> {' | '.join(plan)}" for sql, plan in offenders
+        ))
+
+    def test_donor_views(self):
+        self.client.force_login(self.donor)
+        for name in self.DONOR_VIEWS:
+            with self.subTest(view=name):
+                self.assertNoFullScans(reverse(name))
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.staff)
+        for url in self.ADMIN_URLS:
+            with self.subTest(url=url):
+                self.assertNoFullScans(url)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    """Donor and admin pages must stay within their query budgets as rows grow"""
+
+    DONOR_VIEWS = DonorViewQueryPlanTests.DONOR_VIEWS
+    ADMIN_URLS = DonorViewQueryPlanTests.ADMIN_URLS + ['/admin/donations/receipt/']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.donor = User.objects.create_user('donor', 'donor@example.com', 'pass')
+        Profile.objects.create(user=cls.donor, is_donor=True, donor_type='Individual')
+        cls.staff = User.objects.create_superuser('staff', 'staff@example.com', 'pass')
+        for n in range(5):
+            patient = Patient.objects.create(
+                first_name=f'Patient{n}', last_name='Test', dob=date(2015, 1, 1), gender='F',
+                city='Dar es Salaam', region='Dar es Salaam',
+            )
+            case = PatientCase.objects.create(
+                patient=patient, title=f'Case {n}', story='-', diagnosis='-',
+                hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+                start_date=date.today(), end_date=date.today() + timedelta(days=30),
+                status='published',
+            )
+            for m in range(4):
+                donation = Donation.objects.create(
+                    case=case, donor=cls.donor, amount=Decimal('5000'),
+                    external_id=f'budget_{n}_{m}', status='completed',
+                )
+                PaymentCallback.objects.create(
+                    donation=donation, msisdn='255700000000', amount=donation.amount,
+                    message='Success', utility_ref=donation.external_id, operator='Mpesa',
+                    reference=donation.external_id, transaction_status='success',
+                    raw_payload={},
+                )
+
+    def test_donor_views(self):
+        self.client.force_login(self.donor)
+        for name in self.DONOR_VIEWS:
+            with self.subTest(view=name):
+                response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinQueryBudget(response)
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.staff)
+        for url in self.ADMIN_URLS:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinQueryBudget(response)
+
+
+class DonationStatusEventTests(TestCase):
+    """Each status transition is published once, however many callbacks report it"""
+
+    @classmethod
+    def setUpTestData(cls):
+        donor = User.objects.create_user('donor', 'donor@example.com', 'pass')
+        patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        cls.case = PatientCase.objects.create(
+            patient=patient, title='Heart surgery', story='-', diagnosis='-',
+            hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            status='published',
+        )
+        cls.donation = Donation.objects.create(case=cls.case, donor=donor, amount=Decimal('5000'),
+                                               external_id='twice', status='pending')
+
+    def callback(self, donation, reference):
+        return PaymentCallback.objects.create(
+            donation=donation, msisdn='255700000000', amount='5000', message='Success',
+            utility_ref=donation.external_id, operator='Mpesa', reference=reference,
+            transaction_status='success', raw_payload={'utilityref': donation.external_id},
+        )
+
+    def test_duplicate_success_callbacks_count_once(self):
+        # Two requests that each loaded the donation while it was still pending
+        first, second = Donation.objects.get(pk=self.donation.pk), Donation.objects.get(pk=self.donation.pk)
+        self.callback(first, 'first')
+        self.callback(second, 'second')
+
+        completions = OutboxEvent.objects.filter(
+            topic='donation.status_changed', key=str(self.donation.pk), payload__to='completed')
+        self.assertEqual(completions.count(), 1)
+        self.assertEqual(completions.get().payload['from'], 'pending')
+        outbox.drain(settle=0)
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.amount_raised, Decimal('5000'))
+        self.assertEqual(Receipt.objects.filter(donation=self.donation).count(), 1)
+
+    def test_unchanged_status_publishes_nothing(self):
+        donation = Donation.objects.get(pk=self.donation.pk)
+        before = OutboxEvent.objects.count()
+        donation.message = 'Get well soon'
+        donation.save()
+        donation.save(update_fields=['message'])
+        self.assertEqual(OutboxEvent.objects.count(), before)
+
+    def test_cached_pages_are_dropped_on_commit(self):
+        tags = [case_tag(self.case.pk), donor_tag(self.donation.donor_id)]
+        tagged_cache.set('page', 'old', tags)
+        with self.captureOnCommitCallbacks(execute=True):
+            Donation.objects.get(pk=self.donation.pk).save()
+            self.assertEqual(tagged_cache.get('page', tags), 'old')
+        self.assertIsNone(tagged_cache.get('page', tags))
+
+    def set_status(self, status):
+        donation = Donation.objects.get(pk=self.donation.pk)
+        donation.status = status
+        donation.save(update_fields=['status'])
+        outbox.drain(settle=0)
+        self.case.refresh_from_db()
+
+    def funded_events(self):
+        return OutboxEvent.objects.filter(topic='case.funded', key=str(self.case.pk)).count()
+
+    def test_refund_below_target_lets_the_case_be_funded_again(self):
+        PatientCase.objects.filter(pk=self.case.pk).update(target_amount=Decimal('5000'))
+        self.set_status('completed')
+        self.assertIsNotNone(self.case.funded_at)
+        self.set_status('refunded')
+        self.assertEqual(self.case.amount_raised, Decimal('0'))
+        self.assertIsNone(self.case.funded_at)
+        self.set_status('completed')
+        self.assertIsNotNone(self.case.funded_at)
+        self.assertEqual(self.funded_events(), 2)
+
+    def test_replay_clears_funded_at_only_below_target(self):
+        PatientCase.objects.filter(pk=self.case.pk).update(target_amount=Decimal('5000'))
+        self.set_status('completed')
+        funded_at = self.case.funded_at
+
+        outbox.replay('donations.case_totals')
+        outbox.drain(settle=0)
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.amount_raised, Decimal('5000'))
+        self.assertEqual(self.case.funded_at, funded_at)
+        self.assertEqual(self.funded_events(), 1)
+
+        # Refunded without an event, e.g. by hand in the database
+        Donation.objects.filter(pk=self.donation.pk).update(status='refunded')
+        outbox.replay('donations.case_totals')
+        self.case.refresh_from_db()
+        self.assertIsNone(self.case.funded_at)
+
+    def test_task_queued_before_the_outbox_still_runs(self):
+        # The outbox starts after donations that completed before the upgrade
+        Donation.objects.filter(pk=self.donation.pk).update(status='completed')
+        for n in range(2):
+            tasks.enqueue('donations.donation_completed', {'donation_id': str(self.donation.pk)})
+        self.assertEqual([tasks.run(task) for task in tasks.claim('test')], ['done', 'done'])
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.amount_raised, Decimal('5000'))
+        self.assertEqual(Receipt.objects.filter(donation=self.donation).count(), 1)
+
+
+class NotifyCaseDonorsTests(TestCase):
+    """Case updates reach every donor once, FAN_OUT_BATCH donors per task"""
+
+    @classmethod
+    def setUpTestData(cls):
+        patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        cls.case = PatientCase.objects.create(
+            patient=patient, title='Heart surgery', story='-', diagnosis='-',
+            hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            status='published',
+        )
+        cls.donors = [User.objects.create_user(f'donor{n}', f'donor{n}@example.com', 'pass') for n in range(5)]
+        for n, donor in enumerate(cls.donors):
+            Donation.objects.create(case=cls.case, donor=donor, amount=Decimal('5000'),
+                                    external_id=f'fan_{n}', status='completed')
+        # A second gift does not mean a second notification; unpaid pledges get none
+        Donation.objects.create(case=cls.case, donor=cls.donors[0], amount=Decimal('5000'),
+                                external_id='fan_again', status='completed')
+        cls.pledger = User.objects.create_user('pledger', 'pledger@example.com', 'pass')
+        Donation.objects.create(case=cls.case, donor=cls.pledger, amount=Decimal('5000'),
+                                external_id='fan_pending', status='pending')
+
+    def follow_ups(self):
+        return Task.objects.filter(name='donations.notify_case_donors', status='queued')
+
+    @mock.patch.object(donation_tasks, 'FAN_OUT_BATCH', 2)
+    def test_large_fan_out_continues_after_the_last_donor(self):
+        donation_tasks.notify_case_donors(self.case.pk, 'case_update', 'Surgery done')
+        first_batch = [donor.pk for donor in self.donors[:2]]
+        self.assertCountEqual(Notification.objects.values_list('user_id', flat=True), first_batch)
+        follow_up = self.follow_ups().get()
+        self.assertEqual(follow_up.payload['after'], first_batch[-1])
+        self.assertEqual(follow_up.payload['message'], 'Surgery done')
+
+        while claimed := tasks.claim('test'):
+            self.assertEqual([tasks.run(task) for task in claimed], ['done'])
+        self.assertCountEqual(Notification.objects.values_list('user_id', flat=True),
+                              [donor.pk for donor in self.donors])
+        # Donors 3-4, then donor 5 alone, which ends the chain
+        self.assertEqual(Task.objects.filter(name='donations.notify_case_donors').count(), 2)
+        self.assertFalse(self.follow_ups().exists())
+
+    def test_small_fan_out_queues_nothing(self):
+        donation_tasks.notify_case_donors(self.case.pk, 'case_update', 'Surgery done')
+        self.assertEqual(Notification.objects.count(), len(self.donors))
+        self.assertFalse(self.follow_ups().exists())
+
+
+class AzamPayClientTests(TestCase):
+    """AzamPay clients are closed after each call under WSGI and shared under ASGI"""
+
+    def setUp(self):
+        cache.clear()
+        # The views and httpx log every AzamPay request at INFO
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.stub = AzamPayStub().__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        settings = override_settings(AZAMPAY_AUTH_BASE=self.stub.url, AZAMPAY_CHECKOUT_BASE=self.stub.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.clients = []
+
+        def new_client():
+            self.clients.append(new_client.wrapped())
+            return self.clients[-1]
+
+        new_client.wrapped = views._new_azampay_client
+        patcher = mock.patch.object(views, '_new_azampay_client', new_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_wsgi_requests_close_their_clients(self):
+        for category in ('mno', 'bank', 'card'):
+            response = self.client.get(reverse('donations:providers'), {'category': category})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['success'])
+        # A token and three partner lists, each over a client closed afterwards
+        self.assertEqual(len(self.clients), 4)
+        self.assertTrue(all(client.is_closed for client in self.clients))
+
+    def test_asgi_lifespan_shares_one_client(self):
+        async def serve():
+            events = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+            sent = []
+
+            async def receive():
+                message = next(events)
+                if message['type'] == 'lifespan.shutdown':
+                    # Requests handled between startup and shutdown
+                    await views.get_azampay_token()
+                    for _ in range(2):
+                        await views.get_with_retry(f'{self.stub.url}/api/v1/Partner/GetPaymentPartners', {})
+                    self.assertEqual(len(self.clients), 1)
+                    self.assertFalse(self.clients[0].is_closed)
+                return message
+
+            async def send(message):
+                sent.append(message['type'])
+
+            await asgi.application({'type': 'lifespan'}, receive, send)
+            return sent
+
+        sent = asyncio.run(serve())
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertEqual(len(self.clients), 1)
+        self.assertTrue(self.clients[0].is_closed)
+        self.assertIsNone(views._shared_azampay_client)
+
+
+class ArchiveTests(TestCase):
+    """Archived callbacks and payloads leave the hot tables but stay readable"""
+
+    @classmethod
+    def setUpTestData(cls):
+        donor = User.objects.create_user('donor', 'donor@example.com', 'pass')
+        patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        case = PatientCase.objects.create(
+            patient=patient, title='Heart surgery', story='-', diagnosis='-',
+            hospital_name='-', doctor_name='-', target_amount=Decimal('1000000'),
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            status='published',
+        )
+        old = timezone.now() - timedelta(days=400)
+        cls.donations = []
+        for n in range(3):
+            donation = Donation.objects.create(
+                case=case, donor=donor, amount=Decimal('5000'), external_id=f'archive_{n}',
+                status='completed', payment_data={'order': n}, callback_data={'status': 'completed'},
+            )
+            cls.donations.append(donation)
+            for attempt in range(2):
+                PaymentCallback.objects.create(
+                    donation=donation, msisdn='255700000000', amount='5000', message='Success',
+                    utility_ref=donation.external_id, operator='Mpesa',
+                    reference=f'{donation.external_id}_{attempt}', transaction_status='success',
+                    raw_payload={'utilityref': donation.external_id, 'attempt': attempt},
+                )
+        # Callbacks complete their donation: the third stays unfinished
+        Donation.objects.filter(external_id='archive_2').update(status='pending')
+        # The first donation and its callbacks are past retention; the second is recent
+        Donation.objects.filter(external_id__in=['archive_0', 'archive_2']).update(created_at=old)
+        PaymentCallback.objects.filter(utility_ref__in=['archive_0', 'archive_2']).update(received_at=old)
+        PaymentCallback.objects.filter(reference='archive_1_0').update(received_at=old)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(CALLBACK_ARCHIVE_DIR=directory.name))
+
+    def test_archive_moves_old_rows(self):
+        result = archive.archive(days=180, batch_size=2)
+
+        self.assertEqual((result.callbacks, result.donations), (5, 1))
+        self.assertEqual(list(PaymentCallback.objects.values_list('reference', flat=True)), ['archive_1_1'])
+        donations = {d.external_id: d for d in Donation.objects.all()}
+        self.assertEqual(donations['archive_0'].payment_data, {})
+        # Recent and unfinished donations keep their payloads
+        self.assertEqual(donations['archive_1'].payment_data, {'order': 1})
+        self.assertEqual(donations['archive_2'].payment_data, {'order': 2})
+        self.assertEqual(ArchivedRecord.objects.count(), 6)
+        self.assertEqual(archive.archive(days=180), (0, 0, 0, 0))
+
+    def test_lookup_reads_archive(self):
+        archive.archive(days=180, batch_size=2)
+
+        callbacks = archive.callbacks_for('archive_1')
+        self.assertEqual([c.reference for c in callbacks], ['archive_1_1', 'archive_1_0'])
+        self.assertFalse(hasattr(callbacks[0], 'archived'))
+        self.assertTrue(callbacks[1].archived)
+        self.assertEqual(callbacks[1].raw_payload, {'utilityref': 'archive_1', 'attempt': 0})
+        self.assertEqual(callbacks[1].donation_id, self.donations[1].pk)
+        self.assertEqual(len(archive.callbacks_for('archive_0')), 2)
+
+        archived = Donation.objects.get(external_id='archive_0')
+        self.assertEqual(archive.donation_payloads(archived), ({'order': 0}, {'status': 'completed'}))
+        recent = Donation.objects.get(external_id='archive_1')
+        self.assertEqual(archive.donation_payloads(recent), ({'order': 1}, {'status': 'completed'}))
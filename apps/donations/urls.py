@@ -19,5 +19,6 @@ urlpatterns = [
     path('discover/', views.DiscoveryView.as_view(), name='discover'),  # Added this line
     path('payments/', views.PaymentsView.as_view(), name='payments'),
     path('notifications/', views.NotificationsView.as_view(), name='notifications'),
+    path('notifications/read/', views.mark_notifications_read, name='notifications_read'),
     path('profile/', views.ProfileView.as_view(), name='profile'),
 ]
\ No newline at end of file
@@ -1,17 +1,20 @@
+import asyncio
 import json
 import logging
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import ssl
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import certifi
+import httpx
+from asgiref.sync import sync_to_async
 from decimal import Decimal
 from django.conf import settings
 from django.core.cache import cache
 from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
-from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 from django.views.generic import ListView, TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db import models
@@ -20,6 +23,16 @@ from django.utils import timezone
 from datetime import timedelta, datetime
 from .models import Donation, PaymentCallback
 from apps.beneficiaries.models import PatientCase
+from apps.users.models import Notification
+from apps.users.notifications import mark_read
+from rhci_platform.async_views import (
+    aget_object_or_404, aget_user, csrf_exempt, login_required as async_login_required,
+    require_http_methods,
+)
+from rhci_platform.cache_tags import donor_tag, tagged_cache
+from rhci_platform.db_routers import ReplicaReadMixin
+from rhci_platform.metrics import external_call
+from rhci_platform.transactions import write_transaction
 # Add to existing imports at the top
 from django.contrib import messages
 from django.urls import reverse_lazy
@@ -27,11 +40,57 @@ from django.urls import reverse_lazy
 
 logger = logging.getLogger(__name__)
 
-def get_azampay_token():
+# AzamPay answers worth retrying
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Opened and closed by the ASGI lifespan (rhci_platform.asgi)
+_shared_azampay_client = None
+
+@lru_cache(maxsize=None)
+def azampay_ssl_context():
+    """Loading the CA bundle takes ~30ms, so build the context once per process"""
+    return ssl.create_default_context(cafile=certifi.where())
+
+def _new_azampay_client():
+    # Transport retries cover connection failures
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(verify=azampay_ssl_context(), retries=3),
+        timeout=30,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+
+def open_azampay_client():
+    """Start sharing one client between requests; call on ASGI startup"""
+    global _shared_azampay_client
+    if _shared_azampay_client is None:
+        _shared_azampay_client = _new_azampay_client()
+
+async def close_azampay_client():
+    """Close the shared client; call on ASGI shutdown"""
+    global _shared_azampay_client
+    client, _shared_azampay_client = _shared_azampay_client, None
+    if client is not None:
+        await client.aclose()
+
+@asynccontextmanager
+async def azampay_client():
+    """
+    AsyncClient for AzamPay. Under ASGI every request runs on the server's
+    one event loop, so they share the client opened at startup and reuse its
+    keep-alive connections. Under WSGI each request gets a loop of its own,
+    so the client is opened and closed around the call.
+    """
+    if _shared_azampay_client is not None:
+        yield _shared_azampay_client
+        return
+    async with _new_azampay_client() as client:
+        yield client
+
+async def get_azampay_token():
     """Get access token from AzamPay with proper error handling"""
     
     # Try getting cached token first
-    cached_token = cache.get('azampay_token')
+    cached_token = await cache.aget('azampay_token')
     if cached_token:
         return cached_token
 
@@ -51,13 +110,14 @@ def get_azampay_token():
 
         logger.info(f"Requesting AzamPay token for app: {settings.AZAMPAY_APP_NAME}")
         
-        response = requests.post(
-            url, 
-            json=payload,
-            headers=headers, 
-            timeout=30,
-            verify=True
-        )
+        with external_call('azampay', 'token'):
+            async with azampay_client() as client:
+                response = await client.post(
+                    url, 
+                    json=payload,
+                    headers=headers, 
+                    timeout=30,
+                )
         
         # Log response for debugging
         logger.info(f"AzamPay response status: {response.status_code}")
@@ -84,18 +144,18 @@ def get_azampay_token():
                 expire = datetime.fromisoformat(expire_str.replace('Z', '+00:00'))
                 cache_duration = (expire - timezone.now()).total_seconds() - 300  # 5 minutes buffer
                 if cache_duration > 0:
-                    cache.set('azampay_token', token, int(cache_duration))
+                    await cache.aset('azampay_token', token, int(cache_duration))
             except Exception as e:
                 logger.warning(f"Could not parse token expiry: {e}")
                 # Fall back to default cache duration
-                cache.set('azampay_token', token, settings.AZAMPAY_TOKEN_CACHE_DURATION)
+                await cache.aset('azampay_token', token, settings.AZAMPAY_TOKEN_CACHE_DURATION)
         else:
             # Use default cache duration if no expiry provided
-            cache.set('azampay_token', token, settings.AZAMPAY_TOKEN_CACHE_DURATION)
+            await cache.aset('azampay_token', token, settings.AZAMPAY_TOKEN_CACHE_DURATION)
         
         return token
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Network error getting AzamPay token: {str(e)}")
         raise
     except Exception as e:
@@ -249,21 +309,17 @@ def make_donation(request, case_id):
     
     return render(request, 'donations/donate.html', context)
 
-def get_http_session():
-    """Create requests session with retry strategy"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=3,  # number of retries
-        backoff_factor=0.5,  # wait 0.5, 1, 2... seconds between retries
-        status_forcelist=[500, 502, 503, 504],  # retry on these status codes
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+async def get_with_retry(url, headers, retries=3):
+    """GET that retries 5xx answers with a 0.5, 1, 2... second backoff"""
+    async with azampay_client() as client:
+        for attempt in range(retries + 1):
+            response = await client.get(url, headers=headers, timeout=30)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            await asyncio.sleep(0.5 * 2 ** attempt)
 
 @require_http_methods(["GET"])
-def get_payment_providers(request):
+async def get_payment_providers(request):
     """Fetch payment providers from AzamPay with improved error handling"""
     try:
         category = request.GET.get('category')
@@ -272,15 +328,12 @@ def get_payment_providers(request):
 
         # Try cache first
         cache_key = f'payment_providers_{category}'
-        providers = cache.get(cache_key)
+        providers = await cache.aget(cache_key)
         if providers:
             return JsonResponse({'success': True, 'providers': providers})
 
         # Get fresh token
-        token = get_azampay_token()
-        
-        # Create session with retry strategy
-        session = get_http_session()
+        token = await get_azampay_token()
         
         url = f"{settings.AZAMPAY_CHECKOUT_BASE}/api/v1/Partner/GetPaymentPartners"
         headers = {
@@ -294,12 +347,8 @@ def get_payment_providers(request):
         logger.debug(f"Request URL: {url}")
         logger.debug(f"Request headers: {headers}")
 
-        response = session.get(
-            url, 
-            headers=headers, 
-            timeout=30,
-            verify=True
-        )
+        with external_call('azampay', 'payment_partners'):
+            response = await get_with_retry(url, headers)
         
         # Log response details
         logger.info(f"AzamPay providers response status: {response.status_code}")
@@ -337,17 +386,17 @@ def get_payment_providers(request):
 
         # Cache results
         if filtered:
-            cache.set(cache_key, filtered, 3600)
+            await cache.aset(cache_key, filtered, 3600)
 
         return JsonResponse({
             'success': True, 
             'providers': filtered
         })
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Network error fetching payment providers: {str(e)}")
         # Return cached results if available during network error
-        cached = cache.get(cache_key)
+        cached = await cache.aget(cache_key)
         if cached:
             return JsonResponse({
                 'success': True,
@@ -364,14 +413,12 @@ def get_payment_providers(request):
             'success': False,
             'error': 'Could not fetch providers.'
         }, status=500)
-    finally:
-        if 'session' in locals():
-            session.close()
 
 @require_http_methods(["POST"])
-def initiate_payment(request):
+async def initiate_payment(request):
     """Initiate payment with AzamPay"""
     try:
+        user = await aget_user(request)
         data = json.loads(request.body)
         case_id = data.get('case_id')
         amount = Decimal(data.get('amount', 0))
@@ -389,12 +436,12 @@ def initiate_payment(request):
             }, status=400)
 
         # Get case
-        case = get_object_or_404(PatientCase, id=case_id)
+        case = await aget_object_or_404(PatientCase.objects.select_related('patient'), id=case_id)
         
         # Create donation record
-        donation = Donation.objects.create(
+        donation = await Donation.objects.acreate(
             case=case,
-            donor=request.user,
+            donor=user,
             amount=amount + support_amount,
             currency=currency,
             is_anonymous=is_anonymous,
@@ -409,7 +456,7 @@ def initiate_payment(request):
         )
 
         # Get AzamPay token
-        token = get_azampay_token()
+        token = await get_azampay_token()
         
         # Prepare checkout URL and payload
         if payment_channel == 'mno':
@@ -426,14 +473,16 @@ def initiate_payment(request):
             'Accept': 'application/json'
         }
         
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
+        with external_call('azampay', 'checkout'):
+            async with azampay_client() as client:
+                response = await client.post(url, json=payload, headers=headers, timeout=15)
         response.raise_for_status()
         result = response.json()
 
         # Update donation with response
         donation.payment_data = payload
         donation.azampay_transaction_id = result.get('transactionId')
-        donation.save()
+        await donation.asave()
 
         return JsonResponse({
             'success': True,
@@ -446,19 +495,18 @@ def initiate_payment(request):
         logger.error(f"Error initiating payment: {str(e)}")
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
-@csrf_exempt
-@require_http_methods(["POST"])
-def payment_callback(request):
-    """Handle AzamPay payment callback"""
-    try:
-        data = json.loads(request.body)
-        utility_ref = data.get('utilityref')  # This is our external_id
-        
+def record_payment_callback(data):
+    """Store an AzamPay callback; PaymentCallback.save updates the donation"""
+    utility_ref = data.get('utilityref')  # This is our external_id
+
+    # One write transaction for the callback row, the donation status and
+    # its outbox event (BEGIN IMMEDIATE on SQLite)
+    with write_transaction():
         # Find the donation
         donation = get_object_or_404(Donation, external_id=utility_ref)
         
         # Create callback record
-        callback = PaymentCallback.objects.create(
+        return PaymentCallback.objects.create(
             donation=donation,
             msisdn=data.get('msisdn'),
             amount=data.get('amount'),
@@ -472,7 +520,14 @@ def payment_callback(request):
             raw_payload=data
         )
 
-        # Callback model's save method will update donation status
+@csrf_exempt
+@require_http_methods(["POST"])
+async def payment_callback(request):
+    """Handle AzamPay payment callback"""
+    try:
+        data = json.loads(request.body)
+        # Transactions are sync-only, so the whole write runs in one thread
+        await sync_to_async(record_payment_callback)(data)
         
         return JsonResponse({'success': True})
 
@@ -480,15 +535,15 @@ def payment_callback(request):
         logger.error(f"Error processing payment callback: {str(e)}")
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
-@login_required
-def payment_status(request):
+@async_login_required
+async def payment_status(request):
     """Check payment status"""
     try:
         external_id = request.GET.get('ref')
         if not external_id:
             return JsonResponse({'success': False, 'error': 'Reference required'})
 
-        donation = get_object_or_404(Donation, external_id=external_id)
+        donation = await aget_object_or_404(Donation.objects, external_id=external_id)
         
         return JsonResponse({
             'success': True,
@@ -530,14 +585,22 @@ def payment_success(request):
         logger.error(f"Error displaying success page: {str(e)}")
         return redirect('donations:dashboard')
 
-class DashboardView(LoginRequiredMixin, TemplateView):
+class DashboardView(ReplicaReadMixin, LoginRequiredMixin, TemplateView):
     template_name = 'donations/dashboard.html'
+    query_budget = 8
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
-        
-        context.update({
+        context.update(tagged_cache.get_or_set(
+            f'donor_dashboard:{user.pk}', lambda: self.donor_stats(user),
+            tags=[donor_tag(user.pk)], timeout=300,
+        ))
+        return context
+
+    def donor_stats(self, user):
+        """Totals and recent activity for the dashboard, cached per donor"""
+        return {
             'total_donated': Donation.objects.filter(
                 donor=user,
                 status='completed'
@@ -553,16 +616,14 @@ class DashboardView(LoginRequiredMixin, TemplateView):
                 status='completed'
             ).count(),
             
-            'recent_patients': PatientCase.objects.filter(
+            'recent_patients': list(PatientCase.objects.filter(
                 donations__donor=user
-            ).distinct().order_by('-created_at')[:3],
+            ).distinct().order_by('-created_at')[:3]),
             
-            'recent_donations': Donation.objects.filter(
+            'recent_donations': list(Donation.objects.filter(
                 donor=user
-            ).order_by('-created_at')[:3]
-        })
-        
-        return context
+            ).order_by('-created_at')[:3]),
+        }
 
 def calculate_impact_score(user):
     """Calculate donor impact score"""
@@ -573,8 +634,9 @@ def calculate_impact_score(user):
     # Simple scoring algorithm - can be made more complex
     return int((total_amount / 100) + (donation_count * 10))
 
-class PatientListView(LoginRequiredMixin, ListView):
+class PatientListView(ReplicaReadMixin, LoginRequiredMixin, ListView):
     template_name = 'donations/patients.html'
+    query_budget = 6
     context_object_name = 'patients'
     paginate_by = 10
 
@@ -593,7 +655,7 @@ class PatientListView(LoginRequiredMixin, ListView):
         context['total_patients'] = self.get_queryset().count()
         return context
 
-class ReportsView(LoginRequiredMixin, TemplateView):
+class ReportsView(ReplicaReadMixin, LoginRequiredMixin, TemplateView):
     template_name = 'donations/reports.html'
 
     def get_context_data(self, **kwargs):
@@ -650,7 +712,7 @@ class ReportsView(LoginRequiredMixin, TemplateView):
             count=Count('id')
         )
 
-class TreatmentPlansView(LoginRequiredMixin, ListView):
+class TreatmentPlansView(ReplicaReadMixin, LoginRequiredMixin, ListView):
     template_name = 'donations/treatment_plans.html'
     context_object_name = 'treatment_plans'
     paginate_by = 10
@@ -703,8 +765,9 @@ class SettingsView(LoginRequiredMixin, TemplateView):
         })
         return context
 
-class DonationListView(LoginRequiredMixin, ListView):
+class DonationListView(ReplicaReadMixin, LoginRequiredMixin, ListView):
     template_name = 'donations/donations.html'
+    query_budget = 8
     context_object_name = 'donations'
     paginate_by = 10
 
@@ -746,7 +809,7 @@ class DonationListView(LoginRequiredMixin, ListView):
             count=Count('id')
         ).order_by('date')
     #adding patient discovery view
-class DiscoveryView(LoginRequiredMixin, ListView):
+class DiscoveryView(ReplicaReadMixin, LoginRequiredMixin, ListView):
     template_name = 'donations/discovery.html'
     context_object_name = 'patients'
     paginate_by = 10
@@ -770,8 +833,9 @@ class DiscoveryView(LoginRequiredMixin, ListView):
         context['total_patients'] = self.get_queryset().count()
         return context
 
-class PaymentsView(LoginRequiredMixin, ListView):
+class PaymentsView(ReplicaReadMixin, LoginRequiredMixin, ListView):
     template_name = 'donations/payments.html'
+    query_budget = 8
     context_object_name = 'payments'
     paginate_by = 10
 
@@ -831,34 +895,35 @@ class PaymentsView(LoginRequiredMixin, ListView):
             '-updated_at'
         )[:5]
     #adding notifications view
-class NotificationsView(LoginRequiredMixin, TemplateView):
+class NotificationsView(LoginRequiredMixin, ListView):
     template_name = 'donations/notifications.html'
+    query_budget = 4
+    context_object_name = 'notifications'
+    paginate_by = 20
+
+    def get_queryset(self):
+        # Served by notification_user_read_idx (user, read, -created_at)
+        notifications = Notification.objects.filter(user=self.request.user)
+        if self.request.GET.get('unread'):
+            notifications = notifications.filter(read=False)
+        return notifications.order_by('-created_at')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
-        
-        # Fetch notifications - safely handle users without a notifications relation or anonymous users
-        notifications_manager = getattr(user, 'notifications', None)
-        if notifications_manager is not None:
-            notifications = notifications_manager.all().order_by('-created_at')[:20]
-            # use the manager to count unread notifications efficiently
-            try:
-                unread_count = notifications_manager.filter(read=False).count()
-            except Exception:
-                # fallback if filter/count not supported for some custom managers
-                unread_count = sum(1 for n in notifications if not getattr(n, 'read', False))
-        else:
-            notifications = []
-            unread_count = 0
-
-        context.update({
-            'notifications': notifications,
-            'unread_count': unread_count
-        })
+        # The unread count comes from the unread_notifications context processor
+        context['unread_only'] = bool(self.request.GET.get('unread'))
         return context
 
 
+@login_required
+@require_POST
+def mark_notifications_read(request):
+    """Mark the posted notification ids read, or all of them without ids"""
+    ids = [int(pk) for pk in request.POST.getlist('id') if pk.isdigit()]
+    mark_read(request.user, ids or None)
+    return redirect('donations:notifications')
+
+
 # Add this class after other views
 class ProfileView(LoginRequiredMixin, TemplateView):
     template_name = 'donations/profile.html'
@@ -1,7 +1,19 @@
-from django.contrib import admin
+import csv
+import io
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import Profile
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from rhci_platform.admin_search import IndexedAutocompleteMixin
+from rhci_platform.changelists import FastChangeListMixin
+from . import imports
+from .models import DonorImport, Notification, Profile
 
 class ProfileInline(admin.StackedInline):
     model = Profile
@@ -12,10 +24,27 @@ class ProfileInline(admin.StackedInline):
     fields = ('is_donor', 'donor_type', 'organization_name', 'country', 
               'city', 'address', 'payment_preference')
 
+class DonorImportForm(forms.Form):
+    file = forms.FileField(
+        label='CSV file',
+        help_text='Header row with email, first_name, last_name and optionally password, donor_type, '
+                  'organization_name, country, city, address, payment_preference.')
+    donor_type = forms.ChoiceField(choices=Profile.DONOR_TYPE_CHOICES, initial='Company CSR',
+                                   help_text='For rows without a donor_type')
+    organization_name = forms.CharField(required=False, max_length=255,
+                                        help_text='For rows without an organization_name')
+    country = forms.CharField(required=False, max_length=100)
+    city = forms.CharField(required=False, max_length=100)
+    invite = forms.BooleanField(required=False, initial=True,
+                                help_text='Email the donors a link to choose their password')
+
 # Extend the User admin
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(IndexedAutocompleteMixin, FastChangeListMixin, BaseUserAdmin):
     inlines = (ProfileInline,)
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff', 'get_donor_type')
+    list_select_related = ('profile',)
+    # User widgets match the email by prefix through user_email_lower_uniq
+    autocomplete_search_fields = ('email',)
     
     def get_donor_type(self, obj):
         try:
@@ -24,6 +53,49 @@ class UserAdmin(BaseUserAdmin):
             return '-'
     get_donor_type.short_description = 'Donor Type'
 
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_donors_view), name='auth_user_import'),
+            path('import/<int:import_id>/', self.admin_site.admin_view(self.import_donors_view),
+                 name='auth_user_import_status'),
+        ] + super().get_urls()
+
+    def import_donors_view(self, request, import_id=None):
+        """
+        Validate an uploaded CSV and queue its donor accounts for the task
+        worker (see apps.users.imports); the import's own page shows how far
+        it has got and which rows were skipped
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = DonorImportForm(request.POST or None, request.FILES or None)
+        job = get_object_or_404(DonorImport, pk=import_id) if import_id else None
+        if request.method == 'POST' and form.is_valid():
+            data = form.cleaned_data
+            try:
+                rows = imports.read_csv(io.TextIOWrapper(data['file'].file, encoding='utf-8-sig'))
+                if len(rows) > settings.DONOR_IMPORT_MAX_ROWS:
+                    raise ValueError(f'{len(rows)} rows is more than the {settings.DONOR_IMPORT_MAX_ROWS} '
+                                     f'an upload may have; use manage.py import_donors instead.')
+                job = imports.queue_import(
+                    rows, defaults={key: data[key] for key in ('donor_type', 'organization_name', 'country', 'city')},
+                    invite=data['invite'], requested_by=request.user, filename=data['file'].name)
+            except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                form.add_error('file', str(e))
+            else:
+                level = messages.WARNING if job.errors else messages.SUCCESS
+                self.message_user(
+                    request, f'Queued {job.total} donors for import; {len(job.errors)} rows skipped.', level)
+                return redirect('admin:auth_user_import_status', import_id=job.pk)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Import donors',
+            'opts': self.model._meta,
+            'form': form,
+            'job': job,
+        }
+        return TemplateResponse(request, 'admin/auth/user/import_donors.html', context)
+
 # Re-register UserAdmin
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
@@ -33,3 +105,14 @@ class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'donor_type', 'organization_name', 'country')
     list_filter = ('donor_type', 'country')
     search_fields = ('user__email', 'organization_name')
+    autocomplete_fields = ('user',)
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'level', 'message', 'read', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('kind', 'level', 'read')
+    raw_id_fields = ('user',)
+    # Read state changes go through apps.users.notifications to keep the counter right
+    readonly_fields = ('read',)
@@ -0,0 +1,43 @@
+"""
+Sign in with an email address.
+
+Donor accounts are looked up by LOWER(email), which the unique partial index
+user_email_lower_uniq (users migration 0007) answers with one index probe;
+auth_user.email itself is not indexed, so `filter(email=...)` scans the table.
+"""
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.db.models.functions import Lower
+
+
+def normalize_email(email):
+    """The form an email is stored and compared in: trimmed and lowercased"""
+    return (email or '').strip().lower()
+
+
+def users_with_email(email):
+    """Users whose email matches case-insensitively (at most one, by the index)"""
+    # The exclude repeats the index's WHERE clause so SQLite and Postgres can use it
+    return (User.objects.alias(email_lower=Lower('email'))
+            .filter(email_lower=normalize_email(email)).exclude(email=''))
+
+
+class EmailBackend(ModelBackend):
+    """
+    ModelBackend that treats a username containing '@' as an email address.
+    Anything else, and an address no account has as its email, falls back
+    to the username lookup, so staff usernames keep working in the admin.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None or '@' not in username:
+            return super().authenticate(request, username, password, **kwargs)
+        try:
+            user = users_with_email(username).get()
+        except User.DoesNotExist:
+            return super().authenticate(request, username, password, **kwargs)
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,287 @@
+"""
+Bulk donor onboarding from CSV, for Company CSR and NGO partners registering
+many employee donors at once.
+
+Rows are validated together (existing accounts are looked up IMPORT_BATCH
+emails per query), and users and profiles are inserted with bulk_create,
+IMPORT_BATCH rows per transaction. Rows without a password get an unusable
+one; with invite=True they are also emailed a link to choose it.
+
+`manage.py import_donors` calls import_donors(), which hashes passwords in
+forked worker processes. Admin uploads call queue_import(): the request
+only validates, and `users.import_donors` tasks (apps.users.tasks) insert
+IMPORT_TASK_BATCH rows each, in the task worker. The rows wait in the
+database until then, so admin uploads may not carry passwords; their
+donors are invited to choose one.
+"""
+import csv
+import multiprocessing
+import os
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import password_validation
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.exceptions import ValidationError
+from django.core.mail import EmailMessage
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from core import mail
+from core.models import OutboundEmail
+from core.tasks import enqueue
+from rhci_platform.transactions import write_transaction
+
+from .backends import normalize_email
+from .models import DonorImport, Profile
+
+IMPORT_BATCH = 500
+# Rows per users.import_donors task: about 20s of PBKDF2 when all have passwords
+IMPORT_TASK_BATCH = 100
+COLUMNS = ('email', 'first_name', 'last_name', 'password', 'donor_type', 'organization_name',
+           'country', 'city', 'address', 'payment_preference')
+REQUIRED_COLUMNS = ('email', 'first_name', 'last_name')
+ORGANIZATION_TYPES = ('Company CSR', 'NGO')
+# Checked against the model fields' max_length
+LIMITED = ((User, ('email', 'first_name', 'last_name')), (Profile, ('organization_name', 'country', 'city')))
+
+ImportResult = namedtuple('ImportResult', 'created errors')
+
+
+def read_csv(lines):
+    """
+    (line number, row) for each record of a CSV with a header row. Headers
+    are matched case-insensitively and spaces read as underscores, so
+    "First Name" is first_name; unknown columns are ignored.
+    """
+    reader = csv.DictReader(lines)
+    if not reader.fieldnames:
+        raise ValueError('The file is empty')
+    reader.fieldnames = [name.strip().lower().replace(' ', '_') for name in reader.fieldnames]
+    missing = [column for column in REQUIRED_COLUMNS if column not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    return [(reader.line_num, row) for row in reader]
+
+
+def _problem(row):
+    """What is wrong with a cleaned row, or None"""
+    try:
+        validate_email(row['email'])
+    except ValidationError:
+        return 'Enter a valid email address.'
+    for column in REQUIRED_COLUMNS[1:]:
+        if not row[column]:
+            return f'{column} is required.'
+    for model, columns in LIMITED:
+        for column in columns:
+            limit = model._meta.get_field(column).max_length
+            if len(row[column]) > limit:
+                return f'{column} is longer than {limit} characters.'
+    if row['donor_type'] not in dict(Profile.DONOR_TYPE_CHOICES):
+        return f"Unknown donor_type {row['donor_type']!r}."
+    if row['donor_type'] in ORGANIZATION_TYPES and not all(
+            [row['organization_name'], row['country'], row['city']]):
+        return 'organization_name, country and city are required for organizations.'
+    if row['payment_preference'] and row['payment_preference'] not in dict(Profile.PAYMENT_PREFERENCE_CHOICES):
+        return f"Unknown payment_preference {row['payment_preference']!r}."
+    if row['password']:
+        user = User(username=row['email'], email=row['email'],
+                    first_name=row['first_name'], last_name=row['last_name'])
+        try:
+            password_validation.validate_password(row['password'], user)
+        except ValidationError as e:
+            return ' '.join(e.messages)
+    return None
+
+
+def validate(rows, defaults=None):
+    """
+    Split (line, row) pairs into cleaned rows ready to insert and
+    (line, email, message) errors. `defaults` fill empty donor_type,
+    organization_name, country, city and payment_preference cells.
+    """
+    defaults = {'donor_type': 'Individual', **{k: v for k, v in (defaults or {}).items() if v}}
+    valid, errors, lines = [], [], {}
+    for line, raw in rows:
+        row = {column: (raw.get(column) or '').strip() for column in COLUMNS}
+        for column, value in defaults.items():
+            row[column] = row[column] or value
+        row['email'] = normalize_email(row['email'])
+        problem = _problem(row)
+        if not problem and row['email'] in lines:
+            problem = f"Same email as line {lines[row['email']]}."
+        if problem:
+            errors.append((line, row['email'], problem))
+            continue
+        lines[row['email']] = line
+        valid.append((line, row))
+
+    emails = list(lines)
+    taken = set()
+    for start in range(0, len(emails), IMPORT_BATCH):
+        batch = emails[start:start + IMPORT_BATCH]
+        # LOWER(email) IN (...) is answered by user_email_lower_uniq, username IN (...) by its unique index
+        taken.update(User.objects.annotate(email_lower=Lower('email')).exclude(email='')
+                     .filter(email_lower__in=batch).values_list('email_lower', flat=True))
+        taken.update(User.objects.filter(username__in=batch).values_list('username', flat=True))
+    if taken:
+        errors.extend((line, row['email'], 'An account with this email already exists.')
+                      for line, row in valid if row['email'] in taken)
+        valid = [(line, row) for line, row in valid if row['email'] not in taken]
+    errors.sort()
+    return valid, errors
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    make_password() for each password, across `workers` forked processes
+    (default: one per CPU). Empty passwords become unusable ones.
+    """
+    workers = workers or os.cpu_count() or 1
+    given = [password for password in passwords if password]
+    if workers > 1 and len(given) > workers:
+        # Workers only hash; they inherit settings through fork and never touch the database
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            hashed = iter(pool.map(make_password, given, chunksize=max(len(given) // (workers * 4), 1)))
+    else:
+        hashed = iter([make_password(password) for password in given])
+    return [next(hashed) if password else make_password(None) for password in passwords]
+
+
+def _insert(batch, errors):
+    """Insert one batch of (line, row, User); returns the inserted rows"""
+    users = [user for line, row, user in batch]
+    try:
+        # Savepoint: a concurrent signup can still take an email after validation
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+        inserted = batch
+    except IntegrityError:
+        inserted = []
+        for line, row, user in batch:
+            try:
+                with transaction.atomic():
+                    user.save()
+            except IntegrityError:
+                errors.append((line, row['email'], 'An account with this email already exists.'))
+            else:
+                inserted.append((line, row, user))
+    Profile.objects.bulk_create([
+        Profile(
+            user=user, is_donor=True, donor_type=row['donor_type'],
+            organization_name=row['organization_name'] or None, country=row['country'] or None,
+            city=row['city'] or None, address=row['address'] or None,
+            payment_preference=row['payment_preference'] or None,
+        )
+        for line, row, user in inserted
+    ])
+    return inserted
+
+
+def invitations(users):
+    """EmailMessages with a link for each user to choose a password"""
+    subject = render_to_string('users/donor_invite_subject.txt').strip()
+    for user in users:
+        path = reverse('password_reset_confirm', kwargs={
+            'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
+            'token': default_token_generator.make_token(user),
+        })
+        body = render_to_string('users/donor_invite_email.html', {'user': user, 'url': settings.SITE_URL + path})
+        yield EmailMessage(subject, body, to=[user.email])
+
+
+def _import(rows, hashes, errors, invite):
+    """Insert validated (line, row) pairs with their password hashes in one transaction; returns how many"""
+    batch = [
+        (line, row, User(username=row['email'], email=row['email'], first_name=row['first_name'],
+                         last_name=row['last_name'], password=password))
+        for (line, row), password in zip(rows, hashes)
+    ]
+    with write_transaction():
+        inserted = _insert(batch, errors)
+        if invite:
+            mail.queue(invitations(user for line, row, user in inserted if not row['password']),
+                       priority=OutboundEmail.PRIORITY_BULK)
+    return len(inserted)
+
+
+def import_donors(rows, defaults=None, workers=None, invite=False):
+    """
+    Validate, hash and insert (line, row) pairs from read_csv(). Invalid
+    rows are skipped and reported; returns ImportResult(created, errors).
+    """
+    valid, errors = validate(rows, defaults)
+    hashes = hash_passwords([row['password'] for line, row in valid], workers)
+    created = 0
+    for start in range(0, len(valid), IMPORT_BATCH):
+        created += _import(valid[start:start + IMPORT_BATCH], hashes[start:start + IMPORT_BATCH], errors, invite)
+    errors.sort()
+    return ImportResult(created, errors)
+
+
+def queue_import(rows, defaults=None, invite=False, requested_by=None, filename=''):
+    """
+    Validate (line, row) pairs from read_csv() now and queue the inserts;
+    returns the DonorImport that reports progress and the result. Raises
+    ValueError if a row has a password: queued rows are stored as they are.
+    """
+    if any((row.get('password') or '').strip() for line, row in rows):
+        raise ValueError('Passwords cannot be uploaded here. Leave the password column empty and invite '
+                         'the donors, or use manage.py import_donors.')
+    valid, errors = validate(rows, defaults)
+    finished = {} if valid else {'status': 'done', 'finished_at': timezone.now()}
+    with write_transaction():
+        job = DonorImport.objects.create(
+            requested_by=requested_by, filename=filename, invite=invite, rows=valid,
+            total=len(valid), errors=errors, **finished,
+        )
+        if valid:
+            enqueue('users.import_donors', {'import_id': job.pk, 'position': 0})
+    return job
+
+
+def import_batch(import_id, position):
+    """
+    Insert the IMPORT_TASK_BATCH rows of a DonorImport starting at
+    `position`, and queue the next batch. Hashing, if rows from before
+    passwords were refused carry any, runs outside any transaction; the
+    inserts and the progress commit together, so a batch that was already
+    imported is skipped rather than inserted again. Returns the number of
+    donors created.
+    """
+    job = DonorImport.objects.filter(pk=import_id, position=position).first()
+    if job is None:
+        return 0
+    rows = [tuple(pair) for pair in job.rows[position:position + IMPORT_TASK_BATCH]]
+    hashes = hash_passwords([row['password'] for line, row in rows], workers=1)
+    end = position + len(rows)
+    done = end >= job.total
+    errors = []
+    with write_transaction():
+        if not DonorImport.objects.filter(pk=import_id, position=position).update(
+                position=end, status='running'):
+            return 0
+        created = _import(rows, hashes, errors, job.invite)
+        finished = {'status': 'done', 'rows': [], 'finished_at': timezone.now()} if done else {}
+        DonorImport.objects.filter(pk=import_id).update(
+            created=F('created') + created, errors=sorted(job.errors + [list(error) for error in errors]),
+            **finished)
+        if not done:
+            enqueue('users.import_donors', {'import_id': import_id, 'position': end})
+    return created
+
+
+def fail_import(import_id):
+    """Mark a DonorImport failed and drop the rows it had not inserted"""
+    DonorImport.objects.filter(pk=import_id).exclude(status='done').update(
+        status='failed', rows=[], finished_at=timezone.now())
@@ -0,0 +1,94 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from apps.users.backends import users_with_email
+from rhci_platform.testing import explain
+
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure login latency with --users accounts: the old path (get the "
+        "user by exact email, a scan of auth_user, then authenticate by "
+        "username) against EmailBackend's one indexed LOWER(email) lookup. "
+        "Creates the accounts the table is short of and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000)
+        parser.add_argument('--runs', type=int, default=20, help='Timed runs per measurement')
+        parser.add_argument('--keep', action='store_true', help='Leave the created accounts in place')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        started = time.perf_counter()
+        created = self.setup(tag, options['users'])
+        # The account signs in with different case than it signed up with
+        email = f'Bench-{tag}@Example.com'
+        user = User(username=f'bench-{tag}', email=email.lower())
+        user.set_password(PASSWORD)
+        user.save()
+        self.stdout.write(
+            f"{User.objects.count()} users ({created} created in {time.perf_counter() - started:.1f}s)")
+        try:
+            self.lookups(email, options['runs'])
+            self.logins(user, email, options['runs'])
+        finally:
+            user.delete()
+            if not options['keep']:
+                self.teardown(tag)
+
+    def setup(self, tag, target):
+        missing = max(target - User.objects.count() - 1, 0)
+        # Unusable passwords: hashing a million real ones would take hours
+        for start in range(0, missing, 5000):
+            User.objects.bulk_create([
+                User(username=f'bench-{tag}-{n}', email=f'bench-{tag}-{n}@example.com', password='!')
+                for n in range(start, min(start + 5000, missing))
+            ])
+        return missing
+
+    def timed(self, func, runs):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples)
+
+    def lookups(self, email, runs):
+        exact = User.objects.filter(email=email.lower())
+        indexed = users_with_email(email)
+        for label, queryset in (('email =', exact), ('LOWER(email) =', indexed)):
+            sql, params = queryset.query.sql_with_params()
+            self.stdout.write(f"Plan for {label:<15} {'; '.join(explain(sql, params))}")
+        old = self.timed(lambda: exact.get(), runs)
+        new = self.timed(lambda: indexed.get(), runs)
+        self.stdout.write(
+            f"Lookup:  exact email scan {old:.3f}ms, indexed {new:.3f}ms (median of {runs})")
+
+    def logins(self, user, email, runs):
+        def old():
+            found = User.objects.get(email=email.lower())
+            assert authenticate(None, username=found.username, password=PASSWORD)
+
+        def new():
+            assert authenticate(None, username=email, password=PASSWORD)
+
+        hashing = self.timed(lambda: user.check_password(PASSWORD), runs)
+        before = self.timed(old, runs)
+        after = self.timed(new, runs)
+        self.stdout.write(
+            f"Login:   old {before:.1f}ms, EmailBackend {after:.1f}ms, of which password "
+            f"hashing ~{hashing:.1f}ms (median of {runs})")
+
+    def teardown(self, tag):
+        while ids := list(User.objects.filter(username__startswith=f'bench-{tag}-')
+                          .values_list('id', flat=True)[:5000]):
+            User.objects.filter(id__in=ids).delete()
@@ -0,0 +1,146 @@
+import statistics
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+
+from apps.beneficiaries.models import Patient, PatientCase
+from apps.donations.models import Donation
+from apps.users.models import Notification, NotificationCounter
+from apps.users.notifications import notify_many, unread_count
+from core import tasks
+from core.models import Task
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure notification fan-out to every donor of one case: one row and "
+        "counter update per donor (what a post_save loop would do) against the "
+        "batched donations.notify_case_donors task chain, plus the navbar "
+        "badge read. Creates its own donors and case and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--donors', type=int, default=50000)
+        parser.add_argument('--naive-sample', type=int, default=2000,
+                            help='Donors notified one by one; the rate is extrapolated to --donors')
+        parser.add_argument('--heavy-unread', type=int, default=5000,
+                            help='Unread notifications given to one donor for the badge comparison')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        started = time.perf_counter()
+        patient, case, donor_ids = self.setup(tag, options['donors'])
+        self.stdout.write(f"Created {len(donor_ids)} donors in {time.perf_counter() - started:.1f}s")
+        try:
+            self.naive(donor_ids[:options['naive_sample']], options['donors'])
+            self.batched(case)
+            self.badge(donor_ids[0], options['heavy_unread'])
+        finally:
+            self.teardown(patient, case, donor_ids)
+
+    def setup(self, tag, count):
+        patient = Patient.objects.create(
+            first_name='Bench', last_name=tag, dob=date(2015, 1, 1), gender='O',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        case = PatientCase.objects.create(
+            patient=patient, title=f'Benchmark {tag}', story='-', diagnosis='-',
+            hospital_name='-', doctor_name='-', target_amount=Decimal('1000'),
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            status='published',
+        )
+        User.objects.bulk_create(
+            [User(username=f'bench-{tag}-{n}', email=f'bench-{tag}-{n}@example.com') for n in range(count)],
+            batch_size=2000)
+        donor_ids = list(User.objects.filter(username__startswith=f'bench-{tag}-')
+                         .order_by('id').values_list('id', flat=True))
+        Donation.objects.bulk_create([
+            Donation(case=case, donor_id=donor_id, amount=Decimal('1000'),
+                     external_id=f'bench_{tag}_{donor_id}', status='completed')
+            for donor_id in donor_ids
+        ], batch_size=2000)
+        return patient, case, donor_ids
+
+    def naive(self, sample, total):
+        started = time.perf_counter()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            for user_id in sample:
+                Notification.objects.create(user_id=user_id, kind='case_funded', message='Funded')
+                counter, created = NotificationCounter.objects.get_or_create(user_id=user_id)
+                NotificationCounter.objects.filter(pk=counter.pk).update(unread=F('unread') + 1)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Row by row:   {len(sample)} donors in {elapsed:.2f}s, {queries.count} queries "
+            f"({len(sample) / elapsed:.0f} donors/s, ~{total / len(sample) * elapsed:.0f}s for {total})")
+        Notification.objects.filter(user_id__in=sample).delete()
+        NotificationCounter.objects.filter(user_id__in=sample).delete()
+
+    def batched(self, case):
+        started = time.perf_counter()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            tasks.enqueue('donations.notify_case_donors', {
+                'case_id': case.pk, 'kind': 'case_funded', 'level': 'success',
+                'message': f'{case.title} is fully funded.',
+            })
+            ran = 0
+            while claimed := tasks.claim('benchmark', batch_size=1):
+                for task in claimed:
+                    if tasks.run(task) != 'done':
+                        raise RuntimeError(f'Fan-out task failed: {Task.objects.get(pk=task.pk).last_error}')
+                ran += len(claimed)
+        elapsed = time.perf_counter() - started
+        sent = Notification.objects.filter(user__donations__case=case).count()
+        self.stdout.write(
+            f"Batched:      {sent} donors in {elapsed:.2f}s, {queries.count} queries, {ran} tasks "
+            f"({sent / elapsed:.0f} donors/s)")
+
+    def badge(self, user_id, heavy):
+        user = User.objects.get(pk=user_id)
+        notify_many([user_id], 'case_update', 'warm-up')
+        Notification.objects.bulk_create(
+            [Notification(user_id=user_id, kind='case_update', message=f'Update {n}') for n in range(heavy)],
+            batch_size=2000)
+        NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') + heavy)
+
+        def timed(func, runs=200):
+            samples = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                func()
+                samples.append((time.perf_counter() - started) * 1000)
+            return statistics.median(samples)
+
+        counted = timed(lambda: Notification.objects.filter(user_id=user_id, read=False).count())
+        counter = timed(lambda: unread_count(user))
+        self.stdout.write(
+            f"Badge read:   COUNT(*) over {heavy + 2} unread rows {counted:.3f}ms, "
+            f"counter row {counter:.3f}ms (median of 200)")
+
+    def teardown(self, patient, case, donor_ids):
+        Task.objects.filter(name='donations.notify_case_donors', payload__case_id=case.pk).delete()
+        for start in range(0, len(donor_ids), 2000):
+            batch = donor_ids[start:start + 2000]
+            Notification.objects.filter(user_id__in=batch).delete()
+            NotificationCounter.objects.filter(user_id__in=batch).delete()
+        Donation.objects.filter(case=case).delete()
+        case.delete()
+        patient.delete()
+        for start in range(0, len(donor_ids), 2000):
+            User.objects.filter(id__in=donor_ids[start:start + 2000]).delete()
@@ -0,0 +1,44 @@
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+INDEX_NAME = 'user_email_lower_uniq'
+
+
+def create_index(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    clashes = list(
+        User.objects.exclude(email='').annotate(email_lower=Lower('email'))
+        .values('email_lower').annotate(n=Count('id')).filter(n__gt=1)
+        .values_list('email_lower', flat=True)[:20]
+    )
+    if clashes:
+        raise RuntimeError(
+            f"Cannot add {INDEX_NAME}: these emails belong to more than one account "
+            f"(ignoring case): {', '.join(clashes)}. Merge or change them and migrate again.")
+    quote = schema_editor.quote_name
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(
+        f"CREATE UNIQUE INDEX {concurrently}IF NOT EXISTS {quote(INDEX_NAME)} "
+        f"ON {quote(User._meta.db_table)} (LOWER({quote('email')})) WHERE NOT ({quote('email')} = '')")
+
+
+def drop_index(apps, schema_editor):
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(f"DROP INDEX {concurrently}IF EXISTS {schema_editor.quote_name(INDEX_NAME)}")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0006_notifications'),
+    ]
+
+    operations = [
+        # auth_user belongs to django.contrib.auth, so the index is created
+        # with SQL instead of a constraint on a model this app does not own
+        migrations.RunPython(create_index, drop_index),
+    ]
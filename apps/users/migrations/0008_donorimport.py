@@ -0,0 +1,33 @@
+# Generated by Django 4.2.24 on 2026-10-19 07:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0007_user_email_lower_uniq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DonorImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('invite', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done')], default='queued', max_length=10)),
+                ('rows', models.JSONField(default=list, help_text='[line, row] pairs that passed validation')),
+                ('position', models.PositiveIntegerField(default=0, help_text='Rows processed so far')),
+                ('total', models.PositiveIntegerField(default=0, help_text='Rows that passed validation')),
+                ('created', models.PositiveIntegerField(default=0, help_text='Donor accounts created')),
+                ('errors', models.JSONField(default=list, help_text='[line, email, problem] for each skipped row')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
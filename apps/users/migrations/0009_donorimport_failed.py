@@ -0,0 +1,29 @@
+# Generated by Django 4.2.24 on 2026-10-19 07:57
+
+from django.db import migrations, models
+
+
+def drop_stored_passwords(apps, schema_editor):
+    """Imports queued before passwords were refused: invite those donors instead"""
+    DonorImport = apps.get_model('users', 'DonorImport')
+    for job in DonorImport.objects.exclude(rows=[]).iterator():
+        if any(row.get('password') for line, row in job.rows):
+            job.rows = [[line, {**row, 'password': ''}] for line, row in job.rows]
+            job.invite = True
+            job.save(update_fields=['rows', 'invite'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_donorimport'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='donorimport',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10),
+        ),
+        migrations.RunPython(drop_stored_passwords, migrations.RunPython.noop),
+    ]
@@ -26,3 +26,76 @@ class Profile(models.Model):
     
     def __str__(self):
         return f"Profile for {self.user.email}"
+
+
+class Notification(models.Model):
+    KIND_CHOICES = [
+        ('payment', 'Payment result'),
+        ('case_update', 'Case update'),
+        ('case_funded', 'Case fully funded'),
+    ]
+
+    LEVEL_CHOICES = [
+        ('success', 'Success'),
+        ('info', 'Info'),
+        ('warning', 'Warning'),
+        ('danger', 'Danger'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES, default='info')
+    message = models.CharField(max_length=255)
+    url = models.CharField(max_length=200, blank=True)
+    read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # A user's notifications newest first, optionally only the unread ones
+            models.Index(fields=['user', 'read', '-created_at'], name='notification_user_read_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for {self.user_id}: {self.message}"
+
+
+class NotificationCounter(models.Model):
+    """Unread notifications per user, kept by apps.users.notifications for the navbar badge"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread} unread"
+
+
+class DonorImport(models.Model):
+    """
+    A donor CSV uploaded in the admin. Rows are validated in the request and
+    inserted by `users.import_donors` tasks (apps.users.tasks), one batch per
+    task. `rows` holds the validated rows and is emptied once they are all in
+    or a task has failed for good.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    filename = models.CharField(max_length=255, blank=True)
+    invite = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    rows = models.JSONField(default=list, help_text='[line, row] pairs that passed validation')
+    position = models.PositiveIntegerField(default=0, help_text='Rows processed so far')
+    total = models.PositiveIntegerField(default=0, help_text='Rows that passed validation')
+    created = models.PositiveIntegerField(default=0, help_text='Donor accounts created')
+    errors = models.JSONField(default=list, help_text='[line, email, problem] for each skipped row')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Donor import #{self.pk} {self.filename} ({self.status})"
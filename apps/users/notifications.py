@@ -0,0 +1,82 @@
+"""
+Donor notifications and the unread counter behind the navbar badge.
+
+Everything that creates or reads notifications goes through these functions
+so NotificationCounter.unread stays equal to the user's unread rows.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F
+
+from rhci_platform.transactions import write_transaction
+
+from .models import Notification, NotificationCounter
+
+FAN_OUT_BATCH = 1000
+
+
+def _write(notifications):
+    """Insert rows and bump counters: three statements for a typical batch"""
+    Notification.objects.bulk_create(notifications)
+    added = Counter(n.user_id for n in notifications)
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id) for user_id in added], ignore_conflicts=True)
+    by_amount = defaultdict(list)
+    for user_id, amount in added.items():
+        by_amount[amount].append(user_id)
+    for amount, user_ids in by_amount.items():
+        NotificationCounter.objects.filter(user_id__in=user_ids).update(unread=F('unread') + amount)
+
+
+def send(notifications):
+    """Save unsaved Notification objects, FAN_OUT_BATCH per transaction"""
+    for start in range(0, len(notifications), FAN_OUT_BATCH):
+        with write_transaction():
+            _write(notifications[start:start + FAN_OUT_BATCH])
+    return len(notifications)
+
+
+def notify_many(user_ids, kind, message, level='info', url=''):
+    """Give every user in `user_ids` the same notification"""
+    return send([
+        Notification(user_id=user_id, kind=kind, level=level, message=message, url=url)
+        for user_id in dict.fromkeys(user_ids)
+    ])
+
+
+def unread_count(user):
+    """The badge number: one primary-key read"""
+    return (NotificationCounter.objects.filter(user_id=user.pk)
+            .values_list('unread', flat=True).first() or 0)
+
+
+def mark_read(user, ids=None):
+    """Mark some (or, without `ids`, all) of the user's notifications read"""
+    with write_transaction():
+        unread = Notification.objects.filter(user=user, read=False)
+        if ids is not None:
+            unread = unread.filter(id__in=ids)
+        changed = unread.update(read=True)
+        if changed:
+            NotificationCounter.objects.filter(user=user).update(unread=F('unread') - changed)
+    return changed
+
+
+def recount(user_ids=None):
+    """Rebuild counters from the notification rows, e.g. after deleting rows by hand; returns how many were wrong"""
+    rows = Notification.objects.filter(read=False)
+    counters = NotificationCounter.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+        counters = counters.filter(user_id__in=user_ids)
+    with write_transaction():
+        unread = dict(rows.order_by().values('user_id').annotate(n=Count('id')).values_list('user_id', 'n'))
+        current = dict(counters.values_list('user_id', 'unread'))
+        NotificationCounter.objects.bulk_create(
+            [NotificationCounter(user_id=user_id) for user_id in unread if user_id not in current],
+            ignore_conflicts=True)
+        wrong = [user_id for user_id in unread.keys() | current.keys()
+                 if unread.get(user_id, 0) != current.get(user_id)]
+        for user_id in wrong:
+            NotificationCounter.objects.filter(user_id=user_id).update(unread=unread.get(user_id, 0))
+    return len(wrong)
@@ -0,0 +1,13 @@
+from core.tasks import task
+
+from . import imports
+
+
+def import_failed(import_id, position):
+    imports.fail_import(import_id)
+
+
+@task('users.import_donors', atomic=False, on_failure=import_failed)
+def import_donors(import_id, position):
+    """One batch of an admin donor upload; hashes outside the write transaction"""
+    imports.import_batch(import_id, position)
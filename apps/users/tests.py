@@ -1,3 +1,260 @@
+import io
+from unittest import mock
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+
+from core import tasks
+from core.models import Task
+
+from . import imports, notifications
+from .models import DonorImport, Notification, Profile
+
+
+class EmailBackendTests(TestCase):
+    """Donors sign in by email in any case; usernames still work for staff"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.donor = User.objects.create_user('donor', 'Asha.Juma@Example.com', 'secret-pass')
+        cls.staff = User.objects.create_user('staff', '', 'staff-pass', is_staff=True)
+
+    def test_email_in_any_case(self):
+        for email in ['asha.juma@example.com', 'ASHA.JUMA@EXAMPLE.COM', '  Asha.Juma@example.com ']:
+            with self.subTest(email=email):
+                self.assertEqual(authenticate(username=email, password='secret-pass'), self.donor)
+
+    def test_email_lookup_is_one_query(self):
+        with self.assertNumQueries(1):
+            authenticate(username='asha.juma@example.com', password='secret-pass')
+
+    def test_wrong_password(self):
+        self.assertIsNone(authenticate(username='asha.juma@example.com', password='wrong'))
+
+    def test_falls_back_to_username(self):
+        self.assertEqual(authenticate(username='staff', password='staff-pass'), self.staff)
+        self.assertEqual(authenticate(username='donor', password='secret-pass'), self.donor)
+        # An address no account has as its email is tried as a username
+        legacy = User.objects.create_user('legacy@example.com', '', 'legacy-pass')
+        self.assertEqual(authenticate(username='legacy@example.com', password='legacy-pass'), legacy)
+
+    def test_login_view(self):
+        response = self.client.post(reverse('users:login'), {
+            'username': 'ASHA.JUMA@example.com', 'password': 'secret-pass'})
+        self.assertRedirects(response, reverse('donations:dashboard'), fetch_redirect_response=False)
+        self.assertEqual(int(self.client.session['_auth_user_id']), self.donor.pk)
+
+
+class DuplicateEmailTests(TestCase):
+    """An email belongs to one account, compared case-insensitively"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.donor = User.objects.create_user('donor', 'asha@example.com', 'secret-pass')
+        Profile.objects.create(user=cls.donor, is_donor=True, donor_type='Individual')
+
+    def messages(self, response):
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_signup_rejects_existing_email(self):
+        response = self.client.post(reverse('users:signup'), {
+            'email': 'ASHA@Example.com', 'first_name': 'Asha', 'last_name': 'Other',
+            'password1': 'another-pass', 'password2': 'another-pass', 'terms': 'on',
+            'category': 'Individual',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('An account with this email already exists.', self.messages(response))
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_signup_stores_normalized_email(self):
+        self.client.post(reverse('users:signup'), {
+            'email': ' New.Donor@Example.com', 'first_name': 'New', 'last_name': 'Donor',
+            'password1': 'another-pass', 'password2': 'another-pass', 'terms': 'on',
+            'category': 'Individual',
+        })
+        self.assertTrue(User.objects.filter(email='new.donor@example.com').exists())
+
+    def test_edit_profile_rejects_taken_email(self):
+        other = User.objects.create_user('other', 'other@example.com', 'other-pass')
+        self.client.force_login(other)
+        response = self.client.post(reverse('users:edit_profile'), {'email': 'Asha@Example.com'})
+        self.assertRedirects(response, reverse('users:edit_profile'), fetch_redirect_response=False)
+        self.assertIn('An account with this email already exists.', self.messages(response))
+        other.refresh_from_db()
+        self.assertEqual(other.email, 'other@example.com')
+
+
+def csv_rows(text):
+    return imports.read_csv(io.StringIO(text))
+
+
+class DonorImportTests(TestCase):
+    """CSV rows are checked together, and a bad batch falls back to row-by-row inserts"""
+
+    HEADER = 'Email,First Name,Last Name,donor_type,organization_name,country,city\n'
+
+    def test_duplicate_emails_in_file(self):
+        valid, errors = imports.validate(csv_rows(
+            self.HEADER + 'asha@example.com,Asha,Juma,,,,\nASHA@example.com,Asha,Again,,,,\n'))
+        self.assertEqual([row['email'] for line, row in valid], ['asha@example.com'])
+        self.assertEqual(errors, [(3, 'asha@example.com', 'Same email as line 2.')])
+
+    def test_existing_accounts(self):
+        User.objects.create_user('someone', 'Taken@Example.com', 'pass')
+        User.objects.create_user('legacy@example.com', '', 'pass')
+        valid, errors = imports.validate(csv_rows(
+            self.HEADER + 'taken@example.com,A,B,,,,\nlegacy@example.com,C,D,,,,\nnew@example.com,E,F,,,,\n'))
+        self.assertEqual([row['email'] for line, row in valid], ['new@example.com'])
+        self.assertEqual([(line, problem) for line, email, problem in errors], [
+            (2, 'An account with this email already exists.'),
+            (3, 'An account with this email already exists.'),
+        ])
+
+    def test_organizations_need_name_and_location(self):
+        rows = csv_rows(self.HEADER + 'csr@example.com,A,B,Company CSR,Acme,,\n'
+                                      'ngo@example.com,C,D,NGO,Care,Tanzania,Arusha\n')
+        valid, errors = imports.validate(rows)
+        self.assertEqual([row['email'] for line, row in valid], ['ngo@example.com'])
+        self.assertEqual(errors, [(2, 'csr@example.com',
+                                   'organization_name, country and city are required for organizations.')])
+        # Upload defaults fill the empty cells
+        valid, errors = imports.validate(rows, defaults={'country': 'Tanzania', 'city': 'Dodoma'})
+        self.assertEqual((len(valid), errors), (2, []))
+
+    def test_missing_required_column(self):
+        with self.assertRaisesMessage(ValueError, 'Missing column(s): last_name'):
+            csv_rows('email,first_name\na@example.com,A\n')
+
+    def test_insert_falls_back_row_by_row(self):
+        valid, errors = imports.validate(csv_rows(
+            self.HEADER + ''.join(f'donor{n}@example.com,Donor,{n},,,,\n' for n in range(3))))
+        # A signup takes one of the emails after validation
+        User.objects.create_user('donor1@example.com', 'donor1@example.com', 'pass')
+        batch = [(line, row, User(username=row['email'], email=row['email'])) for line, row in valid]
+        errors = []
+        inserted = imports._insert(batch, errors)
+
+        self.assertEqual([row['email'] for line, row, user in inserted],
+                         ['donor0@example.com', 'donor2@example.com'])
+        self.assertEqual(errors, [(3, 'donor1@example.com', 'An account with this email already exists.')])
+        self.assertEqual(Profile.objects.filter(user__in=[user for line, row, user in inserted]).count(), 2)
+
+
+class AdminDonorImportTests(TestCase):
+    """The admin upload validates in the request and leaves the inserts to the task worker"""
+
+    URL = '/admin/auth/user/import/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser('staff', 'staff@example.com', 'pass')
+
+    def upload(self, text):
+        self.client.force_login(self.staff)
+        return self.client.post(self.URL, {
+            'file': SimpleUploadedFile('donors.csv', text.encode()), 'donor_type': 'Company CSR',
+            'organization_name': 'Acme', 'country': 'Tanzania', 'city': 'Dar es Salaam',
+        })
+
+    def run_tasks(self):
+        while claimed := tasks.claim('test'):
+            for task in claimed:
+                self.assertEqual(tasks.run(task), 'done')
+
+    @mock.patch.object(imports, 'IMPORT_TASK_BATCH', 2)
+    def test_upload_is_queued_and_reported(self):
+        response = self.upload('email,first_name,last_name,password\n'
+                               'a@example.com,A,One,\n'
+                               'b@example.com,B,Two,\n'
+                               'c@example.com,C,Three,\n'
+                               'bad-email,D,Four,\n')
+        job = DonorImport.objects.get()
+        self.assertRedirects(response, f'{self.URL}{job.pk}/', fetch_redirect_response=False)
+        self.assertEqual((job.status, job.total, len(job.errors)), ('queued', 3, 1))
+        self.assertFalse(User.objects.filter(email__endswith='@example.com').exclude(pk=self.staff.pk).exists())
+
+        self.run_tasks()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.position, job.created, job.rows), ('done', 3, 3, []))
+        self.assertEqual(Task.objects.filter(name='users.import_donors').count(), 2)
+        self.assertFalse(User.objects.get(email='a@example.com').has_usable_password())
+        self.assertEqual(Profile.objects.get(user__email='c@example.com').organization_name, 'Acme')
+
+        page = self.client.get(f'{self.URL}{job.pk}/')
+        self.assertContains(page, '3 of 3 donors created')
+        self.assertContains(page, 'bad-email')
+
+    def test_passwords_are_refused(self):
+        response = self.upload('email,first_name,last_name,password\n'
+                               'a@example.com,A,One,\n'
+                               'b@example.com,B,Two,correct-horse-battery\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Passwords cannot be uploaded here')
+        self.assertFalse(DonorImport.objects.exists())
+
+    def test_failed_import_drops_its_rows(self):
+        self.upload('email,first_name,last_name\na@example.com,A,One\n')
+        job = DonorImport.objects.get()
+        Task.objects.update(max_attempts=1)
+        with mock.patch.object(imports, '_import', side_effect=RuntimeError('disk full')), \
+                self.assertLogs('core.tasks', 'ERROR'):
+            [task] = tasks.claim('test')
+            self.assertEqual(tasks.run(task), 'failed')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows, job.created), ('failed', [], 0))
+        self.assertIsNotNone(job.finished_at)
+        page = self.client.get(f'{self.URL}{job.pk}/')
+        self.assertContains(page, 'Failed')
+        self.assertNotContains(page, 'Reload this page')
+
+    def test_repeated_batch_is_skipped(self):
+        self.upload('email,first_name,last_name\na@example.com,A,One\n')
+        job = DonorImport.objects.get()
+        self.assertEqual(imports.import_batch(job.pk, 0), 1)
+        # A retry after the batch committed finds the import moved on
+        self.assertEqual(imports.import_batch(job.pk, 0), 0)
+        self.assertEqual(User.objects.filter(email='a@example.com').count(), 1)
+
+
+class NotificationCounterTests(TestCase):
+    """The navbar badge counter always equals the user's unread rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'donor{n}', f'donor{n}@example.com', 'pass') for n in range(3)]
+
+    def assertCountersMatch(self):
+        for user in self.users:
+            with self.subTest(user=user.username):
+                self.assertEqual(notifications.unread_count(user),
+                                 Notification.objects.filter(user=user, read=False).count())
+
+    def test_notify_many(self):
+        first, second, third = self.users
+        self.assertEqual(notifications.notify_many([first.pk, second.pk, first.pk], 'case_update', 'Surgery done'), 2)
+        with mock.patch.object(notifications, 'FAN_OUT_BATCH', 2):
+            notifications.notify_many([user.pk for user in self.users], 'case_funded', 'Fully funded')
+        self.assertEqual([notifications.unread_count(user) for user in self.users], [2, 2, 1])
+        self.assertCountersMatch()
+
+    def test_mark_read(self):
+        first, second, third = self.users
+        for message in ('One', 'Two', 'Three'):
+            notifications.notify_many([first.pk, second.pk], 'case_update', message)
+        one = Notification.objects.filter(user=first).first()
+        self.assertEqual(notifications.mark_read(first, [one.pk]), 1)
+        self.assertEqual(notifications.mark_read(first, [one.pk]), 0)
+        # Another user's ids are ignored
+        self.assertEqual(notifications.mark_read(second, [one.pk]), 0)
+        self.assertEqual(notifications.unread_count(first), 2)
+        self.assertCountersMatch()
 
-# Create your tests here.
+        self.assertEqual(notifications.mark_read(first), 2)
+        self.assertEqual(notifications.mark_read(first), 0)
+        self.assertEqual(notifications.unread_count(first), 0)
+        self.assertEqual(notifications.unread_count(third), 0)
+        self.assertCountersMatch()
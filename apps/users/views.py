@@ -3,6 +3,7 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.models import User
+from .backends import normalize_email, users_with_email
 from .models import Profile  # Assuming you have a Profile model
 from django.db import IntegrityError
 
@@ -18,24 +19,19 @@ def user_login(request):
         email = request.POST.get('username')  # Form field is 'username' but contains email
         password = request.POST.get('password')
         
-        # Find user by email first
-        try:
-            user = User.objects.get(email=email)
-            # Authenticate with username and password
-            auth_user = authenticate(request, username=user.username, password=password)
+        # EmailBackend finds the account by email with one indexed lookup
+        auth_user = authenticate(request, username=email, password=password)
+        
+        if auth_user is not None:
+            login(request, auth_user)
+            messages.success(request, f"Welcome back, {auth_user.first_name}!")
             
-            if auth_user is not None:
-                login(request, auth_user)
-                messages.success(request, f"Welcome back, {user.first_name}!")
-                
-                if auth_user.is_staff:
-                    return redirect('admin:index')
-                else:
-                    return redirect('donations:dashboard')
+            if auth_user.is_staff:
+                return redirect('admin:index')
             else:
-                messages.error(request, 'Invalid email or password.')
-        except User.DoesNotExist:
-            messages.error(request, 'No account found with this email.')
+                return redirect('donations:dashboard')
+        else:
+            messages.error(request, 'Invalid email or password.')
             
     return render(request, 'users/login.html')
 
@@ -46,7 +42,7 @@ def donor_signup(request):
         
     if request.method == 'POST':
         # Basic info
-        email = request.POST.get('email')
+        email = normalize_email(request.POST.get('email'))
         first_name = request.POST.get('first_name')
         last_name = request.POST.get('last_name')
         password1 = request.POST.get('password1')
@@ -89,7 +85,7 @@ def donor_signup(request):
                 return render(request, 'users/signup.html')
         
         # Check if email already exists
-        if User.objects.filter(email=email).exists():
+        if users_with_email(email).exists():
             messages.error(request, 'An account with this email already exists.')
             return render(request, 'users/signup.html')
             
@@ -209,9 +205,13 @@ def edit_profile(request):
     if request.method == 'POST':
         # Process form submission
         user = request.user
+        email = normalize_email(request.POST.get('email', ''))
+        if email and users_with_email(email).exclude(pk=user.pk).exists():
+            messages.error(request, 'An account with this email already exists.')
+            return redirect('users:edit_profile')
         user.first_name = request.POST.get('first_name', '')
         user.last_name = request.POST.get('last_name', '')
-        user.email = request.POST.get('email', '')
+        user.email = email
         user.save()
         
         # Update profile fields - adjust these based on your actual Profile model
@@ -227,7 +227,7 @@ def edit_profile(request):
         user_profile.save()
         
         messages.success(request, 'Profile updated successfully!')
-        return redirect('profile')
+        return redirect('users:profile')
         
     context = {
         'profile': user_profile,
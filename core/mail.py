@@ -0,0 +1,250 @@
+"""
+Outgoing email through a database outbox.
+
+With EMAIL_BACKEND = 'core.mail.OutboxBackend', send_mail(), the password
+reset view and everything else built on Django's mail API queue messages in
+the caller's transaction instead of talking SMTP inside the request.
+`manage.py send_emails` claims queued messages in batches and delivers each
+batch over one connection of EMAIL_DELIVERY_BACKEND, at most
+EMAIL_RATE_LIMIT messages a second. Failures are retried with the task
+queue's backoff until EMAIL_MAX_ATTEMPTS, then left as `failed`.
+"""
+import base64
+import logging
+import smtplib
+import time
+from datetime import timedelta
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from rhci_platform import metrics
+from rhci_platform.transactions import write_transaction
+
+from .models import OutboundEmail, TaskLock
+from .tasks import retry_delay
+
+logger = logging.getLogger(__name__)
+
+CLAIM_LOCK = 'email'
+# Connection-level failures: reconnect and try the message again
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+EMAILS_SENT = metrics.registry.counter(
+    'rhci_emails_total', 'Outbound emails by result (sent, retry, failed)', ['result'])
+EMAIL_BATCH_DURATION = metrics.registry.histogram(
+    'rhci_email_batch_seconds', 'Time to deliver one claimed batch over one connection')
+
+
+def serialize(message):
+    """The parts of an EmailMessage needed to rebuild it at send time"""
+    attachments = []
+    for attachment in message.attachments:
+        if isinstance(attachment, MIMEBase):
+            raise ValueError('Queued email does not support MIMEBase attachments')
+        filename, content, mimetype = attachment
+        if isinstance(content, str):
+            content = content.encode()
+        attachments.append([filename, base64.b64encode(content).decode(), mimetype])
+    return {
+        'body': message.body,
+        'content_subtype': message.content_subtype,
+        'alternatives': [list(alternative) for alternative in getattr(message, 'alternatives', [])],
+        'cc': list(message.cc),
+        'bcc': list(message.bcc),
+        'reply_to': list(message.reply_to),
+        'headers': dict(message.extra_headers),
+        'attachments': attachments,
+    }
+
+
+def build_message(email, connection=None):
+    parts = email.message
+    message = EmailMultiAlternatives(
+        subject=email.subject, body=parts['body'], from_email=email.from_email, to=email.to,
+        cc=parts['cc'], bcc=parts['bcc'], reply_to=parts['reply_to'], headers=parts['headers'],
+        alternatives=[tuple(alternative) for alternative in parts['alternatives']],
+        connection=connection,
+    )
+    message.content_subtype = parts['content_subtype']
+    for filename, content, mimetype in parts['attachments']:
+        message.attach(filename, base64.b64decode(content), mimetype)
+    return message
+
+
+def queue(messages, priority=OutboundEmail.PRIORITY_TRANSACTIONAL, batch_size=1000):
+    """Queue EmailMessages; call inside the transaction that makes them necessary"""
+    rows = [
+        OutboundEmail(
+            subject=message.subject,
+            from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+            to=list(message.to),
+            message=serialize(message),
+            priority=getattr(message, 'priority', priority),
+        )
+        for message in messages
+    ]
+    OutboundEmail.objects.bulk_create(rows, batch_size=batch_size)
+    if rows and getattr(settings, 'EMAIL_OUTBOX_EAGER', False):
+        transaction.on_commit(send_queued)
+    return len(rows)
+
+
+class OutboxBackend(BaseEmailBackend):
+    """Email backend that queues messages for `manage.py send_emails`"""
+
+    def send_messages(self, email_messages):
+        messages = [message for message in email_messages if message.recipients()]
+        try:
+            return queue(messages)
+        except Exception:
+            if not self.fail_silently:
+                raise
+            return 0
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/rate seconds apart (no limit when rate is 0)"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_slot > now:
+            time.sleep(self.next_slot - now)
+        self.next_slot = max(self.next_slot, now) + self.interval
+
+
+def claim(batch_size):
+    """Mark up to `batch_size` ready messages as sending and return them"""
+    now = timezone.now()
+    with write_transaction():
+        ready = OutboundEmail.objects.filter(status='queued', send_after__lte=now).order_by(
+            'priority', 'send_after', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            ready = ready.select_for_update(skip_locked=True)
+        elif not TaskLock.objects.filter(name=CLAIM_LOCK).update(holder='send_emails', acquired_at=now):
+            TaskLock.objects.create(name=CLAIM_LOCK, holder='send_emails', acquired_at=now)
+        ids = list(ready.values_list('id', flat=True)[:batch_size])
+        if ids:
+            OutboundEmail.objects.filter(id__in=ids).update(
+                status='sending', locked_at=now, attempts=F('attempts') + 1)
+    if not ids:
+        return []
+    return list(OutboundEmail.objects.filter(id__in=ids).order_by('priority', 'send_after', 'id'))
+
+
+def send_queued(batch_size=None, rate=None, limiter=None):
+    """
+    Deliver one claimed batch over a single connection; returns
+    {'sent': n, 'retry': n, 'failed': n}. Messages sent before a crash are
+    marked together at the end, so a worker that dies mid-batch can resend
+    part of it once (delivery is at least once).
+    """
+    batch_size = batch_size or getattr(settings, 'EMAIL_BATCH_SIZE', 100)
+    limiter = limiter or RateLimiter(rate if rate is not None else getattr(settings, 'EMAIL_RATE_LIMIT', 0))
+    results = {'sent': 0, 'retry': 0, 'failed': 0}
+    claimed = claim(batch_size)
+    if not claimed:
+        return results
+
+    started = time.perf_counter()
+    sent = []
+    backend = get_connection(getattr(
+        settings, 'EMAIL_DELIVERY_BACKEND', 'django.core.mail.backends.smtp.EmailBackend'))
+    try:
+        backend.open()
+    except Exception as e:
+        # Server unreachable: the whole batch goes back with a backoff
+        for email in claimed:
+            results[_record_failure(email, f'{type(e).__name__}: {e}')] += 1
+        _count(results)
+        return results
+    try:
+        for email in claimed:
+            limiter.wait()
+            try:
+                try:
+                    backend.send_messages([build_message(email, backend)])
+                except CONNECTION_ERRORS:
+                    # The server dropped us (idle timeout, per-session limit): reconnect once
+                    backend.close()
+                    backend.open()
+                    backend.send_messages([build_message(email, backend)])
+            except Exception as e:
+                results[_record_failure(email, f'{type(e).__name__}: {e}')] += 1
+            else:
+                sent.append(email.pk)
+    finally:
+        try:
+            backend.close()
+        except Exception:
+            logger.warning("Closing the mail connection failed", exc_info=True)
+        if sent:
+            OutboundEmail.objects.filter(id__in=sent).update(
+                status='sent', sent_at=timezone.now(), locked_at=None, last_error='')
+    results['sent'] = len(sent)
+    EMAIL_BATCH_DURATION.observe(time.perf_counter() - started)
+    _count(results)
+    return results
+
+
+def _count(results):
+    for result, count in results.items():
+        if count:
+            EMAILS_SENT.inc((result,), count)
+
+
+def _record_failure(email, error):
+    now = timezone.now()
+    if email.attempts >= getattr(settings, 'EMAIL_MAX_ATTEMPTS', 5):
+        logger.error(f"Email {email.pk} to {email.to} failed after {email.attempts} attempts: {error}")
+        OutboundEmail.objects.filter(pk=email.pk).update(status='failed', locked_at=None, last_error=error)
+        return 'failed'
+    delay = retry_delay(email.attempts)
+    logger.warning(f"Email {email.pk} failed (attempt {email.attempts}), retrying in {delay:.0f}s: {error}")
+    OutboundEmail.objects.filter(pk=email.pk).update(
+        status='queued', send_after=now + timedelta(seconds=delay), locked_at=None, last_error=error)
+    return 'retry'
+
+
+def requeue_stale(timeout=None):
+    """Put messages held by a sender that died back in the queue; returns how many"""
+    timeout = timeout or getattr(settings, 'TASK_LOCK_TIMEOUT', 600)
+    stale = OutboundEmail.objects.filter(
+        status='sending', locked_at__lt=timezone.now() - timedelta(seconds=timeout))
+    return stale.update(status='queued', locked_at=None)
+
+
+def purge_sent(days=None, batch_size=1000):
+    """Delete messages sent more than `days` ago, in batches"""
+    days = days if days is not None else getattr(settings, 'EMAIL_RETENTION_DAYS', 30)
+    old = OutboundEmail.objects.filter(status='sent', sent_at__lt=timezone.now() - timedelta(days=days))
+    deleted = 0
+    while True:
+        ids = list(old.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += OutboundEmail.objects.filter(id__in=ids).delete()[0]
+
+
+def queue_stats():
+    """(queued messages, seconds the oldest due one has waited)"""
+    now = timezone.now()
+    row = OutboundEmail.objects.filter(status='queued', send_after__lte=now).aggregate(
+        depth=Count('id'), oldest=Min('send_after'))
+    return row['depth'], (now - row['oldest']).total_seconds() if row['oldest'] else 0
+
+
+metrics.registry.gauge(
+    'rhci_email_queue_depth', 'Outbound emails ready to send',
+    collect=lambda: {(): queue_stats()[0]})
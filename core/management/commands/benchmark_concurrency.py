@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import secrets
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import httpx
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from apps.beneficiaries.models import PatientCase
+from apps.donations.models import Donation
+from core.management.commands.benchmark_views import git_commit, payment_marks, remove_payments, summarize
+from rhci_platform.testing import AzamPayStub
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    WSGI server that runs at most `threads` requests at a time, the way one
+    gunicorn gthread worker does. Further connections wait in the backlog.
+    """
+    request_queue_size = 1024
+
+    def __init__(self, address, app, threads):
+        super().__init__(address, _QuietHandler)
+        self.set_app(app)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class WSGIWorker:
+    def __init__(self, threads):
+        self.server = PooledWSGIServer(('127.0.0.1', 0), get_wsgi_application(), threads)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ASGIWorker:
+    """One uvicorn worker (a single event loop) serving the ASGI application"""
+
+    def __init__(self):
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError('The ASGI run needs uvicorn (pip install uvicorn)')
+        # The project's application, with the lifespan that opens the shared AzamPay client
+        from rhci_platform.asgi import application
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.server = uvicorn.Server(uvicorn.Config(
+            application, log_level='warning', lifespan='on', backlog=1024))
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.run, kwargs={'sockets': [self.socket]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return f'http://127.0.0.1:{self.socket.getsockname()[1]}'
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join()
+        self.socket.close()
+
+
+async def run_load(base_url, cookies, headers, bodies, concurrency):
+    """POST every body to initiate_payment with `concurrency` requests in flight"""
+    samples, refs = [], []
+    pending = iter(bodies)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=0)
+
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookies, headers=headers,
+                                 limits=limits, timeout=300) as client:
+        async def user():
+            for body in pending:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(reverse('donations:initiate'), json=body)
+                    status = response.status_code
+                    ref = response.json().get('external_id') if status == 200 else None
+                except httpx.HTTPError:
+                    status, ref = 'error', None
+                samples.append((time.perf_counter() - started, status, 0, 0.0, 0, 0))
+                if ref:
+                    refs.append(ref)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return samples, refs, wall
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how many concurrent checkouts one WSGI worker (a fixed thread "
+        "pool) and one ASGI worker (a single event loop) can hold when AzamPay "
+        "is slow. Both serve this project over real sockets against a local "
+        "AzamPay stub; the load generator keeps --concurrency initiate_payment "
+        "requests in flight. Meant for a database filled by generate_dataset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', default='wsgi,asgi', help='Comma-separated: wsgi, asgi')
+        parser.add_argument('--wsgi-threads', type=int, default=4, help='Threads in the WSGI worker')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests kept in flight')
+        parser.add_argument('--requests', type=int, default=200, help='Checkouts per server')
+        parser.add_argument('--azampay-latency', type=float, default=500,
+                            help='Milliseconds the AzamPay stub waits before answering')
+        parser.add_argument('--label', default='', help='Free-form note stored with the results')
+        parser.add_argument('--no-save', action='store_true')
+
+    def handle(self, *args, **options):
+        servers = [name.strip() for name in options['servers'].split(',') if name.strip()]
+        if set(servers) - {'wsgi', 'asgi'}:
+            raise CommandError(f"Unknown server in --servers: {options['servers']}")
+        donor_id = Donation.objects.values_list('donor', flat=True).first()
+        case = PatientCase.objects.filter(status='published').first()
+        if donor_id is None or case is None:
+            raise CommandError('No donations or published case found; run generate_dataset first')
+
+        login = Client()
+        login.force_login(User.objects.get(pk=donor_id))
+        csrf_secret = secrets.token_hex(16)
+        cookies = {
+            settings.SESSION_COOKIE_NAME: login.cookies[settings.SESSION_COOKIE_NAME].value,
+            settings.CSRF_COOKIE_NAME: csrf_secret,
+        }
+        headers = {'X-CSRFToken': csrf_secret, 'Connection': 'close'}
+        bodies = [{
+            'case_id': case.pk, 'amount': '10000', 'payment_channel': 'mno',
+            'provider': 'Mpesa', 'account_number': '255700000000',
+        }] * options['requests']
+
+        if options['verbosity'] < 2:
+            logging.disable(logging.CRITICAL)
+        latency = options['azampay_latency'] / 1000
+        results = {}
+        with AzamPayStub(latency=latency) as stub, override_settings(
+                AZAMPAY_AUTH_BASE=stub.url, AZAMPAY_CHECKOUT_BASE=stub.url,
+                ALLOWED_HOSTS=['127.0.0.1']):
+            for name in servers:
+                worker = WSGIWorker(options['wsgi_threads']) if name == 'wsgi' else ASGIWorker()
+                refs = []
+                marks = payment_marks(case)
+                try:
+                    with worker as base_url:
+                        samples, refs, wall = asyncio.run(
+                            run_load(base_url, cookies, headers, bodies, options['concurrency']))
+                finally:
+                    remove_payments(refs, case, marks)
+                summary = summarize(samples)
+                summary['wall_s'] = round(wall, 2)
+                summary['throughput_rps'] = round(len(samples) / wall, 2)
+                results[name] = summary
+                self.report_line(name, summary, options, latency)
+        logging.disable(logging.NOTSET)
+
+        if not options['no_save']:
+            run = {
+                'timestamp': datetime.now(dt_timezone.utc).isoformat(timespec='seconds'),
+                'commit': git_commit(),
+                'label': options['label'],
+                'options': {k: options[k] for k in (
+                    'wsgi_threads', 'concurrency', 'requests', 'azampay_latency')},
+                'results': results,
+            }
+            results_dir = Path(getattr(settings, 'BENCHMARK_RESULTS_DIR', settings.BASE_DIR / 'benchmark_results'))
+            path = results_dir / 'concurrency' / (
+                f"{run['timestamp'].replace(':', '').replace('-', '')[:15]}-{(run['commit'] or 'nogit')[:8]}.json")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(run, indent=2))
+            self.stdout.write(f"Results written to {path}")
+
+    def report_line(self, name, summary, options, latency):
+        statuses = ' '.join(f'{code}x{n}' for code, n in sorted(summary['statuses'].items()))
+        label = f"{name} ({options['wsgi_threads']} threads)" if name == 'wsgi' else f'{name} (1 event loop)'
+        self.stdout.write(
+            f"{label:<22} {summary['throughput_rps']:>7.1f} req/s  wall {summary['wall_s']:>6.1f}s  "
+            f"p50 {summary['p50_ms'] or 0:>8.1f}ms  p99 {summary['p99_ms'] or 0:>8.1f}ms  "
+            f"in flight {options['concurrency']}, stub {latency * 1000:.0f}ms  [{statuses}]"
+        )
@@ -0,0 +1,307 @@
+import json
+import logging
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, F, Max
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from apps.beneficiaries.models import PatientCase
+from apps.donations.models import Donation, PaymentCallback, Receipt
+from apps.users.models import Notification, NotificationCounter
+from core import outbox
+from core.models import OutboundEmail, Task
+from rhci_platform.cache_tags import case_tag, donor_tag, tagged_cache
+from rhci_platform.testing import AzamPayStub
+from rhci_platform.transactions import write_transaction
+
+# Anonymous client that carries a session cookie
+VISITOR = 'visitor'
+
+DONOR_VIEWS = [
+    'donations:dashboard', 'donations:patients', 'donations:reports', 'donations:treatment_plans',
+    'donations:settings', 'donations:donations', 'donations:discover', 'donations:payments',
+    'donations:notifications', 'donations:profile',
+]
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples):
+    """Reduce a list of (seconds, status, queries, db_seconds, bytes, session_queries) samples"""
+    latencies = sorted(s[0] * 1000 for s in samples)
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample[1])] = statuses.get(str(sample[1]), 0) + 1
+    return {
+        'n': len(samples),
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else None,
+        'p50_ms': round(_percentile(latencies, 0.50), 2) if latencies else None,
+        'p90_ms': round(_percentile(latencies, 0.90), 2) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 0.99), 2) if latencies else None,
+        'max_ms': round(latencies[-1], 2) if latencies else None,
+        'queries': max((s[2] for s in samples), default=None),
+        'db_ms': round(statistics.fmean(s[3] * 1000 for s in samples), 2) if samples else None,
+        'bytes': max((s[4] for s in samples), default=None),
+        'session_queries': max((s[5] for s in samples), default=None),
+        'statuses': statuses,
+    }
+
+
+def payment_marks(case):
+    """Where the tables a payment cycle adds to end before it starts; pass to remove_payments()"""
+    return {
+        'notification': Notification.objects.aggregate(last=Max('id'))['last'] or 0,
+        'email': OutboundEmail.objects.aggregate(last=Max('id'))['last'] or 0,
+        'task': Task.objects.aggregate(last=Max('id'))['last'] or 0,
+        'funded_at': PatientCase.objects.filter(pk=case.pk).values_list('funded_at', flat=True).get(),
+    }
+
+
+def remove_payments(refs, case, marks):
+    """
+    Undo the benchmark payments `refs` to `case`, leaving the outbox log
+    whole: completed donations are refunded through Donation.save(), so the
+    published events still add up and case_totals takes the amounts back
+    off the case. Then the donations and the notifications, unread counts,
+    emails and tasks the cycle caused (rows after `marks` about this case)
+    are deleted.
+    """
+    # Apply outstanding events first, so every completed donation is counted
+    outbox.drain(settle=0)
+    donations = Donation.objects.filter(external_id__in=refs)
+    for donation in donations.filter(status='completed'):
+        donation.status = 'refunded'
+        donation.save(update_fields=['status'])
+    outbox.drain(settle=0)
+
+    url = reverse('core:patient_detail', args=[case.pk])
+    notifications = Notification.objects.filter(id__gt=marks['notification'], url=url)
+    emails = [email.pk for email in OutboundEmail.objects.filter(id__gt=marks['email'])
+              if url in email.message.get('body', '')]
+    donor_ids = set(donations.values_list('donor_id', flat=True))
+    with write_transaction():
+        unread = notifications.filter(read=False).order_by().values('user_id').annotate(count=Count('id'))
+        for row in unread:
+            NotificationCounter.objects.filter(user_id=row['user_id']).update(unread=F('unread') - row['count'])
+        notifications.delete()
+        OutboundEmail.objects.filter(pk__in=emails).delete()
+        Task.objects.filter(id__gt=marks['task'], name='donations.notify_case_donors',
+                            payload__case_id=case.pk).delete()
+        PaymentCallback.objects.filter(donation__in=donations).delete()
+        Receipt.objects.filter(donation__in=donations).delete()
+        donations.delete()
+        PatientCase.objects.filter(pk=case.pk).update(funded_at=marks['funded_at'])
+    tagged_cache.invalidate(case_tag(case.pk), *(donor_tag(pk) for pk in donor_ids if pk))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the public pages, every donor dashboard view, the admin index and "
+        "changelists, and the initiate_payment -> payment_callback cycle "
+        "against a local AzamPay stub. Reports latency percentiles and query "
+        "counts, writes the results to BENCHMARK_RESULTS_DIR and optionally "
+        "compares them with an earlier run. Meant for a database filled by "
+        "generate_dataset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per view')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per view')
+        parser.add_argument('--payments', type=int, default=50, help='Payment cycles to run (0 to skip)')
+        parser.add_argument('--azampay-latency', type=float, default=50,
+                            help='Milliseconds the AzamPay stub waits before answering')
+        parser.add_argument('--only', default='', help='Only run targets whose name contains this')
+        parser.add_argument('--label', default='', help='Free-form note stored with the results')
+        parser.add_argument('--compare', default=None,
+                            help="Earlier result file to compare with, or 'latest'")
+        parser.add_argument('--no-save', action='store_true')
+
+    def handle(self, *args, **options):
+        results_dir = Path(getattr(settings, 'BENCHMARK_RESULTS_DIR', settings.BASE_DIR / 'benchmark_results'))
+        baseline = self.load_baseline(options['compare'], results_dir)
+
+        donor, staff, case = self.setup()
+        targets = self.targets(donor, staff, case)
+        if options['only']:
+            targets = [t for t in targets if options['only'] in t[0]]
+
+        if options['verbosity'] < 2:
+            # Failing views and query budget warnings show up in the table
+            logging.disable(logging.CRITICAL)
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            # Failing views are recorded as 500s instead of aborting the run
+            clients = {user: Client(raise_request_exception=False) for user in (None, VISITOR, donor, staff)}
+            clients[donor].force_login(donor)
+            clients[staff].force_login(staff)
+            self.start_visitor_session(clients[VISITOR])
+            for name, url, user in targets:
+                results[name] = self.time_view(clients[user], url, options['warmup'], options['iterations'])
+                self.report_line(name, results[name], baseline)
+
+            if options['payments'] and (not options['only'] or options['only'].startswith('payment')):
+                for name, summary in self.time_payments(
+                        clients[donor], case, options['payments'], options['azampay_latency'] / 1000).items():
+                    results[name] = summary
+                    self.report_line(name, summary, baseline)
+
+        logging.disable(logging.NOTSET)
+
+        run = {
+            'timestamp': datetime.now(dt_timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'label': options['label'],
+            'database': {'vendor': connection.vendor, 'name': str(connection.settings_dict['NAME'])},
+            'dataset': {
+                'users': User.objects.count(),
+                'cases': PatientCase.objects.count(),
+                'donations': Donation.objects.count(),
+            },
+            'options': {k: options[k] for k in ('iterations', 'warmup', 'payments', 'azampay_latency')},
+            'results': results,
+        }
+        if not options['no_save']:
+            results_dir.mkdir(parents=True, exist_ok=True)
+            stamp = run['timestamp'].replace(':', '').replace('-', '')[:15]
+            path = results_dir / f"{stamp}-{(run['commit'] or 'nogit')[:8]}.json"
+            path.write_text(json.dumps(run, indent=2))
+            self.stdout.write(f"Results written to {path}")
+
+    def setup(self):
+        """Pick the donor with the most donations, a staff user and a busy published case"""
+        top = (Donation.objects.values('donor').annotate(n=Count('id')).order_by('-n').first())
+        if not top:
+            raise CommandError('No donations found; run generate_dataset first')
+        donor = User.objects.get(pk=top['donor'])
+        staff = User.objects.filter(is_superuser=True, is_active=True).first()
+        if staff is None:
+            staff = User.objects.create_superuser('benchmark_staff', 'benchmark_staff@example.org', None)
+        case = PatientCase.objects.filter(status='published').order_by('-amount_raised').first()
+        if case is None:
+            raise CommandError('No published case found')
+        self.stdout.write(f"Donor {donor.username} ({top['n']} donations), staff {staff.username}, case {case.pk}")
+        return donor, staff, case
+
+    def start_visitor_session(self, client):
+        """Give the anonymous visitor a session, as a flash message or login redirect would"""
+        session = client.session
+        session['next'] = reverse('donations:dashboard')
+        session.save()
+        client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def targets(self, donor, staff, case):
+        targets = [
+            ('core:home', reverse('core:home'), None),
+            ('core:home[visitor]', reverse('core:home'), VISITOR),
+            ('core:patient_detail', reverse('core:patient_detail', args=[case.pk]), None),
+            ('core:discover', reverse('core:discover'), None),
+        ]
+        targets += [(name, reverse(name), donor) for name in DONOR_VIEWS]
+        targets.append(('admin:index', reverse('admin:index'), staff))
+        for model in admin.site._registry:
+            name = f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist'
+            targets.append((name, reverse(name), staff))
+        return targets
+
+    def time_view(self, client, url, warmup, iterations):
+        for _ in range(warmup):
+            client.get(url)
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            response = client.get(url)
+            samples.append(self.sample(time.perf_counter() - started, response))
+        return summarize(samples)
+
+    def sample(self, elapsed, response):
+        recorder = getattr(response, 'query_recorder', None)
+        statements = recorder.statements.items() if recorder else ()
+        return (
+            elapsed, response.status_code,
+            recorder.count if recorder else 0, recorder.duration if recorder else 0.0,
+            len(response.content) if not response.streaming else 0,
+            sum(times for sql, times in statements if 'django_session' in sql),
+        )
+
+    def time_payments(self, client, case, count, latency):
+        """Run `count` initiate -> success callback cycles, then remove what they created"""
+        initiated, called_back = [], []
+        refs = []
+        marks = payment_marks(case)
+        with AzamPayStub(latency=latency) as stub, override_settings(
+                AZAMPAY_AUTH_BASE=stub.url, AZAMPAY_CHECKOUT_BASE=stub.url):
+            try:
+                for n in range(count):
+                    body = {
+                        'case_id': case.pk, 'amount': '10000', 'payment_channel': 'mno',
+                        'provider': 'Mpesa', 'account_number': '255700000000',
+                    }
+                    started = time.perf_counter()
+                    response = client.post(reverse('donations:initiate'), json.dumps(body),
+                                           content_type='application/json')
+                    initiated.append(self.sample(time.perf_counter() - started, response))
+                    ref = response.json().get('external_id') if response.status_code == 200 else None
+                    if not ref:
+                        continue
+                    refs.append(ref)
+                    callback = {
+                        'utilityref': ref, 'msisdn': '255700000000', 'amount': '10000',
+                        'message': 'Success', 'operator': 'Mpesa', 'reference': f'bench{n}',
+                        'transactionstatus': 'success', 'submerchantAcc': None, 'fspReferenceId': f'bench{n}',
+                    }
+                    started = time.perf_counter()
+                    response = client.post(reverse('donations:callback'), json.dumps(callback),
+                                           content_type='application/json')
+                    called_back.append(self.sample(time.perf_counter() - started, response))
+            finally:
+                remove_payments(refs, case, marks)
+        return {'payment:initiate': summarize(initiated), 'payment:callback': summarize(called_back)}
+
+    def load_baseline(self, compare, results_dir):
+        if not compare:
+            return None
+        if compare == 'latest':
+            files = sorted(results_dir.glob('*.json'))
+            if not files:
+                raise CommandError(f'No earlier results in {results_dir}')
+            path = files[-1]
+        else:
+            path = Path(compare)
+        self.stdout.write(f"Comparing with {path}")
+        return json.loads(path.read_text())['results']
+
+    def report_line(self, name, summary, baseline):
+        statuses = ' '.join(f'{code}x{n}' for code, n in sorted(summary['statuses'].items()))
+        line = (f"{name:<52} p50 {summary['p50_ms'] or 0:>8.1f}ms  p90 {summary['p90_ms'] or 0:>8.1f}ms  "
+                f"p99 {summary['p99_ms'] or 0:>8.1f}ms  {summary['queries'] or 0:>4} queries  "
+                f"{summary.get('session_queries') or 0:>2} session  [{statuses}]")
+        before = (baseline or {}).get(name)
+        if before and before.get('p50_ms') and summary['p50_ms']:
+            change = (summary['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+            line += f"  p50 {change:+.0f}% queries {before['queries']}->{summary['queries']}"
+        self.stdout.write(line)
@@ -0,0 +1,40 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rhci_platform.transactions import write_transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired django_session rows in small batches, so the cleanup "
+        "never holds a long write lock. Run it from cron instead of "
+        "clearsessions, which deletes every expired row in one statement."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--max-batches', type=int, default=0, help='Stop after this many (0 = no limit)')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = Session.objects.filter(expire_date__lt=now).order_by('expire_date')
+        deleted = batches = 0
+        started = time.perf_counter()
+        while not options['max_batches'] or batches < options['max_batches']:
+            keys = list(expired.values_list('session_key', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            with write_transaction():
+                deleted += Session.objects.filter(session_key__in=keys, expire_date__lt=now).delete()[0]
+            batches += 1
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(
+            f"Deleted {deleted} expired sessions in {batches} batches "
+            f"({time.perf_counter() - started:.1f}s)"
+        )
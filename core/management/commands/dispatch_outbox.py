@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver outbox events to their subscribers until all have caught up. "
+        "run_tasks does this too; use this command to catch up after an "
+        "outage, or with --replay to rebuild one subscriber from the event log."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--replay', metavar='SUBSCRIBER',
+                            help='Reset this subscriber and deliver the log to it again')
+        parser.add_argument('--position', type=int, default=0,
+                            help='Event id to replay after (default: the whole log)')
+        parser.add_argument('--status', action='store_true', help='Only print each subscriber\'s backlog')
+
+    def handle(self, *args, **options):
+        if options['replay']:
+            if options['replay'] not in outbox.backlog():
+                raise CommandError(f"Unknown subscriber {options['replay']!r}")
+            outbox.replay(options['replay'], options['position'])
+            self.stdout.write(f"Moved {options['replay']} back to event {options['position']}")
+
+        if not options['status']:
+            started = time.perf_counter()
+            consumed = outbox.drain(options['batch_size'], timeout=float('inf'))
+            self.stdout.write(f"Delivered {consumed} events in {time.perf_counter() - started:.1f}s")
+
+        for name, behind in outbox.backlog().items():
+            self.stdout.write(f"{name:<32} {behind} events behind")
@@ -0,0 +1,410 @@
+import multiprocessing
+import random
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import DecimalField, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from apps.beneficiaries.models import BudgetItem, Patient, PatientCase, TreatmentStep
+from apps.donations.models import Donation, PaymentCallback, Receipt
+from apps.users.models import Profile
+from rhci_platform.cache_tags import HOME, tagged_cache
+
+FIRST_NAMES = [
+    'Asha', 'Baraka', 'Neema', 'Juma', 'Rehema', 'Hamisi', 'Zawadi', 'Imani', 'Upendo', 'Faraja',
+    'Amani', 'Saida', 'Musa', 'Halima', 'Daudi', 'Mwanaisha', 'Elia', 'Tumaini', 'Rashidi', 'Pendo',
+]
+LAST_NAMES = [
+    'Mushi', 'Mwakyusa', 'Kimaro', 'Massawe', 'Lyimo', 'Mrema', 'Ngowi', 'Shirima', 'Temba', 'Swai',
+    'Mollel', 'Laizer', 'Komba', 'Njau', 'Minja', 'Kessy', 'Mbwambo', 'Urio', 'Tarimo', 'Kavishe',
+]
+REGIONS = [
+    ('Dar es Salaam', 'Dar es Salaam'), ('Arusha', 'Arusha'), ('Mwanza', 'Mwanza'),
+    ('Dodoma', 'Dodoma'), ('Moshi', 'Kilimanjaro'), ('Mbeya', 'Mbeya'), ('Tanga', 'Tanga'),
+    ('Morogoro', 'Morogoro'), ('Zanzibar', 'Unguja'), ('Iringa', 'Iringa'),
+]
+DIAGNOSES = [
+    'Congenital heart defect', 'Hydrocephalus', 'Spina bifida', 'Cleft lip and palate',
+    'Clubfoot', 'Burn contractures', 'Cataract', 'Hernia', 'Kidney stones', 'Bowed legs',
+]
+HOSPITALS = [
+    'Muhimbili National Hospital', 'CCBRT Hospital', 'KCMC', 'Bugando Medical Centre',
+    'Jakaya Kikwete Cardiac Institute', 'Mbeya Zonal Referral Hospital', 'Aga Khan Hospital',
+]
+STEP_TITLES = ['Assessment', 'Pre-operative tests', 'Surgery', 'Recovery', 'Follow-up visit', 'Physiotherapy']
+PROVIDERS = {'mno': ['Mpesa', 'Airtel', 'Tigo', 'Halopesa', 'Azampesa'], 'bank': ['CRDB', 'NMB']}
+
+# (value, weight) tables for the shape of the data
+CASE_STATUSES = [('published', 55), ('completed', 20), ('draft', 8), ('pending', 7), ('paused', 5), ('archived', 5)]
+DONATION_STATUSES = [('completed', 70), ('failed', 10), ('pending', 8), ('initiated', 7), ('processing', 3), ('refunded', 2)]
+DONOR_TYPES = [('Individual', 85), ('Company CSR', 10), ('NGO', 5)]
+CALLBACK_STATUSES = {'completed': 'success', 'refunded': 'success', 'failed': 'failure'}
+
+# What later stages need from rows already inserted; model instances for
+# hundreds of thousands of rows would not fit comfortably in memory
+DonorRow = namedtuple('DonorRow', 'pk last_name')
+PatientRow = namedtuple('PatientRow', 'pk first_name city created_at')
+CaseRow = namedtuple('CaseRow', 'pk patient_id created_at start_date status')
+
+
+def _weighted(rng, table, k):
+    values, weights = zip(*table)
+    return rng.choices(values, weights=weights, k=k)
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+DonationPlan = namedtuple(
+    'DonationPlan',
+    'seed prefix anchor window batch_size cases donors case_weights donor_weights',
+)
+# Set by Command.generate_donations before forking worker processes
+_plan = None
+
+
+def _random_time(rng, anchor, window, not_before=None):
+    start = max(not_before, anchor - window) if not_before else anchor - window
+    span = max((anchor - start).total_seconds(), 1)
+    return start + timedelta(seconds=rng.random() * span)
+
+
+def _insert_donation_chunk(bounds):
+    """
+    Generate and insert donations `bounds[0]` to `bounds[1]` of the plan,
+    with a callback for every settled donation and a receipt for every
+    completed one. Return (donations, callbacks, receipts) inserted.
+    """
+    plan = _plan
+    first, stop = bounds
+    rng = random.Random(f'{plan.seed}:donations:{first}')
+    totals = [0, 0, 0]
+    for batch_start in range(first, stop, plan.batch_size):
+        donations, callbacks, receipts = [], [], []
+        for n in range(batch_start, min(batch_start + plan.batch_size, stop)):
+            case = rng.choices(plan.cases, cum_weights=plan.case_weights)[0]
+            channel = 'mno' if rng.random() < 0.85 else 'bank'
+            status = _weighted(rng, DONATION_STATUSES, 1)[0]
+            created = _random_time(rng, plan.anchor, plan.window, not_before=case.created_at)
+            completed = created + timedelta(seconds=rng.randint(5, 600))
+            external_id = f'{plan.prefix}_{n:09d}'
+            donation = Donation(
+                id=uuid.uuid5(uuid.NAMESPACE_OID, external_id),
+                case_id=case.pk, donor_id=rng.choices(plan.donors, cum_weights=plan.donor_weights)[0],
+                amount=Decimal(rng.choice([5_000, 10_000, 20_000, 50_000, 100_000, 250_000])),
+                is_anonymous=rng.random() < 0.15, payment_channel=channel,
+                payment_provider=rng.choice(PROVIDERS[channel]),
+                account_number=f'2557{rng.randint(10_000_000, 99_999_999)}',
+                external_id=external_id, azampay_transaction_id=f'AZM{n:012d}',
+                status=status, created_at=created,
+                updated_at=completed if status in CALLBACK_STATUSES else created,
+                completed_at=completed if status == 'completed' else None,
+            )
+            donations.append(donation)
+            if status in CALLBACK_STATUSES:
+                callbacks.append(PaymentCallback(
+                    donation_id=donation.id, msisdn=donation.account_number,
+                    amount=str(donation.amount),
+                    message='Success' if status != 'failed' else 'Insufficient balance',
+                    utility_ref=external_id, operator=donation.payment_provider,
+                    reference=f'REF{n:012d}', transaction_status=CALLBACK_STATUSES[status],
+                    fsp_reference_id=f'FSP{n:012d}',
+                    raw_payload={'utilityref': external_id, 'amount': str(donation.amount),
+                                 'transactionstatus': CALLBACK_STATUSES[status]},
+                    received_at=completed,
+                ))
+            if status == 'completed':
+                receipts.append(Receipt(
+                    donation_id=donation.id, amount=donation.amount, currency=donation.currency,
+                    receipt_number=f'RCP{created:%Y%m%d}{donation.id.hex[:16]}',
+                    generated_at=completed,
+                ))
+        with transaction.atomic():
+            Donation.objects.bulk_create(donations, batch_size=plan.batch_size)
+            PaymentCallback.objects.bulk_create(callbacks, batch_size=plan.batch_size)
+            Receipt.objects.bulk_create(receipts, batch_size=plan.batch_size)
+        totals[0] += len(donations)
+        totals[1] += len(callbacks)
+        totals[2] += len(receipts)
+    return tuple(totals)
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create keep the created_at/updated_at values we generate"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a realistic, reproducible dataset for performance work: donor "
+        "users with profiles, patients, cases with treatment steps and budget "
+        "items, donations, payment callbacks and receipts. The same --seed and "
+        "--anchor always produce the same rows. Run it against an empty "
+        "database (see DJANGO_DB_NAME)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--anchor', type=str, default=None,
+                            help='Newest timestamp in the data, YYYY-MM-DD (default: today)')
+        parser.add_argument('--days', type=int, default=3 * 365, help='History length in days')
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='Multiply every volume below, e.g. 0.01 for a quick run')
+        parser.add_argument('--donors', type=int, default=100_000)
+        parser.add_argument('--patients', type=int, default=200_000)
+        parser.add_argument('--cases-per-patient', type=float, default=1.25)
+        parser.add_argument('--steps-per-case', type=int, default=4)
+        parser.add_argument('--budget-items-per-case', type=int, default=3)
+        parser.add_argument('--donations', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes inserting donations in parallel (useful on PostgreSQL)')
+        parser.add_argument('--password', default='benchmark',
+                            help='Password shared by every generated user')
+        parser.add_argument('--prefix', default='gen', help='Prefix for generated usernames and references')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+        scale = options['scale']
+        counts = {
+            'donors': max(int(options['donors'] * scale), 1),
+            'patients': max(int(options['patients'] * scale), 1),
+            'donations': int(options['donations'] * scale),
+        }
+        counts['cases'] = max(int(counts['patients'] * options['cases_per_patient']), 1)
+        anchor_date = (datetime.strptime(options['anchor'], '%Y-%m-%d').date()
+                       if options['anchor'] else datetime.now(dt_timezone.utc).date())
+        self.anchor = datetime.combine(anchor_date, dt_time.min, tzinfo=dt_timezone.utc)
+        self.window = timedelta(days=options['days'])
+        self.seed = options['seed']
+
+        if User.objects.filter(username__startswith=f'{self.prefix}_donor_').exists():
+            raise CommandError(f"Generated users with prefix '{self.prefix}' already exist; "
+                               f"use another --prefix or an empty database")
+
+        self.stdout.write(f"Seed {self.seed}, anchor {anchor_date}, {options['days']} days, "
+                          f"batch size {self.batch_size}")
+        started = time.perf_counter()
+        with explicit_timestamps(User, Patient, PatientCase, Donation, PaymentCallback, Receipt):
+            donor_ids = self.generate_donors(counts['donors'], options['password'])
+            patients = self.generate_patients(counts['patients'])
+            cases = self.generate_cases(counts['cases'], patients)
+            self.generate_case_details(cases, options['steps_per_case'], options['budget_items_per_case'])
+            self.generate_donations(counts['donations'], donor_ids, cases, options['workers'])
+        self.update_amount_raised(cases)
+        # bulk_create sends no signals; the home page lists the newest cases
+        tagged_cache.invalidate(HOME)
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.perf_counter() - started:.1f}s"))
+
+    def rng(self, name):
+        # Independent stream per entity, so changing one volume leaves the others alone
+        return random.Random(f'{self.seed}:{name}')
+
+    def random_time(self, rng, not_before=None):
+        return _random_time(rng, self.anchor, self.window, not_before)
+
+    def insert(self, model, objects, label, keep=None):
+        """
+        bulk_create `objects` in batches, one transaction per batch. Return
+        `keep(obj)` for every inserted object when `keep` is given.
+        """
+        started = time.perf_counter()
+        created = []
+        total = 0
+        for batch in _batched(objects, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+            total += len(batch)
+            if keep:
+                created.extend(keep(obj) for obj in batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"  {label:<16} {total:>10,} rows in {elapsed:6.1f}s "
+                          f"({total / max(elapsed, 1e-6):,.0f}/s)")
+        return created
+
+    def generate_donors(self, count, password):
+        rng = self.rng('donors')
+        password_hash = make_password(password)
+
+        def users():
+            for n in range(count):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                yield User(
+                    username=f'{self.prefix}_donor_{n}', email=f'{self.prefix}.donor{n}@example.org',
+                    first_name=first, last_name=last, password=password_hash,
+                    date_joined=self.random_time(rng),
+                )
+
+        users_created = self.insert(User, users(), 'users', keep=lambda u: DonorRow(u.pk, u.last_name))
+        donor_types = _weighted(rng, DONOR_TYPES, len(users_created))
+        profiles = (
+            Profile(
+                user_id=user.pk, is_donor=True, donor_type=donor_type,
+                organization_name=f'{user.last_name} Group' if donor_type != 'Individual' else None,
+                country='Tanzania', city=rng.choice(REGIONS)[0],
+                payment_preference=rng.choice(['One-time', 'Periodic', 'Not sure']),
+            )
+            for user, donor_type in zip(users_created, donor_types)
+        )
+        self.insert(Profile, profiles, 'profiles')
+        return [user.pk for user in users_created]
+
+    def generate_patients(self, count):
+        rng = self.rng('patients')
+
+        def patients():
+            for _ in range(count):
+                city, region = rng.choice(REGIONS)
+                created = self.random_time(rng)
+                yield Patient(
+                    first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                    dob=(created - timedelta(days=rng.randint(180, 16 * 365))).date(),
+                    gender=rng.choice('MF'), city=city, region=region,
+                    guardian_name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                    guardian_contact=f'2557{rng.randint(10_000_000, 99_999_999)}',
+                    created_at=created,
+                )
+
+        return self.insert(Patient, patients(), 'patients',
+                           keep=lambda p: PatientRow(p.pk, p.first_name, p.city, p.created_at))
+
+    def generate_cases(self, count, patients):
+        rng = self.rng('cases')
+        statuses = _weighted(rng, CASE_STATUSES, count)
+
+        def cases():
+            for n in range(count):
+                # Every patient gets a case; the remainder go to random patients
+                patient = patients[n] if n < len(patients) else rng.choice(patients)
+                diagnosis = rng.choice(DIAGNOSES)
+                created = self.random_time(rng, not_before=patient.created_at)
+                status = statuses[n]
+                yield PatientCase(
+                    patient_id=patient.pk, title=f'{diagnosis} treatment for {patient.first_name}',
+                    story=f'{patient.first_name} from {patient.city} needs treatment for {diagnosis.lower()}.',
+                    diagnosis=diagnosis, hospital_name=rng.choice(HOSPITALS),
+                    doctor_name=f'Dr. {rng.choice(LAST_NAMES)}',
+                    target_amount=Decimal(rng.randrange(500_000, 15_000_000, 50_000)),
+                    start_date=created.date(), end_date=(created + timedelta(days=rng.randint(30, 180))).date(),
+                    status=status,
+                    published_at=created + timedelta(days=rng.randint(0, 7)) if status != 'draft' else None,
+                    created_at=created, updated_at=created,
+                )
+
+        return self.insert(PatientCase, cases(), 'cases',
+                           keep=lambda c: CaseRow(c.pk, c.patient_id, c.created_at, c.start_date, c.status))
+
+    def generate_case_details(self, cases, steps_per_case, budget_items_per_case):
+        rng = self.rng('case_details')
+        step_statuses = ['completed', 'in_progress', 'planned', 'delayed']
+
+        def steps():
+            for case in cases:
+                for index in range(rng.randint(max(steps_per_case - 2, 1), steps_per_case + 2)):
+                    planned = case.start_date + timedelta(days=index * rng.randint(5, 20))
+                    status = rng.choice(step_statuses)
+                    yield TreatmentStep(
+                        case_id=case.pk, title=STEP_TITLES[index % len(STEP_TITLES)],
+                        description=f'Step {index + 1} of the treatment plan', planned_date=planned,
+                        actual_date=planned if status == 'completed' else None,
+                        status=status, order_index=index,
+                    )
+
+        def budget_items():
+            categories = [choice for choice, _ in BudgetItem.CATEGORY_CHOICES]
+            for case in cases:
+                for category in rng.sample(categories, min(budget_items_per_case, len(categories))):
+                    yield BudgetItem(
+                        category=category, patient_id=case.patient_id, case_id=case.pk,
+                        cost=Decimal(rng.randrange(50_000, 3_000_000, 10_000)),
+                        expected_date=case.start_date + timedelta(days=rng.randint(0, 60)),
+                    )
+
+        self.insert(TreatmentStep, steps(), 'treatment steps')
+        self.insert(BudgetItem, budget_items(), 'budget items')
+
+    def generate_donations(self, count, donor_ids, cases, workers):
+        rng = self.rng('donations')
+        fundable = [case for case in cases if case.status != 'draft'] or cases
+        rng.shuffle(fundable)
+        donor_order = donor_ids[:]
+        rng.shuffle(donor_order)
+        global _plan
+        _plan = DonationPlan(
+            seed=self.seed, prefix=self.prefix, anchor=self.anchor, window=self.window,
+            batch_size=self.batch_size, cases=fundable, donors=donor_order,
+            # Popularity is long-tailed: a few cases and donors account for most donations
+            case_weights=list(accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(fundable)))),
+            donor_weights=list(accumulate(1 / (rank + 1) ** 0.6 for rank in range(len(donor_order)))),
+        )
+        # Each chunk has its own random stream, so the rows do not depend on --workers
+        chunk_size = self.batch_size * 10
+        chunks = [(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+
+        started = time.perf_counter()
+        if workers > 1 and len(chunks) > 1:
+            if connection.vendor == 'sqlite':
+                self.stdout.write(self.style.WARNING(
+                    "  SQLite allows one writer at a time; --workers mostly adds lock waits"))
+            # Children inherit the plan and settings through fork and open their own connections
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                results = pool.map(_insert_donation_chunk, chunks)
+        else:
+            results = [_insert_donation_chunk(chunk) for chunk in chunks]
+        elapsed = time.perf_counter() - started
+
+        donations, callbacks, receipts = (sum(column) for column in zip(*results)) if results else (0, 0, 0)
+        rows = donations + callbacks + receipts
+        self.stdout.write(
+            f"  {'donations':<16} {donations:>10,} rows, {callbacks:,} callbacks, "
+            f"{receipts:,} receipts in {elapsed:6.1f}s ({rows / max(elapsed, 1e-6):,.0f} rows/s)"
+        )
+
+    def update_amount_raised(self, cases):
+        """
+        Set amount_raised on the generated cases from their completed
+        donations, and funded_at on those at or over target (the last
+        completion), so the next donation does not announce them as funded
+        """
+        started = time.perf_counter()
+        completed = Donation.objects.filter(case=OuterRef('pk'), status='completed').values('case')
+        raised = completed.annotate(total=Sum('amount')).values('total')
+        last_completed = completed.annotate(last=Max('completed_at')).values('last')
+        ids = [case.pk for case in cases]
+        for batch in _batched(ids, self.batch_size):
+            with transaction.atomic():
+                PatientCase.objects.filter(pk__in=batch).update(
+                    amount_raised=Coalesce(Subquery(raised), Value(Decimal('0')),
+                                           output_field=DecimalField(max_digits=12, decimal_places=2)),
+                    funded_at=None,
+                )
+                PatientCase.objects.filter(pk__in=batch, amount_raised__gte=F('target_amount')).update(
+                    funded_at=Subquery(last_completed))
+        self.stdout.write(f"  {'amount_raised':<16} {len(ids):>10,} cases in {time.perf_counter() - started:6.1f}s")
@@ -0,0 +1,93 @@
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import outbox, tasks
+
+HOUSEKEEPING_SECONDS = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Process background tasks from the database queue and deliver outbox "
+        "events to their subscribers. Run one or more workers next to the web "
+        "processes; each claims --batch-size ready tasks at a time. "
+        "SIGTERM/SIGINT stop the worker after the current batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit when no task is ready')
+        parser.add_argument('--max-tasks', type=int, default=0, help='Exit after this many (0 = no limit)')
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help='Seconds between throughput/lag lines (0 = off)')
+        parser.add_argument('--worker-id', default=f'{socket.gethostname()}:{os.getpid()}')
+        parser.add_argument('--no-outbox', action='store_true',
+                            help='Leave outbox events to other workers or dispatch_outbox')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        worker = options['worker_id']
+        processed = 0
+        results = {}
+        window_started = time.monotonic()
+        housekept = float('-inf')
+        window_count = 0
+        self.stdout.write(f"Worker {worker} started")
+
+        while not self.stopping:
+            close_old_connections()
+            if time.monotonic() - housekept >= HOUSEKEEPING_SECONDS:
+                self.housekeeping()
+                housekept = time.monotonic()
+
+            claimed = tasks.claim(worker, options['batch_size'])
+            delivered = 0 if options['no_outbox'] else outbox.dispatch()
+            if not claimed and not delivered:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+            for task in claimed:
+                result = tasks.run(task)
+                results[result] = results.get(result, 0) + 1
+            processed += len(claimed)
+            window_count += len(claimed)
+
+            elapsed = time.monotonic() - window_started
+            if options['stats_interval'] and elapsed >= options['stats_interval']:
+                self.report(window_count, elapsed, results)
+                window_started, window_count = time.monotonic(), 0
+            if options['max_tasks'] and processed >= options['max_tasks']:
+                break
+
+        summary = ', '.join(f'{n} {result}' for result, n in sorted(results.items())) or 'nothing'
+        self.stdout.write(f"Worker {worker} stopped after {processed} tasks ({summary})")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def housekeeping(self):
+        requeued = tasks.requeue_stale()
+        purged = tasks.purge_finished()
+        if requeued or purged:
+            self.stdout.write(f"Requeued {requeued} stale tasks, purged {purged} finished tasks")
+
+    def report(self, count, elapsed, results):
+        stats = tasks.queue_stats()
+        backlog = sum(depth for depth, lag in stats.values())
+        lag = max((lag for depth, lag in stats.values()), default=0)
+        events = max(outbox.backlog().values(), default=0)
+        self.stdout.write(
+            f"{count / elapsed:.1f} tasks/s, {backlog} queued, oldest due {lag:.1f}s ago, "
+            f"{results.get('retry', 0)} retried, {results.get('failed', 0)} failed so far, "
+            f"{events} outbox events behind"
+        )
@@ -0,0 +1,74 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import mail
+
+HOUSEKEEPING_SECONDS = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver queued email. Each batch of --batch-size messages goes over "
+        "one connection to the mail server, paced to --rate messages a second "
+        "across batches. SIGTERM/SIGINT stop the sender after the current batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Messages per connection (default EMAIL_BATCH_SIZE)')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Messages per second, 0 for no limit (default EMAIL_RATE_LIMIT)')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait when nothing is queued')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help='Seconds between throughput lines (0 = off)')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        rate = options['rate'] if options['rate'] is not None else getattr(settings, 'EMAIL_RATE_LIMIT', 0)
+        # One limiter for the whole run, so the rate holds across batches
+        limiter = mail.RateLimiter(rate)
+        totals = {'sent': 0, 'retry': 0, 'failed': 0}
+        window_sent, window_started = 0, time.monotonic()
+        housekept = float('-inf')
+
+        while not self.stopping:
+            close_old_connections()
+            if time.monotonic() - housekept >= HOUSEKEEPING_SECONDS:
+                self.housekeeping()
+                housekept = time.monotonic()
+
+            results = mail.send_queued(options['batch_size'], limiter=limiter)
+            for result, count in results.items():
+                totals[result] += count
+            window_sent += results['sent']
+            if not any(results.values()):
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+
+            elapsed = time.monotonic() - window_started
+            if options['stats_interval'] and elapsed >= options['stats_interval']:
+                depth, lag = mail.queue_stats()
+                self.stdout.write(f"{window_sent / elapsed:.1f} emails/s, {depth} queued, oldest {lag:.0f}s")
+                window_sent, window_started = 0, time.monotonic()
+
+        self.stdout.write(
+            f"Sent {totals['sent']} emails ({totals['retry']} to retry, {totals['failed']} failed)")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def housekeeping(self):
+        requeued = mail.requeue_stale()
+        purged = mail.purge_sent()
+        if requeued or purged:
+            self.stdout.write(f"Requeued {requeued} stale emails, purged {purged} sent emails")
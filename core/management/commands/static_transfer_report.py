@@ -0,0 +1,70 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+ASSET_RE = re.compile(r'''(?:src|href)=["']([^"']+)["']''')
+
+
+def _header_bytes(response):
+    return sum(len(k) + len(v) + 4 for k, v in response.items()) + 17
+
+
+def _body_bytes(response):
+    if getattr(response, 'streaming', False):
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def _is_cacheable(response):
+    cache_control = response.get('Cache-Control', '')
+    match = re.search(r'max-age=(\d+)', cache_control)
+    return bool(match and int(match.group(1)) > 0) and 'no-cache' not in cache_control
+
+
+class Command(BaseCommand):
+    help = (
+        "Report bytes transferred for a first and a repeat load of a page and "
+        "its static assets, with and without compression negotiation. "
+        "Run collectstatic first when DEBUG is off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/')
+        parser.add_argument('--encoding', default='br, gzip',
+                            help="Accept-Encoding sent by the client ('' for none)")
+
+    def handle(self, *args, **options):
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            client = Client(HTTP_ACCEPT_ENCODING=options['encoding'])
+            page = client.get(options['path'])
+            html = page.content.decode('utf-8', 'replace')
+            assets = sorted({
+                url for url in ASSET_RE.findall(html)
+                if url.startswith(settings.STATIC_URL)
+            })
+
+            first = _header_bytes(page) + len(page.content)
+            repeat = _header_bytes(page) + len(page.content)
+            cached = 0
+            for url in assets:
+                response = client.get(url)
+                first += _header_bytes(response) + _body_bytes(response)
+                if response.status_code == 200 and _is_cacheable(response):
+                    cached += 1
+                    continue
+                # Browser revalidates anything it may not reuse from cache
+                conditional = {}
+                if response.get('ETag'):
+                    conditional['HTTP_IF_NONE_MATCH'] = response['ETag']
+                if response.get('Last-Modified'):
+                    conditional['HTTP_IF_MODIFIED_SINCE'] = response['Last-Modified']
+                revalidated = client.get(url, **conditional)
+                repeat += _header_bytes(revalidated) + _body_bytes(revalidated)
+
+        self.stdout.write(f"Page:            {options['path']} ({len(assets)} static assets)")
+        self.stdout.write(f"Accept-Encoding: {options['encoding'] or '(none)'}")
+        self.stdout.write(f"First load:      {first:,} bytes")
+        self.stdout.write(f"Repeat load:     {repeat:,} bytes "
+                          f"({cached} assets from cache, {len(assets) - cached} requested)")
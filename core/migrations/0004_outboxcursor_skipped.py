@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-19 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_outbound_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxcursor',
+            name='skipped',
+            field=models.JSONField(blank=True, default=list, help_text='[first, last, skipped_at] id ranges passed over before they committed'),
+        ),
+    ]
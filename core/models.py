@@ -1,3 +1,137 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class Task(models.Model):
+    """A unit of background work, claimed and run by `manage.py run_tasks`"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Claim query: ready tasks, oldest first
+            models.Index(
+                fields=['run_after', 'id'],
+                condition=models.Q(status='queued'),
+                name='task_ready_idx',
+            ),
+            # Requeueing tasks whose worker died
+            models.Index(
+                fields=['locked_at'],
+                condition=models.Q(status='running'),
+                name='task_running_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+class TaskLock(models.Model):
+    """
+    Lock row for databases without SELECT ... FOR UPDATE SKIP LOCKED.
+    Claimers update it first, which serializes them (on SQLite it takes the
+    database write lock at the start of the claim).
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    holder = models.CharField(max_length=100, blank=True)
+    acquired_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class OutboxEvent(models.Model):
+    """
+    An event written in the same transaction as the change it describes.
+    `core.outbox` delivers events to subscribers in id order.
+    """
+    topic = models.CharField(max_length=100)
+    key = models.CharField(max_length=64, help_text='Id of the object the event is about')
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['topic', 'key'], name='outbox_topic_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} {self.key} #{self.pk}"
+
+
+class OutboxCursor(models.Model):
+    """The last event id each subscriber has processed"""
+    subscriber = models.CharField(max_length=100, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    skipped = models.JSONField(
+        default=list, blank=True,
+        help_text='[first, last, skipped_at] id ranges passed over before they committed')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.subscriber} @ {self.position}"
+
+
+class OutboundEmail(models.Model):
+    """
+    A message queued by core.mail.OutboxBackend and delivered by
+    `manage.py send_emails` over one reused connection per batch.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    # Lower goes first: password resets overtake a campaign already queued
+    PRIORITY_TRANSACTIONAL = 0
+    PRIORITY_BULK = 10
+
+    subject = models.CharField(max_length=255)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    message = models.JSONField(default=dict, help_text='Body, alternatives, headers and the other recipients')
+    priority = models.PositiveSmallIntegerField(default=PRIORITY_TRANSACTIONAL)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Claim query: ready messages by priority, oldest first
+            models.Index(
+                fields=['priority', 'send_after', 'id'],
+                condition=models.Q(status='queued'),
+                name='email_ready_idx',
+            ),
+            models.Index(
+                fields=['locked_at'],
+                condition=models.Q(status='sending'),
+                name='email_sending_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
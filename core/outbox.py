@@ -0,0 +1,224 @@
+"""
+Transactional outbox: events written with the change they describe, then
+delivered to in-process subscribers by `manage.py run_tasks` (or
+`manage.py dispatch_outbox`).
+
+Call `publish(topic, key, payload)` inside the transaction that makes the
+change; the event commits or rolls back with it. Register consumers with
+`@subscriber('name', topics=[...])`. Each subscriber receives batches of
+events in id order and keeps its own cursor; its writes and the cursor move
+commit together, so a batch is applied exactly once. A subscriber that
+raises is retried from the same position on the next pass and holds up
+nobody else.
+
+A missing id may belong to a transaction that has not committed yet. It
+holds delivery back for OUTBOX_SETTLE_SECONDS; after that the cursor moves
+past it and remembers it. Each pass looks for remembered ids again for
+OUTBOX_RECHECK_SECONDS, and delivers one that turns up late ahead of the
+new batch, so out of id order. Every skip, late delivery and abandoned
+gap is logged and counted in rhci_outbox_gaps_total.
+
+Because the log is kept, a subscriber can be replayed from any position
+with `replay()`. Subscribers that maintain aggregates pass `reset=` to
+clear them first; the rest must tolerate seeing an event twice.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from rhci_platform import metrics
+from rhci_platform.transactions import write_transaction
+
+from .models import OutboxCursor, OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+_subscribers = {}
+
+EVENTS_DELIVERED = metrics.registry.counter(
+    'rhci_outbox_events_total', 'Outbox events delivered by subscriber', ['subscriber'])
+DISPATCH_ERRORS = metrics.registry.counter(
+    'rhci_outbox_errors_total', 'Outbox batches that raised, by subscriber', ['subscriber'])
+DELIVERY_LAG = metrics.registry.histogram(
+    'rhci_outbox_lag_seconds', 'Delay between an event being written and a subscriber applying it',
+    ['subscriber'], buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600))
+GAPS = metrics.registry.counter(
+    'rhci_outbox_gaps_total',
+    'Missing event ids by subscriber and outcome (skipped, late, abandoned)', ['subscriber', 'outcome'])
+
+
+@dataclass
+class Subscriber:
+    name: str
+    handler: callable
+    topics: frozenset
+    reset: callable = None
+
+
+def subscriber(name, topics, reset=None):
+    """Register the decorated function to receive lists of OutboxEvent for `topics`"""
+    def decorator(func):
+        _subscribers[name] = Subscriber(name, func, frozenset(topics), reset)
+        return func
+    return decorator
+
+
+def publish(topic, key, payload=None):
+    """Write an event; call inside the transaction that makes the change"""
+    event = OutboxEvent.objects.create(topic=topic, key=str(key), payload=payload or {})
+    if getattr(settings, 'OUTBOX_EAGER', False):
+        transaction.on_commit(dispatch)
+    return event
+
+
+def _deliverable(events, position, settle_cutoff):
+    """
+    Events up to the first gap that may still be filled, and the (first,
+    last) id ranges skipped on the way. Ids are handed out at insert but
+    become visible at commit, so a missing id can belong to a transaction
+    still in flight; once the events after it are older than the settle
+    window, the cursor moves past it and the range is re-checked later.
+    """
+    expected = position + 1
+    ready, skipped = [], []
+    for event in events:
+        if event.id != expected:
+            if event.created_at > settle_cutoff:
+                break
+            skipped.append((expected, event.id - 1))
+        ready.append(event)
+        expected = event.id + 1
+    return ready, skipped
+
+
+def _recheck(gaps, expire_before):
+    """
+    Look again for the events of skipped ranges ([first, last, skipped_at]).
+    Returns the events that have committed since, the ranges still missing,
+    and the ranges skipped before `expire_before` that are given up.
+    """
+    if not gaps:
+        return [], [], []
+    query = Q()
+    for first, last, skipped_at in gaps:
+        query |= Q(id__range=(first, last))
+    late = list(OutboxEvent.objects.filter(query).order_by('id'))
+    found = [event.id for event in late]
+    still_missing, abandoned = [], []
+    for first, last, skipped_at in gaps:
+        pieces, start = [], first
+        for event_id in found:
+            if first <= event_id <= last:
+                if start < event_id:
+                    pieces.append([start, event_id - 1, skipped_at])
+                start = event_id + 1
+        if start <= last:
+            pieces.append([start, last, skipped_at])
+        (abandoned if skipped_at < expire_before else still_missing).extend(pieces)
+    return late, still_missing, abandoned
+
+
+def _count(gaps):
+    return sum(last - first + 1 for first, last, *rest in gaps)
+
+
+def dispatch_one(name, batch_size=None, settle=None):
+    """Deliver the next batch to one subscriber; returns how many events it consumed"""
+    sub = _subscribers[name]
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 500)
+    settle = settle if settle is not None else getattr(settings, 'OUTBOX_SETTLE_SECONDS', 5)
+    recheck = getattr(settings, 'OUTBOX_RECHECK_SECONDS', 900)
+    now = timezone.now()
+    with write_transaction():
+        cursor = OutboxCursor.objects.select_for_update().filter(subscriber=name).first()
+        if cursor is None:
+            cursor = OutboxCursor.objects.create(subscriber=name)
+        late, gaps, abandoned = _recheck(cursor.skipped, now.timestamp() - recheck)
+        events, skipped = _deliverable(
+            OutboxEvent.objects.filter(id__gt=cursor.position).order_by('id')[:batch_size],
+            cursor.position, now - timedelta(seconds=settle))
+        if not (late or events or abandoned):
+            return 0
+        relevant = [event for event in late + events if event.topic in sub.topics]
+        if relevant:
+            sub.handler(relevant)
+        gaps += [[first, last, now.timestamp()] for first, last in skipped]
+        moved = {'position': events[-1].id} if events else {}
+        OutboxCursor.objects.filter(subscriber=name).update(skipped=gaps, updated_at=now, **moved)
+
+    for first, last in skipped:
+        logger.warning(f"Outbox subscriber {name} skipped missing events {first}-{last} after "
+                       f"{settle}s; they will be delivered if they commit within {recheck}s")
+    for event in late:
+        logger.warning(f"Outbox subscriber {name} received event {event.id} after skipping it")
+    for first, last, skipped_at in abandoned:
+        logger.error(f"Outbox subscriber {name} gave up on missing events {first}-{last}: "
+                     f"nothing committed within {recheck}s")
+    GAPS.inc((name, 'skipped'), _count(skipped))
+    GAPS.inc((name, 'late'), len(late))
+    GAPS.inc((name, 'abandoned'), _count(abandoned))
+    for event in relevant:
+        DELIVERY_LAG.observe(max((now - event.created_at).total_seconds(), 0), (name,))
+    EVENTS_DELIVERED.inc((name,), len(relevant))
+    return len(late) + len(events)
+
+
+def dispatch(batch_size=None, settle=None):
+    """
+    Give every subscriber that is behind, or waiting on skipped events, one
+    batch; returns the events consumed in total. Costs two queries when
+    there is nothing new.
+    """
+    head = OutboxEvent.objects.aggregate(head=Max('id'))['head'] or 0
+    cursors = {name: (position, skipped) for name, position, skipped
+               in OutboxCursor.objects.values_list('subscriber', 'position', 'skipped')}
+    consumed = 0
+    for name in _subscribers:
+        position, skipped = cursors.get(name, (0, []))
+        if position >= head and not skipped:
+            continue
+        try:
+            consumed += dispatch_one(name, batch_size, settle)
+        except Exception:
+            DISPATCH_ERRORS.inc((name,))
+            logger.exception(f"Outbox subscriber {name} failed; it will retry from the same event")
+    return consumed
+
+
+def drain(batch_size=None, settle=None, timeout=60):
+    """Dispatch until every subscriber has caught up (tests, benchmarks, replays)"""
+    deadline = time.monotonic() + timeout
+    consumed = 0
+    while time.monotonic() < deadline:
+        delivered = dispatch(batch_size, settle)
+        if not delivered:
+            break
+        consumed += delivered
+    return consumed
+
+
+def replay(name, position=0):
+    """Move a subscriber back to `position`, clearing its state first if it has a reset"""
+    sub = _subscribers[name]
+    with write_transaction():
+        if sub.reset is not None:
+            sub.reset()
+        OutboxCursor.objects.update_or_create(subscriber=name, defaults={'position': position, 'skipped': []})
+
+
+def backlog():
+    """{subscriber: events written after its cursor}"""
+    head = OutboxEvent.objects.aggregate(head=Max('id'))['head'] or 0
+    positions = dict(OutboxCursor.objects.values_list('subscriber', 'position'))
+    return {name: max(head - positions.get(name, 0), 0) for name in _subscribers}
+
+
+metrics.registry.gauge(
+    'rhci_outbox_backlog', 'Outbox events not yet processed, by subscriber', ['subscriber'],
+    collect=lambda: {(name,): depth for name, depth in backlog().items()})
@@ -0,0 +1,204 @@
+"""
+Background tasks stored in the database, run by `manage.py run_tasks`.
+
+Register a handler with `@task('name')` and call `enqueue('name', {...})`
+inside the transaction that makes the work necessary: the task row commits
+or rolls back with it. Workers claim ready tasks in batches, using
+SELECT ... FOR UPDATE SKIP LOCKED where the database supports it and the
+TaskLock row elsewhere (SQLite). Failures are retried with exponential
+backoff until the task's max_attempts, then left as `failed`; a handler
+registered with `on_failure=` is then called with the task's payload to
+clean up after it.
+
+A handler runs in one write transaction with its `done` mark. Handlers
+that do slow work before writing (hashing passwords, say) register with
+`atomic=False` and open their own, short transactions; they must tolerate
+being run again after a crash between their commit and the mark.
+"""
+import logging
+import random
+import time
+import traceback
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from rhci_platform import metrics
+from rhci_platform.transactions import write_transaction
+
+from .models import Task, TaskLock
+
+logger = logging.getLogger(__name__)
+
+CLAIM_LOCK = 'claim'
+LAG_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+_handlers = {}
+
+TASKS_RUN = metrics.registry.counter(
+    'rhci_tasks_total', 'Tasks run by name and result (done, retry, failed)', ['task', 'result'])
+TASK_DURATION = metrics.registry.histogram(
+    'rhci_task_duration_seconds', 'Task run time by name', ['task'])
+TASK_LAG = metrics.registry.histogram(
+    'rhci_task_lag_seconds', 'Delay between a task becoming due and a worker starting it', ['task'],
+    buckets=LAG_BUCKETS)
+
+
+def task(name, atomic=True, on_failure=None):
+    """
+    Register the decorated function as the handler for `name`.
+    `on_failure(**payload)` runs once the task has failed for good.
+    """
+    def decorator(func):
+        _handlers[name] = func
+        func.task_name = name
+        func.task_atomic = atomic
+        func.task_on_failure = on_failure
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=None):
+    """Queue a task. Payloads are stored as JSON, so pass ids rather than objects."""
+    queued = Task.objects.create(
+        name=name,
+        payload=payload or {},
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or getattr(settings, 'TASK_MAX_ATTEMPTS', 5),
+    )
+    if getattr(settings, 'TASKS_EAGER', False) and not delay:
+        transaction.on_commit(lambda: run_now(queued.pk))
+    return queued
+
+
+def claim(worker, batch_size=20):
+    """Mark up to `batch_size` ready tasks as running for `worker` and return them"""
+    now = timezone.now()
+    with write_transaction():
+        ready = Task.objects.filter(status='queued', run_after__lte=now).order_by('run_after', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            ready = ready.select_for_update(skip_locked=True)
+        elif not TaskLock.objects.filter(name=CLAIM_LOCK).update(holder=worker, acquired_at=now):
+            TaskLock.objects.create(name=CLAIM_LOCK, holder=worker, acquired_at=now)
+        ids = list(ready.values_list('id', flat=True)[:batch_size])
+        if ids:
+            Task.objects.filter(id__in=ids).update(
+                status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1)
+    if not ids:
+        return []
+    return list(Task.objects.filter(id__in=ids).order_by('run_after', 'id'))
+
+
+def retry_delay(attempts):
+    """Seconds before attempt `attempts + 1`: doubling from TASK_RETRY_DELAY, with jitter"""
+    base = getattr(settings, 'TASK_RETRY_DELAY', 10)
+    ceiling = getattr(settings, 'TASK_RETRY_MAX_DELAY', 3600)
+    return min(ceiling, base * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+def run(claimed):
+    """Run a claimed task and record the outcome; returns 'done', 'retry' or 'failed'"""
+    started = time.perf_counter()
+    TASK_LAG.observe(max((timezone.now() - claimed.run_after).total_seconds(), 0), (claimed.name,))
+    try:
+        handler = _handlers.get(claimed.name)
+        if handler is None:
+            raise LookupError(f"No handler registered for task {claimed.name!r}")
+        # The handler's writes and the `done` mark commit together, so a
+        # task is either finished or left to retry, never half-applied
+        with write_transaction() if handler.task_atomic else nullcontext():
+            handler(**claimed.payload)
+            Task.objects.filter(pk=claimed.pk).update(
+                status='done', finished_at=timezone.now(), locked_by='', last_error='')
+    except Exception:
+        result = _record_failure(claimed, traceback.format_exc())
+    else:
+        result = 'done'
+    TASK_DURATION.observe(time.perf_counter() - started, (claimed.name,))
+    TASKS_RUN.inc((claimed.name, result))
+    return result
+
+
+def _record_failure(claimed, error):
+    now = timezone.now()
+    if claimed.attempts >= claimed.max_attempts:
+        logger.error(f"Task {claimed} failed after {claimed.attempts} attempts:\n{error}")
+        with write_transaction():
+            Task.objects.filter(pk=claimed.pk).update(
+                status='failed', finished_at=now, locked_by='', last_error=error[-4000:])
+            _on_failure(claimed.name, claimed.payload)
+        return 'failed'
+    delay = retry_delay(claimed.attempts)
+    logger.warning(f"Task {claimed} failed (attempt {claimed.attempts}), retrying in {delay:.0f}s:\n{error}")
+    Task.objects.filter(pk=claimed.pk).update(
+        status='queued', run_after=now + timedelta(seconds=delay), locked_by='', last_error=error[-4000:])
+    return 'retry'
+
+
+def _on_failure(name, payload):
+    handler = _handlers.get(name)
+    if handler is None or handler.task_on_failure is None:
+        return
+    try:
+        with transaction.atomic():
+            handler.task_on_failure(**payload)
+    except Exception:
+        logger.exception(f"on_failure of task {name} failed")
+
+
+def run_now(task_id):
+    """Claim and run one specific task in this process (TASKS_EAGER)"""
+    now = timezone.now()
+    if Task.objects.filter(pk=task_id, status='queued').update(
+            status='running', locked_by='eager', locked_at=now, attempts=F('attempts') + 1):
+        return run(Task.objects.get(pk=task_id))
+    return None
+
+
+def requeue_stale(timeout=None):
+    """Give tasks held by a worker that died another attempt; returns how many"""
+    timeout = timeout or getattr(settings, 'TASK_LOCK_TIMEOUT', 600)
+    now = timezone.now()
+    stale = Task.objects.filter(status='running', locked_at__lt=now - timedelta(seconds=timeout))
+    with write_transaction():
+        lost = list(stale.filter(attempts__gte=F('max_attempts')).values_list('id', 'name', 'payload'))
+        Task.objects.filter(id__in=[task_id for task_id, name, payload in lost]).update(
+            status='failed', finished_at=now, locked_by='', last_error='Worker lost while running')
+        for task_id, name, payload in lost:
+            _on_failure(name, payload)
+    return stale.update(status='queued', run_after=now, locked_by='')
+
+
+def purge_finished(days=None, batch_size=1000):
+    """Delete tasks that finished successfully more than `days` ago, in batches"""
+    days = days if days is not None else getattr(settings, 'TASK_RETENTION_DAYS', 7)
+    finished = Task.objects.filter(status='done', finished_at__lt=timezone.now() - timedelta(days=days))
+    deleted = 0
+    while True:
+        ids = list(finished.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Task.objects.filter(id__in=ids).delete()[0]
+
+
+def queue_stats():
+    """{name: (ready or scheduled tasks, seconds the oldest ready one has waited)}"""
+    now = timezone.now()
+    rows = (Task.objects.filter(status='queued').values('name')
+            .annotate(depth=Count('id'), oldest=Min('run_after')).order_by())
+    return {
+        row['name']: (row['depth'], max((now - row['oldest']).total_seconds(), 0))
+        for row in rows
+    }
+
+
+metrics.registry.gauge(
+    'rhci_task_queue_depth', 'Queued tasks by name', ['task'],
+    collect=lambda: {(name,): depth for name, (depth, lag) in queue_stats().items()})
+metrics.registry.gauge(
+    'rhci_task_queue_lag_seconds', 'How long the oldest due task has been waiting, by name', ['task'],
+    collect=lambda: {(name,): lag for name, (depth, lag) in queue_stats().items()})
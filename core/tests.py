@@ -1,3 +1,400 @@
-from django.test import TestCase
+import socket
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, send_mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.beneficiaries.models import Patient, PatientCase
+from apps.donations.models import Donation, PaymentCallback
+from apps.users.models import Notification
+from apps.users.notifications import unread_count
+from rhci_platform.testing import SMTPStub
+
+from . import mail, outbox, tasks
+from .management.commands.benchmark_views import payment_marks, remove_payments
+from .models import OutboundEmail, OutboxCursor, OutboxEvent, Task, TaskLock
+
+SMTP = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class OutboxTests(TestCase):
+    """Events reach a subscriber once, in id order, even around gaps in the ids"""
+
+    NAME = 'tests.recorder'
+    TOPIC = 'tests.event'
+
+    def setUp(self):
+        self.received = []
+        self.failing = False
+
+        def record(events):
+            if self.failing:
+                raise RuntimeError('subscriber down')
+            self.received.extend(event.key for event in events)
+
+        # The recorder is the only subscriber while the test runs
+        self.enterContext(mock.patch.dict(outbox._subscribers, clear=True))
+        outbox.subscriber(self.NAME, topics=[self.TOPIC])(record)
+
+    def publish(self, *keys):
+        return [outbox.publish(self.TOPIC, key) for key in keys]
+
+    def cursor(self):
+        return OutboxCursor.objects.get(subscriber=self.NAME)
+
+    def drop(self, *events):
+        """Take events out of the log, as if their transactions had not committed yet"""
+        ids = [event.id for event in events]
+        OutboxEvent.objects.filter(id__in=ids).delete()
+        return ids
+
+    def test_delivers_in_order_and_advances_cursor(self):
+        events = self.publish('a', 'b', 'c')
+        outbox.publish('tests.other', 'x')
+        self.assertEqual(outbox.dispatch_one(self.NAME, settle=0), 4)
+        self.assertEqual(self.received, ['a', 'b', 'c'])
+        self.assertEqual(self.cursor().position, events[-1].id + 1)
+        self.assertEqual(outbox.dispatch_one(self.NAME, settle=0), 0)
+        self.assertEqual(self.received, ['a', 'b', 'c'])
+
+    def test_failing_subscriber_keeps_its_position(self):
+        self.publish('a')
+        self.failing = True
+        with self.assertLogs('core.outbox', 'ERROR'):
+            outbox.dispatch(settle=0)
+        self.assertFalse(OutboxCursor.objects.filter(subscriber=self.NAME, position__gt=0).exists())
+        self.failing = False
+        outbox.dispatch(settle=0)
+        self.assertEqual(self.received, ['a'])
+
+    def test_recent_gap_holds_delivery_back(self):
+        first, missing, last = self.publish('a', 'b', 'c')
+        self.drop(missing)
+        self.assertEqual(outbox.dispatch_one(self.NAME, settle=60), 1)
+        self.assertEqual(self.received, ['a'])
+        self.assertEqual(self.cursor().position, first.id)
+
+    def test_late_commit_after_skip_is_delivered(self):
+        first, missing, last = self.publish('a', 'b', 'c')
+        [missing_id] = self.drop(missing)
+        late_before = outbox.GAPS.value((self.NAME, 'late'))
+        with self.assertLogs('core.outbox', 'WARNING') as logs:
+            outbox.dispatch_one(self.NAME, settle=0)
+        self.assertIn(f'skipped missing events {missing_id}-{missing_id}', logs.output[0])
+        self.assertEqual(self.received, ['a', 'c'])
+        cursor = self.cursor()
+        self.assertEqual(cursor.position, last.id)
+        self.assertEqual([gap[:2] for gap in cursor.skipped], [[missing_id, missing_id]])
+
+        # Still missing: nothing to do, and the gap is kept
+        self.assertEqual(outbox.dispatch(settle=0), 0)
+        self.assertEqual(len(self.cursor().skipped), 1)
+
+        # The slow transaction commits; the subscriber is caught up but still gets it
+        OutboxEvent.objects.create(id=missing_id, topic=self.TOPIC, key='b')
+        with self.assertLogs('core.outbox', 'WARNING'):
+            self.assertEqual(outbox.dispatch(settle=0), 1)
+        self.assertEqual(self.received, ['a', 'c', 'b'])
+        self.assertEqual(self.cursor().skipped, [])
+        self.assertEqual(outbox.GAPS.value((self.NAME, 'late')), late_before + 1)
+
+    def test_late_commit_splits_a_skipped_range(self):
+        events = self.publish('a', 'b', 'c', 'd', 'e')
+        b, c, d = self.drop(*events[1:4])
+        with self.assertLogs('core.outbox', 'WARNING'):
+            outbox.dispatch_one(self.NAME, settle=0)
+        self.assertEqual([gap[:2] for gap in self.cursor().skipped], [[b, d]])
+        OutboxEvent.objects.create(id=c, topic=self.TOPIC, key='c')
+        with self.assertLogs('core.outbox', 'WARNING'):
+            outbox.dispatch_one(self.NAME, settle=0)
+        self.assertEqual(self.received, ['a', 'e', 'c'])
+        self.assertEqual([gap[:2] for gap in self.cursor().skipped], [[b, b], [d, d]])
+
+    @override_settings(OUTBOX_RECHECK_SECONDS=0)
+    def test_gap_is_abandoned_after_recheck_window(self):
+        first, missing, last = self.publish('a', 'b', 'c')
+        self.drop(missing)
+        with self.assertLogs('core.outbox', 'WARNING'):
+            outbox.dispatch_one(self.NAME, settle=0)
+        with self.assertLogs('core.outbox', 'ERROR') as logs:
+            outbox.dispatch_one(self.NAME, settle=0)
+        self.assertIn('gave up on missing events', logs.output[0])
+        self.assertEqual(self.cursor().skipped, [])
+
+    def test_replay_redelivers_and_clears_gaps(self):
+        first, missing, last = self.publish('a', 'b', 'c')
+        self.drop(missing)
+        with self.assertLogs('core.outbox', 'WARNING'):
+            outbox.dispatch_one(self.NAME, settle=0)
+        outbox.replay(self.NAME, position=first.id - 1)
+        self.assertEqual(self.cursor().skipped, [])
+        with self.assertLogs('core.outbox', 'WARNING'):
+            outbox.dispatch_one(self.NAME, settle=0)
+        self.assertEqual(self.received, ['a', 'c', 'a', 'c'])
+
+
+@override_settings(TASKS_EAGER=False, TASK_RETRY_DELAY=10, TASK_RETRY_MAX_DELAY=3600)
+class TaskQueueTests(TestCase):
+    """Claiming, retry backoff and recovery of tasks whose worker died"""
+
+    def setUp(self):
+        self.calls = []
+
+        def flaky(fail=False):
+            self.calls.append(fail)
+            if fail:
+                raise RuntimeError('provider unavailable')
+
+        patcher = mock.patch.dict(tasks._handlers, {'tests.flaky': tasks.task('tests.flaky')(flaky)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queue(self, seconds_ago=0, **fields):
+        fields.setdefault('name', 'tests.flaky')
+        return Task.objects.create(run_after=timezone.now() - timedelta(seconds=seconds_ago), **fields)
+
+    def test_claim_takes_oldest_ready_tasks(self):
+        newer = self.queue(seconds_ago=10)
+        oldest = self.queue(seconds_ago=30)
+        middle = self.queue(seconds_ago=20)
+        self.queue(seconds_ago=-60)  # scheduled for later
+        self.queue(seconds_ago=60, status='running', locked_by='other')
+
+        claimed = tasks.claim('worker-1', batch_size=2)
+        self.assertEqual([t.pk for t in claimed], [oldest.pk, middle.pk])
+        for t in claimed:
+            self.assertEqual((t.status, t.locked_by, t.attempts), ('running', 'worker-1', 1))
+            self.assertIsNotNone(t.locked_at)
+        self.assertEqual(TaskLock.objects.get(name=tasks.CLAIM_LOCK).holder, 'worker-1')
+
+        self.assertEqual([t.pk for t in tasks.claim('worker-2')], [newer.pk])
+        self.assertEqual(tasks.claim('worker-3'), [])
+
+    def test_run_marks_done(self):
+        queued = tasks.enqueue('tests.flaky', {'fail': False})
+        [claimed] = tasks.claim('worker')
+        self.assertEqual(tasks.run(claimed), 'done')
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.locked_by), ('done', ''))
+        self.assertIsNotNone(queued.finished_at)
+        self.assertEqual(self.calls, [False])
+
+    def test_retry_delay_doubles_up_to_the_ceiling(self):
+        with mock.patch('random.uniform', return_value=1):
+            self.assertEqual([tasks.retry_delay(n) for n in (1, 2, 3, 4)], [10, 20, 40, 80])
+            self.assertEqual(tasks.retry_delay(20), 3600)
+        with mock.patch('random.uniform', side_effect=lambda low, high: low):
+            self.assertEqual(tasks.retry_delay(2), 16)
+        with mock.patch('random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual(tasks.retry_delay(2), 24)
+
+    def test_failure_is_retried_with_backoff_then_failed(self):
+        queued = tasks.enqueue('tests.flaky', {'fail': True}, max_attempts=2)
+        [claimed] = tasks.claim('worker')
+        before = timezone.now()
+        with mock.patch('random.uniform', return_value=1), self.assertLogs('core.tasks', 'WARNING'):
+            self.assertEqual(tasks.run(claimed), 'retry')
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.locked_by), ('queued', 1, ''))
+        self.assertIn('provider unavailable', queued.last_error)
+        self.assertGreaterEqual(queued.run_after, before + timedelta(seconds=10))
+        self.assertEqual(tasks.claim('worker'), [])  # not due yet
+
+        Task.objects.filter(pk=queued.pk).update(run_after=timezone.now())
+        [claimed] = tasks.claim('worker')
+        with self.assertLogs('core.tasks', 'ERROR'):
+            self.assertEqual(tasks.run(claimed), 'failed')
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('failed', 2))
+        self.assertIsNotNone(queued.finished_at)
+        self.assertEqual(self.calls, [True, True])
+
+    def test_unknown_task_is_retried(self):
+        queued = tasks.enqueue('tests.missing')
+        [claimed] = tasks.claim('worker')
+        with self.assertLogs('core.tasks', 'WARNING'):
+            self.assertEqual(tasks.run(claimed), 'retry')
+        queued.refresh_from_db()
+        self.assertIn('No handler registered', queued.last_error)
+
+    def test_on_failure_runs_once_the_task_gives_up(self):
+        failures = []
+        handler = tasks.task('tests.flaky', on_failure=lambda **payload: failures.append(payload))(
+            tasks._handlers['tests.flaky'])
+        self.addCleanup(setattr, handler, 'task_on_failure', None)
+        tasks.enqueue('tests.flaky', {'fail': True}, max_attempts=2)
+        with self.assertLogs('core.tasks', 'WARNING'):
+            for result in ('retry', 'failed'):
+                Task.objects.update(run_after=timezone.now())
+                [claimed] = tasks.claim('worker')
+                self.assertEqual(tasks.run(claimed), result)
+                self.assertEqual(len(failures), result == 'failed')
+        self.assertEqual(failures, [{'fail': True}])
+
+        lost = self.queue(status='running', locked_by='dead', locked_at=timezone.now() - timedelta(seconds=700),
+                          attempts=5, max_attempts=5, payload={'fail': False})
+        tasks.requeue_stale(timeout=600)
+        self.assertEqual(failures, [{'fail': True}, {'fail': False}])
+        lost.refresh_from_db()
+        self.assertEqual(lost.status, 'failed')
+
+    def test_requeue_stale(self):
+        lost_at = timezone.now() - timedelta(seconds=700)
+        lost = self.queue(status='running', locked_by='dead', locked_at=lost_at, attempts=1)
+        exhausted = self.queue(status='running', locked_by='dead', locked_at=lost_at, attempts=5, max_attempts=5)
+        busy = self.queue(status='running', locked_by='alive', locked_at=timezone.now(), attempts=1)
+
+        self.assertEqual(tasks.requeue_stale(timeout=600), 1)
+        lost.refresh_from_db()
+        exhausted.refresh_from_db()
+        busy.refresh_from_db()
+        self.assertEqual((lost.status, lost.locked_by, lost.attempts), ('queued', '', 1))
+        self.assertEqual((exhausted.status, exhausted.last_error), ('failed', 'Worker lost while running'))
+        self.assertEqual((busy.status, busy.locked_by), ('running', 'alive'))
+        self.assertEqual([t.pk for t in tasks.claim('worker')], [lost.pk])
+
+
+@override_settings(EMAIL_BACKEND='core.mail.OutboxBackend', EMAIL_DELIVERY_BACKEND=SMTP,
+                   EMAIL_OUTBOX_EAGER=False)
+class EmailOutboxTests(TestCase):
+    """Mail is queued in the request and delivered in batches over one SMTP session"""
+
+    def queue(self, count, priority=OutboundEmail.PRIORITY_TRANSACTIONAL):
+        mail.queue([EmailMessage(f'Update {n}', 'Body', to=[f'donor{n}@example.com'])
+                    for n in range(count)], priority=priority)
+
+    def test_password_reset_is_queued_not_sent(self):
+        User.objects.create_user('donor', 'donor@example.com', 'pass')
+        with SMTPStub() as stub, override_settings(EMAIL_HOST=stub.host, EMAIL_PORT=stub.port):
+            response = self.client.post('/password-reset/', {'email': 'donor@example.com'})
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(stub.connections, 0)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.to, ['donor@example.com'])
+        self.assertIn('/password-reset-confirm/', email.message['body'])
+
+    def test_batch_reuses_one_connection(self):
+        self.queue(50)
+        send_mail('Welcome', 'Hello', None, ['new@example.com'],
+                  html_message='<p>Hello</p>')
+        with SMTPStub() as stub, override_settings(EMAIL_HOST=stub.host, EMAIL_PORT=stub.port):
+            results = mail.send_queued(batch_size=100, rate=0)
+        self.assertEqual(results, {'sent': 51, 'retry': 0, 'failed': 0})
+        self.assertEqual(stub.connections, 1)
+        self.assertEqual(len(stub.messages), 51)
+        self.assertIn(b'text/html', stub.messages[-1][2])
+        self.assertFalse(OutboundEmail.objects.exclude(status='sent').exists())
+
+    def test_transactional_mail_overtakes_bulk(self):
+        self.queue(5, priority=OutboundEmail.PRIORITY_BULK)
+        send_mail('Reset your password', 'Link', None, ['urgent@example.com'])
+        claimed = mail.claim(batch_size=1)
+        self.assertEqual(claimed[0].to, ['urgent@example.com'])
+
+    def test_unreachable_server_retries_later(self):
+        self.queue(3)
+        with override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=free_port(), EMAIL_TIMEOUT=1), \
+                self.assertLogs('core.mail', 'WARNING'):
+            results = mail.send_queued(batch_size=10, rate=0)
+        self.assertEqual(results['retry'], 3)
+        self.assertFalse(OutboundEmail.objects.filter(
+            status='queued', send_after__lte=timezone.now()).exists())
+
+    def test_rate_limit(self):
+        self.queue(6)
+        with SMTPStub() as stub, override_settings(EMAIL_HOST=stub.host, EMAIL_PORT=stub.port):
+            started = time.monotonic()
+            mail.send_queued(batch_size=10, rate=50)
+            elapsed = time.monotonic() - started
+        self.assertEqual(len(stub.messages), 6)
+        self.assertGreaterEqual(elapsed, 5 / 50)
+
+    def test_sessions_against_local_smtp(self):
+        """One session per message (the old path) against one per batch"""
+        count = 40
+        with SMTPStub() as stub, \
+                override_settings(EMAIL_HOST=stub.host, EMAIL_PORT=stub.port, EMAIL_BACKEND=SMTP):
+            for n in range(count):
+                send_mail('Direct', 'Body', None, [f'd{n}@example.com'])
+            direct_sessions = stub.connections
+
+        self.queue(count)
+        with SMTPStub() as stub, override_settings(EMAIL_HOST=stub.host, EMAIL_PORT=stub.port):
+            mail.send_queued(batch_size=count, rate=0)
+            batched_sessions = stub.connections
+
+        self.assertEqual((direct_sessions, batched_sessions), (count, 1))
+
+
+@override_settings(TASKS_EAGER=False, OUTBOX_EAGER=False)
+class BenchmarkCleanupTests(TestCase):
+    """remove_payments() undoes a payment cycle without cutting events out of the outbox"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.supporter = User.objects.create_user('supporter', 'supporter@example.com', 'pass')
+        cls.bencher = User.objects.create_user('bencher', 'bencher@example.com', 'pass')
+        patient = Patient.objects.create(
+            first_name='Asha', last_name='Juma', dob=date(2015, 1, 1), gender='F',
+            city='Dar es Salaam', region='Dar es Salaam',
+        )
+        cls.case = PatientCase.objects.create(
+            patient=patient, title='Heart surgery', story='-', diagnosis='-',
+            hospital_name='-', doctor_name='-', target_amount=Decimal('15000'),
+            start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            status='published',
+        )
+        Donation.objects.create(case=cls.case, donor=cls.supporter, amount=Decimal('10000'),
+                                external_id='earlier', status='completed')
+        outbox.drain(settle=0)
+
+    def pay(self, ref):
+        donation = Donation.objects.create(case=self.case, donor=self.bencher, amount=Decimal('10000'),
+                                           external_id=ref, status='pending')
+        PaymentCallback.objects.create(
+            donation=donation, msisdn='255700000000', amount='10000', message='Success',
+            utility_ref=ref, operator='Mpesa', reference=ref, transaction_status='success',
+            raw_payload={'utilityref': ref},
+        )
+
+    def test_cycle_is_undone(self):
+        marks = payment_marks(self.case)
+        notified = unread_count(self.supporter)
+        self.pay('bench0')
+        outbox.drain(settle=0)
+        # The payment funded the case: its donors are told in the app and by email
+        while claimed := tasks.claim('test'):
+            [tasks.run(task) for task in claimed]
+        self.assertEqual(unread_count(self.supporter), notified + 1)
+        self.assertTrue(OutboundEmail.objects.exists())
+        self.pay('bench1')  # left for the cleanup to deliver
+        events = list(OutboxEvent.objects.order_by('id').values_list('id', flat=True))
+
+        remove_payments(['bench0', 'bench1'], self.case, marks)
+        self.assertFalse(Donation.objects.filter(external_id__startswith='bench').exists())
+        self.assertEqual(list(OutboxEvent.objects.order_by('id').values_list('id', flat=True))[:len(events)], events)
+        self.case.refresh_from_db()
+        self.assertEqual((self.case.amount_raised, self.case.funded_at), (Decimal('10000'), None))
+        self.assertFalse(Notification.objects.filter(user=self.bencher).exists())
+        self.assertFalse(Notification.objects.filter(kind='case_funded').exists())
+        self.assertEqual(unread_count(self.supporter), notified)
+        self.assertEqual(unread_count(self.bencher), 0)
+        self.assertFalse(OutboundEmail.objects.exists())
+        self.assertFalse(Task.objects.filter(status='queued').exists())
+
+        # The log still adds up: recounting from the first event gives the same total
+        outbox.replay('donations.case_totals')
+        outbox.drain(settle=0)
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.amount_raised, Decimal('10000'))
@@ -3,7 +3,10 @@ from django.http import Http404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import logout as auth_logout
 from django.urls import reverse
-from apps.beneficiaries.models import PatientCase
+from django.db.models import Prefetch
+from apps.beneficiaries.models import PatientCase, TreatmentStep
+from rhci_platform.cache_tags import HOME, case_tag, tagged_cache
+from rhci_platform.db_routers import replica_reads
 
 # Defensive imports to support different model names / missing apps
 try:
@@ -19,11 +22,17 @@ try:
 except Exception:
     PatientModel = None
 
+@replica_reads
 def home(request):
     """Home view showing featured patient cases"""
-    cases = PatientCase.objects.select_related('patient').filter(
-        status='published'  # Assuming 'published' is a valid status
-    ).order_by('-created_at')[:8]
+    cases = tagged_cache.get_or_set(
+        'home:cases',
+        lambda: list(PatientCase.objects.select_related('patient').filter(
+            status='published'  # Assuming 'published' is a valid status
+        ).order_by('-created_at')[:8]),
+        tags=[HOME],
+        timeout=300,
+    )
     
     context = {
         'cases': cases,
@@ -42,28 +51,51 @@ def patient_detail(request, id):  # Changed to match URL parameter name
     """
     Patient detail view - resolve patient and related cases defensively.
     """
-    case = get_object_or_404(PatientCase, id=id)
-
-    # Calculate budget category sums
-    category_sums = {}
-    for item in case.budget_items.all():
-        if item.category in category_sums:
-            category_sums[item.category] += item.amount
-        else:
-            category_sums[item.category] = item.amount
+    bundle = tagged_cache.get_or_set(
+        f'patient_detail:{id}', lambda: _case_bundle(id), tags=[case_tag(id)], timeout=600)
+    case = bundle['case']
 
     context = {
         'patient': case.patient,  # Add patient object
         'case': case,  # Single case
         'cases': [case],  # List of cases for legacy template support
-        'treatment_steps': case.treatment_steps.all().order_by('planned_date'),
-        'budget_items': case.budget_items.all(),
-        'category_sums': category_sums,
-        'distinct_categories': case.budget_items.values_list('category', flat=True).distinct(),
+        'treatment_steps': bundle['treatment_steps'],
+        'budget_items': bundle['budget_items'],
+        'category_sums': bundle['category_sums'],
+        'distinct_categories': bundle['distinct_categories'],
+        # Medical records are only shown to signed-in users and never cached
         'medical_records': case.medical_records.all() if request.user.is_authenticated else None,
     }
     return render(request, 'core/patient_detail.html', context)
 
+def _case_bundle(id):
+    """Load a case with everything patient_detail shows publicly"""
+    case = get_object_or_404(
+        PatientCase.objects.select_related('patient').prefetch_related(
+            Prefetch('treatment_steps', queryset=TreatmentStep.objects.order_by('planned_date')),
+            'budget_items',
+        ),
+        id=id,
+    )
+    budget_items = list(case.budget_items.all())
+
+    # Calculate budget category sums
+    category_sums = {}
+    for item in budget_items:
+        cost = item.cost or 0
+        if item.category in category_sums:
+            category_sums[item.category] += cost
+        else:
+            category_sums[item.category] = cost
+
+    return {
+        'case': case,
+        'treatment_steps': list(case.treatment_steps.all()),
+        'budget_items': budget_items,
+        'category_sums': category_sums,
+        'distinct_categories': list(category_sums),
+    }
+
 def about(request):
     return render(request, 'core/about.html')
 
@@ -86,6 +118,7 @@ def signup_view(request):
 def logout_view(request):
     auth_logout(request)
     return redirect('core:home')
+@replica_reads
 def discover(request):
     """
     Defensive discover view: avoids unsupported lookups and shows recent cases.
@@ -1,4 +1,8 @@
+import hmac
+
+from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseForbidden
 from django.template.response import TemplateResponse
 from django.contrib.auth.models import User
 from django.db.models import Sum, Count, Q
@@ -7,6 +11,7 @@ from apps.beneficiaries.models import Patient, PatientCase
 from apps.users.models import Profile
 from apps.donations.models import Donation
 from decimal import Decimal
+from .metrics import registry
 
 @staff_member_required
 def custom_admin_index(request, extra_context=None):
@@ -64,4 +69,16 @@ def custom_admin_index(request, extra_context=None):
     if extra_context:
         context.update(extra_context)
     
-    return TemplateResponse(request, 'admin/index.html', context)
\ No newline at end of file
+    return TemplateResponse(request, 'admin/index.html', context)
+
+
+def metrics(request):
+    """Prometheus metrics for this worker, for staff users or a scraper holding METRICS_TOKEN"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    bearer = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    authorized = request.user.is_active and request.user.is_staff
+    if token and hmac.compare_digest(bearer, token):
+        authorized = True
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
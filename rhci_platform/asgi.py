@@ -13,4 +13,27 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rhci_platform.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from apps.donations.views import close_azampay_client, open_azampay_client  # noqa: E402 (needs the app registry)
+
+
+async def lifespan(receive, send):
+    """Share one AzamPay client between the requests of this worker's event loop"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            open_azampay_client()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_azampay_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    # Django's handler only speaks HTTP; servers that skip lifespan events
+    # (uvicorn --lifespan off) leave the views opening a client per call
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,64 @@
+"""
+Async-capable counterparts of the Django view helpers we use.
+
+Django 4.2's `require_http_methods`, `login_required` and `csrf_exempt` wrap
+views in plain functions, which hides a coroutine view from the handler, and
+it has no `request.auser()` or `aget_object_or_404()` yet (both arrive in
+5.0). Drop these in favour of the Django versions after upgrading.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404, HttpResponseNotAllowed
+from django.utils.log import log_response
+
+
+def require_http_methods(request_method_list):
+    def decorator(view_func):
+        @wraps(view_func)
+        async def inner(request, *args, **kwargs):
+            if request.method not in request_method_list:
+                response = HttpResponseNotAllowed(request_method_list)
+                log_response(
+                    'Method Not Allowed (%s): %s', request.method, request.path,
+                    response=response, request=request,
+                )
+                return response
+            return await view_func(request, *args, **kwargs)
+        return inner
+    return decorator
+
+
+def csrf_exempt(view_func):
+    @wraps(view_func)
+    async def inner(*args, **kwargs):
+        return await view_func(*args, **kwargs)
+    inner.csrf_exempt = True
+    return inner
+
+
+async def aget_user(request):
+    """Resolve request.user (session + user lookup) off the event loop"""
+    def resolve():
+        request.user.is_authenticated  # evaluates the lazy object
+        return request.user
+    return await sync_to_async(resolve)()
+
+
+def login_required(view_func):
+    @wraps(view_func)
+    async def inner(request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), settings.LOGIN_URL)
+        return await view_func(request, *args, **kwargs)
+    return inner
+
+
+async def aget_object_or_404(queryset, *args, **kwargs):
+    try:
+        return await queryset.aget(*args, **kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
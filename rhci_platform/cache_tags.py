@@ -0,0 +1,138 @@
+"""
+Tagged, versioned entries on top of the default cache.
+
+Every tag ("home", "case:<id>", "donor:<id>") has a version stored in the
+cache. An entry remembers the versions of its tags when it is stored and
+counts as a miss once any of them has moved on, so invalidating a tag is a
+single write however many entries carry it, and works across every process
+sharing the cache.
+
+Versions are clock readings in nanoseconds. Invalidating stores a fresh one
+instead of incrementing, which on FileBasedCache is a read-modify-write that
+concurrent invalidations could lose. A view reading from the replica does
+not store what it computed while a tag is younger than REPLICA_PIN_SECONDS:
+the replica may not have the write that moved the tag on yet.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from . import metrics
+from .db_routers import reading_from_replica
+
+HOME = 'home'
+
+TAGGED_LOOKUPS = metrics.registry.counter(
+    'rhci_tagged_cache_lookups_total', 'Tagged cache lookups by tag family and result',
+    ['tag', 'result'])
+TAGGED_INVALIDATIONS = metrics.registry.counter(
+    'rhci_tagged_cache_invalidations_total', 'Tag invalidations by tag family', ['tag'])
+
+
+def case_tag(case_id):
+    return f'case:{case_id}'
+
+
+def donor_tag(donor_id):
+    return f'donor:{donor_id}'
+
+
+def _family(tag):
+    return tag.split(':', 1)[0]
+
+
+def _version_key(tag):
+    return f'tag-version:{tag}'
+
+
+def _entry_key(key):
+    return f'tagged:{key}'
+
+
+class TaggedCache:
+    def __init__(self, cache=default_cache):
+        self.cache = cache
+
+    def _lookup(self, key, tags):
+        """Return (hit, value, current tag versions)"""
+        version_keys = [_version_key(tag) for tag in tags]
+        found = self.cache.get_many([_entry_key(key)] + version_keys)
+        versions = tuple(found.get(k) for k in version_keys)
+        entry = found.get(_entry_key(key))
+        hit = entry is not None and None not in versions and entry[0] == versions
+        for family in {_family(tag) for tag in tags}:
+            TAGGED_LOOKUPS.inc((family, 'hit' if hit else 'miss'))
+        return hit, entry[1] if hit else None, versions
+
+    def _ensure_versions(self, tags, versions):
+        """Fill in versions for tags never seen (or evicted) before"""
+        if None not in versions:
+            return versions
+        result = []
+        for tag, version in zip(tags, versions):
+            if version is None:
+                # Start from the clock, not 0, so an evicted tag can never
+                # make entries stored under an older version valid again
+                self.cache.add(_version_key(tag), time.time_ns(), None)
+                version = self.cache.get(_version_key(tag))
+            result.append(version)
+        return tuple(result)
+
+    def get(self, key, tags, default=None):
+        hit, value, _ = self._lookup(key, tuple(tags))
+        return value if hit else default
+
+    def set(self, key, value, tags, timeout=DEFAULT_TIMEOUT):
+        tags = tuple(tags)
+        versions = self._ensure_versions(tags, self._lookup(key, tags)[2])
+        if not self._maybe_stale(versions):
+            self.cache.set(_entry_key(key), (versions, value), timeout)
+
+    def get_or_set(self, key, default, tags, timeout=DEFAULT_TIMEOUT):
+        """
+        Return the cached value, or compute `default()` and store it. Tag
+        versions are read before computing, so an invalidation that happens
+        meanwhile leaves the stored value already stale.
+        """
+        tags = tuple(tags)
+        hit, value, versions = self._lookup(key, tags)
+        if hit:
+            return value
+        versions = self._ensure_versions(tags, versions)
+        value = default() if callable(default) else default
+        if not self._maybe_stale(versions):
+            self.cache.set(_entry_key(key), (versions, value), timeout)
+        return value
+
+    def _maybe_stale(self, versions):
+        """Whether a value read from the replica may predate the latest invalidation"""
+        if not reading_from_replica():
+            return False
+        lag_ns = getattr(settings, 'REPLICA_PIN_SECONDS', 15) * 1_000_000_000
+        return time.time_ns() - max(versions) < lag_ns
+
+    def invalidate(self, *tags):
+        """Invalidate every entry carrying any of `tags`, in one write"""
+        if not tags:
+            return
+        # Entries only compare versions for equality, so a fresh clock
+        # reading serves as an increment and two writers cannot collide
+        version = time.time_ns()
+        self.cache.set_many({_version_key(tag): version for tag in tags}, None)
+        for tag in tags:
+            TAGGED_INVALIDATIONS.inc((_family(tag),))
+
+    def stats(self):
+        """Hits, misses and hit rate per tag family in this process"""
+        stats = {}
+        for (family, result), count in TAGGED_LOOKUPS.series().items():
+            stats.setdefault(family, {'hit': 0, 'miss': 0})[result] = count
+        for counts in stats.values():
+            total = counts['hit'] + counts['miss']
+            counts['hit_rate'] = counts['hit'] / total if total else None
+        return stats
+
+
+tagged_cache = TaggedCache()
@@ -1,13 +1,24 @@
 from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db import models, connection
 from django.db.models import Sum, Count, Q
 from decimal import Decimal
+from django.utils.functional import SimpleLazyObject
 
 def admin_metrics(request):
     """Add metrics to admin template context."""
     if not request.path.startswith('/admin/'):
         return {}
+    # Admin pages render several templates per request; count once
+    if hasattr(request, '_admin_metrics'):
+        return request._admin_metrics
+    # The counts scan growing tables; every admin page shares one result for a while
+    context = cache.get('admin-metrics')
+    if context is not None:
+        request._admin_metrics = context
+        return context
     
     context = {}
     
@@ -54,12 +65,20 @@ def admin_metrics(request):
         print(f"Error in admin_metrics: {e}")
         traceback.print_exc()
         
+    request._admin_metrics = context
+    cache.set('admin-metrics', context, settings.ADMIN_METRICS_CACHE_SECONDS)
     return context
 
 def admin_dashboard_metrics(request):
     """Add dashboard metrics to all admin templates"""
     if not request.path.startswith('/admin/') or not request.user.is_authenticated or not request.user.is_staff:
         return {}
+    if hasattr(request, '_admin_dashboard_metrics'):
+        return request._admin_dashboard_metrics
+    context = cache.get('admin-dashboard-metrics')
+    if context is not None:
+        request._admin_dashboard_metrics = context
+        return context
     
     context = {}
     
@@ -112,4 +131,16 @@ def admin_dashboard_metrics(request):
     
     # Recent patients and donations - skip for context processor to keep it light
     
-    return context
\ No newline at end of file
+    request._admin_dashboard_metrics = context
+    cache.set('admin-dashboard-metrics', context, settings.ADMIN_METRICS_CACHE_SECONDS)
+    return context
+
+
+def unread_notifications(request):
+    """Navbar badge count; read from the per-user counter only if a template shows it"""
+    from apps.users.notifications import unread_count
+
+    def count():
+        user = getattr(request, 'user', None)
+        return unread_count(user) if user is not None and user.is_authenticated else 0
+    return {'unread_notifications': SimpleLazyObject(count)}
@@ -0,0 +1,77 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+# Per-request routing state, set by ReplicaRoutingMiddleware
+_routing = ContextVar('rhci_db_routing', default=None)
+
+# Writes to these apps do not count as "the user's own write"
+UNPINNED_APP_LABELS = {'sessions'}
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.read_only_view = False
+        self.pinned = pinned
+        self.wrote = False
+
+
+def replica_alias():
+    """Return the replica alias if one is configured, otherwise None"""
+    alias = getattr(settings, 'REPLICA_DATABASE_ALIAS', 'replica')
+    return alias if alias in connections.databases else None
+
+
+def replica_reads(view_func):
+    """Mark a function view as safe to serve from the read replica"""
+    view_func.replica_reads = True
+    return view_func
+
+
+class ReplicaReadMixin:
+    """Mark a class-based view as safe to serve from the read replica"""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.replica_reads = True
+        return view
+
+
+def reading_from_replica():
+    """Whether reads in the current context go to the replica"""
+    state = _routing.get()
+    return (state is not None and state.read_only_view and not state.pinned and not state.wrote
+            and replica_alias() is not None)
+
+
+class ReplicaRouter:
+    """
+    Send reads from views marked read-only to the replica and everything else,
+    including all writes, to the primary (`default`).
+
+    Reads fall back to the primary when there is no request context, the
+    request is not a safe method, the user wrote recently (pin cookie), or the
+    current request has already written.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or not state.read_only_view or state.pinned or state.wrote:
+            return 'default'
+        return replica_alias() or 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None and model._meta.app_label not in UNPINNED_APP_LABELS:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primary and replica hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica receives schema changes through replication
+        return db == 'default'
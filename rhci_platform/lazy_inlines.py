@@ -0,0 +1,224 @@
+"""
+Admin inlines that load one page at a time, when expanded.
+
+A regular inline renders a form for every related row into the change page,
+so a patient with hundreds of cases makes a page of hundreds of forms. A
+ModelAdmin with LazyInlinesMixin instead renders one collapsed panel per
+entry of `lazy_inlines`. Opening a panel fetches
+`<object_id>/inline/<model_name>/?page=N`, an HTML fragment with a tabular
+formset for LAZY_INLINE_PAGE_SIZE rows and links to the other pages.
+
+Saving a page posts only that page, and its rows are written together: new
+rows with one bulk_create, edited rows with one bulk_update of the fields
+that changed and deleted rows with one DELETE. Bulk writes skip
+Model.save() and post_save, so each LazyInline's `saved()` does what those
+would have (events, and cache invalidation deferred to the commit) once for
+the page.
+"""
+from django import forms
+from django.conf import settings
+from django.contrib.admin import helpers
+from django.contrib.admin.options import InlineModelAdmin
+from django.contrib.admin.utils import unquote
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.forms.models import BaseInlineFormSet, _get_foreign_key
+from django.http import Http404, HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.functional import cached_property
+from django.utils.text import capfirst
+
+from .query_budget import query_budget
+from .transactions import write_transaction
+
+
+def _is_fetch(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+class PageRowField(forms.ModelChoiceField):
+    """
+    The hidden primary key field of a page's forms. ModelChoiceField would
+    validate each with its own query; this looks it up among the rows the
+    formset has loaded.
+    """
+
+    def __init__(self, formset, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.formset = formset
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.formset.rows_by_pk[str(value)]
+        except KeyError:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice',
+                                  params={'value': value})
+
+
+class LazyInlineFormSet(BaseInlineFormSet):
+    @cached_property
+    def rows_by_pk(self):
+        return {str(obj.pk): obj for obj in self.get_queryset()}
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        name = self._pk_field.name
+        field = form.fields.get(name)
+        if isinstance(field, forms.ModelChoiceField):
+            form.fields[name] = PageRowField(self, field.queryset, initial=field.initial,
+                                             required=False, widget=field.widget)
+
+
+class LazyInline(InlineModelAdmin):
+    """Tabular inline for LazyInlinesMixin.lazy_inlines"""
+    template = 'admin/edit_inline/tabular.html'
+    formset = LazyInlineFormSet
+    extra = 0
+    # Rows per page (default LAZY_INLINE_PAGE_SIZE)
+    per_page = None
+
+    def get_per_page(self):
+        return self.per_page or settings.LAZY_INLINE_PAGE_SIZE
+
+    @property
+    def foreign_key(self):
+        return _get_foreign_key(self.parent_model, self.model, self.fk_name)
+
+    def get_page(self, request, parent, number):
+        """The page of `parent`'s rows and a queryset of them for the formset"""
+        ordering = [*(self.get_ordering(request) or self.model._meta.ordering), 'pk']
+        rows = self.get_queryset(request).filter(**{self.foreign_key.name: parent}).order_by(*ordering)
+        paginator = Paginator(rows.values_list('pk', flat=True), self.get_per_page())
+        page = paginator.get_page(number)
+        return page, rows.filter(pk__in=list(page.object_list))
+
+    def save_page(self, request, parent, formset):
+        """Write a valid formset's added, changed and deleted rows in bulk"""
+        formset.save(commit=False)
+        opts = self.model._meta
+        with write_transaction():
+            if formset.new_objects:
+                self.model._default_manager.bulk_create(formset.new_objects)
+            if formset.changed_objects:
+                fields = {field for field in opts.concrete_fields if getattr(field, 'auto_now', False)}
+                for obj, names in formset.changed_objects:
+                    fields.update(field for field in opts.concrete_fields
+                                  if field.name in names and not field.primary_key)
+                objs = [obj for obj, names in formset.changed_objects]
+                # What save() would do per field: auto_now timestamps, committing uploaded files
+                for obj in objs:
+                    for field in fields:
+                        setattr(obj, field.attname, field.pre_save(obj, False))
+                self.model._default_manager.bulk_update(objs, [field.name for field in fields])
+            if formset.deleted_objects:
+                self.model._default_manager.filter(pk__in=[obj.pk for obj in formset.deleted_objects]).delete()
+            self.saved(request, parent, formset.new_objects, formset.changed_objects, formset.deleted_objects)
+
+    def saved(self, request, parent, added, changed, deleted):
+        """
+        Called inside the save transaction with the rows just written:
+        `changed` is (obj, changed field names) pairs. Write events here so
+        they commit with the rows; invalidate caches with
+        transaction.on_commit(), or a concurrent request can cache the old
+        rows again before the commit.
+        """
+
+
+class LazyInlinesMixin:
+    """ModelAdmin mixin rendering `lazy_inlines` as panels loaded on demand"""
+    lazy_inlines = []
+    change_form_template = 'admin/lazy_inlines/change_form.html'
+
+    def get_lazy_inline_instances(self, request, obj):
+        inlines = [inline_class(self.model, self.admin_site) for inline_class in self.lazy_inlines]
+        return [inline for inline in inlines if inline.has_view_or_change_permission(request, obj)]
+
+    def get_urls(self):
+        name = '%s_%s_inline' % (self.opts.app_label, self.opts.model_name)
+        return [
+            path('<path:object_id>/inline/<str:model_name>/', self.admin_site.admin_view(self.lazy_inline_view),
+                 name=name),
+        ] + super().get_urls()
+
+    def render_change_form(self, request, context, add=False, change=False, form_url='', obj=None):
+        if obj is not None:
+            inlines = self.get_lazy_inline_instances(request, obj)
+            name = 'admin:%s_%s_inline' % (self.opts.app_label, self.opts.model_name)
+            context['lazy_inline_panels'] = [
+                {'title': inline.verbose_name_plural,
+                 'url': reverse(name, args=[obj.pk, inline.opts.model_name], current_app=self.admin_site.name)}
+                for inline in inlines
+            ]
+            # Scripts the fragments need are loaded up front: they do not run when inserted
+            media = forms.Media(js=['admin/js/jquery.init.js', 'admin/js/inlines.js', 'js/admin/lazy_inlines.js'])
+            for inline in inlines:
+                empty = inline.get_formset(request, obj)(instance=obj, queryset=inline.model._default_manager.none())
+                media += inline.media + empty.media
+            context['media'] = context['media'] + media
+        return super().render_change_form(request, context, add, change, form_url, obj)
+
+    # Django's form fields validate and render each row's foreign keys with a query apiece
+    @query_budget(20 + 3 * settings.LAZY_INLINE_PAGE_SIZE)
+    def lazy_inline_view(self, request, object_id, model_name):
+        """One page of a lazy inline: GET renders it, POST saves it"""
+        parent = self.get_object(request, unquote(object_id))
+        if parent is None or not self.has_view_or_change_permission(request, parent):
+            raise Http404
+        inline = next((inline for inline in self.get_lazy_inline_instances(request, parent)
+                       if inline.opts.model_name == model_name), None)
+        if inline is None:
+            raise Http404
+        can_edit = self.has_change_permission(request, parent)
+        if request.method == 'POST' and not can_edit:
+            raise PermissionDenied
+
+        FormSet = inline.get_formset(request, parent)
+        prefix = FormSet.get_default_prefix()
+        formset = saved = None
+        if request.method == 'POST':
+            # The posted rows, not the page as it is now: rows may have been added since it was loaded
+            pk_name = inline.opts.pk.name
+            posted = [request.POST.get(f'{prefix}-{n}-{pk_name}', '') for n in range(inline.get_per_page())]
+            posted_rows = inline.get_queryset(request).filter(
+                **{inline.foreign_key.name: parent}, pk__in=[pk for pk in posted if pk.isdigit()])
+            formset = FormSet(request.POST, request.FILES, instance=parent, queryset=posted_rows, prefix=prefix)
+            if formset.is_valid():
+                inline.save_page(request, parent, formset)
+                saved = (len(formset.new_objects), len(formset.changed_objects), len(formset.deleted_objects))
+                self.log_change(request, parent, '{}: {} added, {} changed, {} deleted.'.format(
+                    capfirst(inline.verbose_name_plural), *saved))
+                if not _is_fetch(request):
+                    return HttpResponseRedirect(request.get_full_path())
+                formset = None
+        page, rows = inline.get_page(request, parent, request.GET.get('page'))
+        if formset is None:
+            formset = FormSet(instance=parent, queryset=rows, prefix=prefix)
+        if not can_edit:
+            formset.extra = formset.max_num = 0
+
+        inline_admin_formset = helpers.InlineAdminFormSet(
+            inline, formset, list(inline.get_fieldsets(request, parent)),
+            dict(inline.get_prepopulated_fields(request, parent)),
+            list(inline.get_readonly_fields(request, parent)),
+            model_admin=self,
+            has_add_permission=can_edit and inline.has_add_permission(request, parent),
+            has_change_permission=can_edit and inline.has_change_permission(request, parent),
+            has_delete_permission=can_edit and inline.has_delete_permission(request, parent),
+            has_view_permission=inline.has_view_permission(request, parent),
+        )
+        context = {
+            **self.admin_site.each_context(request),
+            'title': f'{capfirst(inline.verbose_name_plural)} of {parent}',
+            'opts': self.opts,
+            'original': parent,
+            'inline_admin_formset': inline_admin_formset,
+            'page': page,
+            'can_edit': can_edit,
+            'saved': saved,
+            'media': self.media + inline.media + formset.media,
+        }
+        template = 'admin/lazy_inlines/panel.html' if _is_fetch(request) else 'admin/lazy_inlines/page.html'
+        return TemplateResponse(request, template, context)
@@ -0,0 +1,215 @@
+"""
+In-process metrics registry exported in the Prometheus text format.
+
+Every worker process keeps its own registry, so scrape each worker (or run
+one worker per container) to see the whole deployment.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Time spent in external services during the current request, by service
+_external_timings = ContextVar('rhci_external_timings', default=None)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (
+        str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        for v in values
+    )
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def series(self):
+        """Return a copy of {label values: count}"""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # label values -> [count per bucket..., sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in sorted(self._series.items())]
+        names = self.labels + ('le',)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f'{self.name}_bucket', _format_labels(names, labels + (_format_value(bound),)), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labels, labels), series[-1]
+            yield f'{self.name}_count', _format_labels(self.labels, labels), cumulative
+
+
+class Gauge:
+    """
+    A value that can go up and down. With `collect`, a callable returning
+    {label values: value}, it is computed when the registry is rendered.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self):
+        if self.collect is not None:
+            values = self.collect()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def counter(self, name, documentation, labels=()):
+        return self._metrics.setdefault(name, Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), collect=None):
+        return self._metrics.setdefault(name, Gauge(name, documentation, labels, collect))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._metrics.setdefault(name, Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format (0.0.4)"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram(
+    'rhci_http_request_duration_seconds', 'Request latency by view', ['view', 'method'])
+REQUEST_DB_TIME = registry.histogram(
+    'rhci_http_request_db_seconds', 'Database time per request by view', ['view'])
+REQUEST_QUERIES = registry.histogram(
+    'rhci_http_request_queries', 'Database queries per request by view', ['view'],
+    buckets=QUERY_COUNT_BUCKETS)
+RESPONSE_SIZE = registry.histogram(
+    'rhci_http_response_size_bytes', 'Response body size by view', ['view'],
+    buckets=SIZE_BUCKETS)
+RESPONSES = registry.counter(
+    'rhci_http_responses_total', 'Responses by view, method and status code',
+    ['view', 'method', 'status'])
+EXTERNAL_CALL_LATENCY = registry.histogram(
+    'rhci_external_call_duration_seconds', 'Outbound call latency by service and operation',
+    ['service', 'operation'])
+EXTERNAL_CALL_ERRORS = registry.counter(
+    'rhci_external_call_errors_total', 'Outbound calls that raised, by service and operation',
+    ['service', 'operation'])
+
+
+@contextmanager
+def external_call(service, operation):
+    """Time an outbound call, e.g. `with external_call('azampay', 'checkout'):`"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        EXTERNAL_CALL_ERRORS.inc((service, operation))
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        EXTERNAL_CALL_LATENCY.observe(elapsed, (service, operation))
+        timings = _external_timings.get()
+        if timings is not None:
+            timings[service] = timings.get(service, 0.0) + elapsed
+
+
+@contextmanager
+def collect_external_timings():
+    """Collect external call time per service for the enclosed request"""
+    timings = {}
+    token = _external_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _external_timings.reset(token)
+
+
+def server_timing(total, db_time=None, queries=None, external=None):
+    """Build a Server-Timing header value; durations are in seconds"""
+    entries = []
+    if db_time is not None:
+        entries.append(f'db;dur={db_time * 1000:.1f};desc="{queries} queries"')
+    for service, elapsed in sorted((external or {}).items()):
+        entries.append(f'{service};dur={elapsed * 1000:.1f}')
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
@@ -0,0 +1,179 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from . import metrics
+from .db_routers import RoutingState, _routing
+from .query_budget import QueryRecorder, budget_for
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that wraps the rest of the chain and works under both
+    WSGI and ASGI, so async views are not pushed back onto a thread. Subclasses
+    implement `wrap(request)`, a context manager around the inner call, and
+    `finish(request, response, state)`.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.wrap(request) as state:
+            response = self.get_response(request)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        with self.wrap(request) as state:
+            response = await self.get_response(request)
+        return self.finish(request, response, state)
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """
+    WhiteNoise 6 is sync-only; under ASGI that would run every request
+    through a thread. File lookups are in memory, so serve them directly and
+    only await the rest of the chain.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class ReplicaRoutingMiddleware(HybridMiddleware):
+    """
+    Enable replica reads for safe requests to views marked with
+    `replica_reads` / `ReplicaReadMixin`, and pin a client to the primary for
+    REPLICA_PIN_SECONDS after any request in which it wrote.
+    """
+
+    @contextmanager
+    def wrap(self, request):
+        cookie = getattr(settings, 'REPLICA_PIN_COOKIE', 'rhci_pin_primary')
+        state = RoutingState(pinned=cookie in request.COOKIES)
+        token = _routing.set(state)
+        try:
+            yield state
+        finally:
+            _routing.reset(token)
+
+    def finish(self, request, response, state):
+        cookie = getattr(settings, 'REPLICA_PIN_COOKIE', 'rhci_pin_primary')
+        if state.wrote:
+            response.set_cookie(
+                cookie, '1',
+                max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 15),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _routing.get()
+        if state is not None and request.method in SAFE_METHODS:
+            state.read_only_view = getattr(view_func, 'replica_reads', False)
+        return None
+
+
+class QueryBudgetMiddleware(HybridMiddleware):
+    """
+    Record query count, DB time and repeated SQL for every request and log a
+    warning when a view goes over its query budget. The recorder and budget
+    are attached to the response for `rhci_platform.testing` to assert on.
+    """
+
+    def wrap(self, request):
+        return QueryRecorder().record()
+
+    def finish(self, request, response, recorder):
+        budget = getattr(request, 'query_budget', None)
+        response.query_recorder = recorder
+        response.query_budget = budget
+        if budget is not None and recorder.count > budget:
+            logger.warning(
+                f"Query budget exceeded for {request.method} {request.path} "
+                f"({getattr(request, 'query_budget_view', '?')}): "
+                f"budget {budget}, {recorder.summary()}"
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        request.query_budget_view = view_name
+        request.query_budget = budget_for(view_func, view_name)
+        return None
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Record latency, DB time, query count, response size and status for every
+    request, labelled by URL name, and, with DEBUG or METRICS_SERVER_TIMING
+    on, add a Server-Timing header with the db / external service / total
+    breakdown. Sits outside QueryBudgetMiddleware, whose recorder supplies
+    the DB figures.
+    """
+
+    @contextmanager
+    def wrap(self, request):
+        started = time.perf_counter()
+        with metrics.collect_external_timings() as external:
+            yield started, external
+
+    def finish(self, request, response, state):
+        started, external = state
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        metrics.REQUEST_LATENCY.observe(elapsed, (view, request.method))
+        metrics.RESPONSES.inc((view, request.method, str(response.status_code)))
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.observe(len(response.content), (view,))
+        elif response.has_header('Content-Length'):
+            metrics.RESPONSE_SIZE.observe(int(response['Content-Length']), (view,))
+
+        recorder = getattr(response, 'query_recorder', None)
+        if recorder is not None:
+            metrics.REQUEST_DB_TIME.observe(recorder.duration, (view,))
+            metrics.REQUEST_QUERIES.observe(recorder.count, (view,))
+
+        if settings.DEBUG or getattr(settings, 'METRICS_SERVER_TIMING', False):
+            response['Server-Timing'] = metrics.server_timing(
+                elapsed,
+                db_time=recorder.duration if recorder else None,
+                queries=recorder.count if recorder else None,
+                external=external,
+            )
+        return response
@@ -0,0 +1,102 @@
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Recorders active in the current context. Async views run their queries in
+# sync_to_async threads with their own connections; the context (unlike the
+# connection) follows them there.
+_recorders = ContextVar('rhci_query_recorders', default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    recorders = _recorders.get()
+    if not recorders:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for recorder in recorders:
+            recorder.add(sql, elapsed)
+
+
+def _install(connection):
+    if _dispatch not in connection.execute_wrappers:
+        # Outermost, so execute_wrapper() blocks can still pop their own
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _install(connection)
+
+
+connection_created.connect(_on_connection_created)
+
+
+class QueryRecorder:
+    """
+    Count queries, total DB time and how often each SQL statement was issued
+    while recording. Parameters are not part of the statement, so an N+1
+    loop shows up as one statement repeated N times.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def add(self, sql, elapsed):
+        self.duration += elapsed
+        self.count += 1
+        self.statements[sql] += 1
+
+    @contextmanager
+    def record(self):
+        """Record every query issued in this context, on any connection or thread"""
+        for conn in connections.all(initialized_only=True):
+            _install(conn)
+        token = _recorders.set(_recorders.get() + (self,))
+        try:
+            yield self
+        finally:
+            _recorders.reset(token)
+
+    def duplicates(self):
+        """Return (sql, times) for statements issued more than once, most repeated first"""
+        return [(sql, times) for sql, times in self.statements.most_common() if times > 1]
+
+    def summary(self, limit=3):
+        lines = [f"{self.count} queries in {self.duration * 1000:.1f}ms"]
+        for sql, times in self.duplicates()[:limit]:
+            lines.append(f"  {times}x {sql[:200]}")
+        return '\n'.join(lines)
+
+
+def query_budget(limit):
+    """Declare the maximum number of queries a function view may issue per request"""
+    def decorator(view_func):
+        view_func.query_budget = limit
+        return view_func
+    return decorator
+
+
+def budget_for(view_func, view_name=None):
+    """
+    Resolve the query budget for a view: `@query_budget` on a function view,
+    a `query_budget` attribute on a class-based view, QUERY_BUDGETS[view_name]
+    (for views we do not own, e.g. the admin), then QUERY_BUDGET_DEFAULT.
+    """
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'view_class', None), 'query_budget', None)
+    if budget is None and view_name:
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+    if budget is None:
+        budget = getattr(settings, 'QUERY_BUDGET_DEFAULT', None)
+    return budget
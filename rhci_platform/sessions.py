@@ -0,0 +1,69 @@
+"""
+Session engine that keeps anonymous sessions in a signed cookie and moves a
+session into cached_db storage once a user logs in.
+
+Anonymous visitors who only pick up a flash message or a login `next` URL no
+longer create `django_session` rows, and authenticated requests are served
+from the cache instead of reading the table. Signed cookies cannot be revoked
+server-side, which is acceptable for data that carries no identity; anything
+with `_auth_user_id` in it lives in the database and is removed on logout.
+"""
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends import cached_db
+from django.core import signing
+
+SIGNED_COOKIE_SALT = 'django.contrib.sessions.backends.signed_cookies'
+
+
+def is_cookie_key(session_key):
+    """Signed payloads contain ':' separators; database keys are [a-z0-9]{32}"""
+    return bool(session_key) and ':' in session_key
+
+
+class SessionStore(cached_db.SessionStore):
+    def load(self):
+        if not is_cookie_key(self.session_key):
+            return super().load()
+        try:
+            return signing.loads(
+                self.session_key,
+                serializer=self.serializer,
+                max_age=self.get_session_cookie_age(),
+                salt=SIGNED_COOKIE_SALT,
+            )
+        except Exception:
+            # Tampered, expired or from another SECRET_KEY: start empty
+            self._session_key = None
+            return {}
+
+    def save(self, must_create=False):
+        data = self._get_session(no_load=must_create)
+        if SESSION_KEY in data:
+            if self.session_key is None or is_cookie_key(self.session_key):
+                # Logging in: create() picks a fresh database key and calls
+                # back into save()
+                return self.create()
+            return super().save(must_create)
+
+        if self.session_key and not is_cookie_key(self.session_key) and not must_create:
+            # A stored session lost its user id without a flush; drop the row.
+            # With must_create the key was just generated (create(), cycle_key())
+            # and there is no row to drop.
+            super().delete(self.session_key)
+        self._session_key = signing.dumps(
+            data, compress=True, salt=SIGNED_COOKIE_SALT, serializer=self.serializer)
+
+    def exists(self, session_key):
+        if is_cookie_key(session_key):
+            return False
+        return super().exists(session_key)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        if is_cookie_key(session_key):
+            if session_key == self.session_key:
+                self._session_key = None
+                self._session_cache = {}
+            return
+        super().delete(session_key)
@@ -2,6 +2,8 @@
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'  # Or wherever you want to redirect after login
 LOGOUT_REDIRECT_URL = '/login/'
+# Donors sign in with their email; see apps/users/backends.py
+AUTHENTICATION_BACKENDS = ['apps.users.backends.EmailBackend']
 
 
 # Load environment variables securely from .env (requires python-dotenv)
@@ -74,6 +76,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'rhci_platform.middleware.WhiteNoiseMiddleware',
+    'rhci_platform.middleware.MetricsMiddleware',
+    'rhci_platform.middleware.QueryBudgetMiddleware',
+    'rhci_platform.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -95,8 +101,9 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                'rhci_platform.context_processors.admin_metrics',  # Keep this
+                'rhci_platform.context_processors.admin_metrics',  # Keep this (cached, ADMIN_METRICS_CACHE_SECONDS)
                 'rhci_platform.context_processors.admin_dashboard_metrics',
+                'rhci_platform.context_processors.unread_notifications',
             ]
         },
     },
@@ -108,13 +115,79 @@ WSGI_APPLICATION = 'rhci_platform.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+def _database_config(prefix, sqlite_default=None):
+    """
+    Build one DATABASES entry from environment variables.
+
+    <prefix>_ENGINE is 'sqlite' (default) or 'postgres'. Postgres reads
+    <prefix>_NAME/_USER/_PASSWORD/_HOST/_PORT, keeps connections open for
+    <prefix>_CONN_MAX_AGE seconds and health-checks them before reuse. With
+    <prefix>_POOLER=pgbouncer, connections go through a local PgBouncer in
+    transaction mode, so server-side cursors are disabled.
+    """
+    def env(key, default=None):
+        return os.environ.get(f'{prefix}_{key}', default)
+
+    if env('ENGINE', 'sqlite') == 'postgres':
+        config = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': env('NAME', 'rhci'),
+            'USER': env('USER', 'rhci'),
+            'PASSWORD': env('PASSWORD', ''),
+            'HOST': env('HOST', 'localhost'),
+            'PORT': env('PORT', '5432'),
+            'CONN_MAX_AGE': int(env('CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': env('CONN_HEALTH_CHECKS', 'True') == 'True',
+            'OPTIONS': {
+                'connect_timeout': int(env('CONNECT_TIMEOUT', '5')),
+            },
+        }
+        if env('POOLER') == 'pgbouncer':
+            config['PORT'] = env('PORT', '6432')
+            config['DISABLE_SERVER_SIDE_CURSORS'] = True
+        return config
+    name = env('NAME', sqlite_default)
+    if not name:
+        return None
+    return {
+        # django.db.backends.sqlite3 plus SQLITE_PRAGMAS and BEGIN IMMEDIATE support
+        'ENGINE': 'rhci_platform.sqlite_backend',
+        'NAME': name,
     }
+
+
+# SQLite by default; set DJANGO_DB_ENGINE=postgres for production
+DATABASES = {
+    'default': _database_config('DJANGO_DB', BASE_DIR / 'db.sqlite3'),
 }
 
+# Optional read replica (DJANGO_REPLICA_DB_* variables, same keys as above).
+# Views marked with replica_reads/ReplicaReadMixin read from it; all writes,
+# and reads for REPLICA_PIN_SECONDS after a client's own write, go to
+# `default`. Locally this can be a copy of db.sqlite3.
+_replica = _database_config('DJANGO_REPLICA_DB')
+if _replica:
+    _replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES['replica'] = _replica
+
+# Applied to every new SQLite connection. WAL lets readers run alongside the
+# callback writer; busy_timeout makes writers wait instead of failing with
+# "database is locked"; synchronous=NORMAL is durable across app crashes in
+# WAL mode and only risks the last commits on power loss.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': int(os.environ.get('DJANGO_SQLITE_BUSY_TIMEOUT', '5000')),
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,  # KiB, i.e. ~20 MB per connection
+    'temp_store': 'MEMORY',
+}
+
+DATABASE_ROUTERS = ['rhci_platform.db_routers.ReplicaRouter']
+REPLICA_DATABASE_ALIAS = 'replica'
+REPLICA_PIN_SECONDS = 15
+REPLICA_PIN_COOKIE = 'rhci_pin_primary'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -151,17 +224,50 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = '/static/'
-STATIC_ROOT = os.path.join(BASE_DIR, 'static')
-# STATICFILES_DIRS = [
-#     os.path.join(BASE_DIR, 'static'),
-#     BASE_DIR / 'static',   # ensure your project-level static/ folder exists
-# ]
+# collectstatic output; the project's own assets live in static/
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+STATICFILES_DIRS = [
+    os.path.join(BASE_DIR, 'static'),
+]
+
+# Outside DEBUG, collectstatic writes content-hashed filenames plus .gz/.br
+# variants, and WhiteNoise serves hashed files with a far-future immutable
+# Cache-Control header (WHITENOISE_MAX_AGE covers the unhashed originals).
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'whitenoise.storage.CompressedStaticFilesStorage' if DEBUG
+            else 'rhci_platform.storage.LenientManifestStaticFilesStorage'
+        ),
+    },
+}
+WHITENOISE_MAX_AGE = 0 if DEBUG else 60 * 60 * 24
+# Templates that reference a missing asset fall back to the unhashed URL
+# instead of raising a 500
+WHITENOISE_MANIFEST_STRICT = False
 
 # Media files (User uploads)
 MEDIA_URL = '/media/'
 # change to a dedicated media folder
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Protected file delivery (medical records)
+# '' streams from Django in chunks, 'xsendfile' sets X-Sendfile (Apache/lighttpd),
+# 'nginx' sets X-Accel-Redirect to SENDFILE_INTERNAL_URL (an `internal` location
+# aliased to MEDIA_ROOT). The proxy must not expose /media/medical_records/ itself.
+SENDFILE_BACKEND = os.environ.get('DJANGO_SENDFILE_BACKEND', '')
+SENDFILE_INTERNAL_URL = os.environ.get('DJANGO_SENDFILE_INTERNAL_URL', '/protected-media/')
+SENDFILE_CHUNK_SIZE = 64 * 1024
+
+# Resumable chunked uploads (medical records and case images)
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'tmp_uploads')
+CHUNKED_UPLOAD_CHUNK_SIZE = 1024 * 1024  # suggested to clients
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_FILE_SIZE = 500 * 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -199,10 +305,122 @@ LOGGING = {
     },
 }
 
-# Cache settings for token storage
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
-    }
-}
\ No newline at end of file
+# Query budgets: requests issuing more queries than their view's budget are
+# logged by QueryBudgetMiddleware and fail the view's tests. Views declare
+# their own budget (`query_budget`); QUERY_BUDGETS covers views we do not own.
+QUERY_BUDGET_DEFAULT = int(os.environ.get('DJANGO_QUERY_BUDGET_DEFAULT', 30))
+QUERY_BUDGETS = {
+    # Date hierarchy and value filters use a few index seeks each instead of
+    # one scan (rhci_platform.changelists)
+    'admin:donations_donation_changelist': 40,
+    'admin:donations_paymentcallback_changelist': 40,
+    'admin:donations_receipt_changelist': 18,
+}
+
+# Metrics: /metrics/ serves Prometheus text to staff users, or to scrapers
+# presenting `Authorization: Bearer <METRICS_TOKEN>` when a token is set.
+# The Server-Timing header exposes DB and AzamPay timings to the client, so
+# it is only sent with DEBUG on or when METRICS_SERVER_TIMING is enabled.
+METRICS_TOKEN = os.environ.get('DJANGO_METRICS_TOKEN', '')
+METRICS_SERVER_TIMING = os.environ.get('DJANGO_METRICS_SERVER_TIMING', 'false').lower() == 'true'
+
+# Output of `manage.py benchmark_views`, kept out of git
+BENCHMARK_RESULTS_DIR = BASE_DIR / 'benchmark_results'
+
+# Payment callbacks and donation payloads older than CALLBACK_RETENTION_DAYS
+# move from the database to compressed segment files in CALLBACK_ARCHIVE_DIR
+# (`manage.py archive_callbacks`, apps.donations.archive). Keep the directory
+# on durable storage and out of git.
+CALLBACK_RETENTION_DAYS = int(os.environ.get('DJANGO_CALLBACK_RETENTION_DAYS', 180))
+CALLBACK_ARCHIVE_DIR = Path(os.environ.get('DJANGO_CALLBACK_ARCHIVE_DIR', BASE_DIR / 'archive'))
+
+# Cache: shared by every worker so the AzamPay token, provider lists and
+# tagged page data (rhci_platform.cache_tags) are computed and invalidated once
+def _cache_config(url):
+    """
+    Build a cache from a URL:
+      redis://host:6379/0      RedisCache (needs the `redis` package)
+      memcached://host:11211   PyMemcacheCache (needs `pymemcache`)
+      file:///var/cache/rhci   FileBasedCache, shared by the workers on one host
+      locmem://name            LocMemCache, private to each process
+    """
+    scheme, _, location = url.partition('://')
+    if scheme in ('redis', 'rediss'):
+        config = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': url}
+    elif scheme == 'memcached':
+        config = {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': location}
+    elif scheme == 'file':
+        config = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    elif scheme == 'locmem':
+        config = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': location or 'rhci'}
+    else:
+        raise ValueError(f"Unsupported DJANGO_CACHE_URL scheme: {scheme!r}")
+    config['KEY_PREFIX'] = os.environ.get('DJANGO_CACHE_KEY_PREFIX', 'rhci')
+    return config
+
+
+CACHES = {'default': _cache_config(os.environ.get('DJANGO_CACHE_URL', f"file://{BASE_DIR / 'cache'}"))}
+
+# The test runner swaps in a process-local cache (rhci_platform.testing.TEST_CACHES),
+# so tests never share entries with a running server
+TEST_RUNNER = 'rhci_platform.testing.TestRunner'
+
+# Sessions: anonymous sessions live in a signed cookie, logged-in sessions in
+# cached_db (see rhci_platform.sessions). Set DJANGO_SESSION_ENGINE to
+# django.contrib.sessions.backends.db to go back to a row per visitor.
+SESSION_ENGINE = os.environ.get('DJANGO_SESSION_ENGINE', 'rhci_platform.sessions')
+SESSION_COOKIE_AGE = int(os.environ.get('DJANGO_SESSION_COOKIE_AGE', 60 * 60 * 24 * 14))
+
+# Background tasks (core.tasks), processed by `manage.py run_tasks`.
+# DJANGO_TASKS_EAGER=True runs each task in-process right after its
+# transaction commits, for development without a worker.
+TASKS_EAGER = os.environ.get('DJANGO_TASKS_EAGER', 'False') == 'True'
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_DELAY = 10  # seconds before the first retry, doubled each time
+TASK_RETRY_MAX_DELAY = 3600
+TASK_LOCK_TIMEOUT = 600  # running tasks older than this are assumed lost
+TASK_RETENTION_DAYS = 7
+
+# Transactional outbox (core.outbox). The run_tasks worker delivers events to
+# subscribers; OUTBOX_EAGER delivers them in-process after each commit.
+OUTBOX_EAGER = TASKS_EAGER
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_SETTLE_SECONDS = 5  # how long a gap in event ids may be an uncommitted write
+OUTBOX_RECHECK_SECONDS = 900  # how long skipped ids are looked for again before giving up
+
+# Email is queued in the database (core.mail) and delivered by
+# `manage.py send_emails` in batches over one reused connection of
+# EMAIL_DELIVERY_BACKEND, at most EMAIL_RATE_LIMIT messages a second per sender.
+EMAIL_BACKEND = 'core.mail.OutboxBackend'
+EMAIL_DELIVERY_BACKEND = os.environ.get(
+    'DJANGO_EMAIL_DELIVERY_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.environ.get('DJANGO_EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('DJANGO_EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('DJANGO_EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('DJANGO_EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('DJANGO_EMAIL_USE_TLS', 'False') == 'True'
+EMAIL_TIMEOUT = 30
+DEFAULT_FROM_EMAIL = os.environ.get('DJANGO_DEFAULT_FROM_EMAIL', 'RHCI <noreply@localhost>')
+EMAIL_OUTBOX_EAGER = TASKS_EAGER
+EMAIL_BATCH_SIZE = 100
+EMAIL_RATE_LIMIT = float(os.environ.get('DJANGO_EMAIL_RATE_LIMIT', 10))
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETENTION_DAYS = 30
+# Absolute links in emails
+SITE_URL = os.environ.get('DJANGO_SITE_URL', 'http://localhost:8000')
+
+# Donor CSV import. Admin uploads are validated in the request and imported
+# by the task worker; larger files than DONOR_IMPORT_MAX_ROWS go through
+# `manage.py import_donors`, which hashes passwords in one process per CPU.
+DONOR_IMPORT_MAX_ROWS = 5000
+
+# The admin header counts (rhci_platform.context_processors) are shared by
+# every admin page for this long instead of recounted on each request
+ADMIN_METRICS_CACHE_SECONDS = 60
+
+# Rows per page of the admin's lazily loaded inline panels (rhci_platform.lazy_inlines)
+LAZY_INLINE_PAGE_SIZE = 20
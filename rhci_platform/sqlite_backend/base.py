@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend tuned for a single-node deployment.
+
+    Every new connection applies settings.SQLITE_PRAGMAS (WAL journal, busy
+    timeout, ...). Code that is about to write can set `begin_immediate` so
+    the next transaction starts with BEGIN IMMEDIATE and takes the write lock
+    up front instead of failing with "database is locked" when it upgrades
+    from a read lock halfway through. See rhci_platform.transactions.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.begin_immediate = False
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.begin_immediate:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
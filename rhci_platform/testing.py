@@ -0,0 +1,255 @@
+"""Helpers shared by the test suites and benchmarks of the project's apps."""
+import json
+import re
+import socketserver
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# Process-local, so tests never share entries with a server using the real cache
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (?:TABLE )?"?(\w+)"?(?:\s+AS\s+\w+)?\s*$')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on "?(\w+)"?')
+# Django aliases tables in subqueries and repeated joins: "donations_donation" U0
+TABLE_ALIAS = re.compile(r'"(\w+)" ([UT]\d+)\b')
+
+
+def explain(sql, params=None, using=connection):
+    """Return the query plan for `sql` as a list of text lines"""
+    with using.cursor() as cursor:
+        if using.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+        if using.vendor == 'postgresql':
+            # Tiny test tables are always cheaper to seq-scan; ask the planner
+            # what it would do if the table were large
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return [row[0] for row in cursor.fetchall()]
+    raise NotImplementedError(f'EXPLAIN is not supported for {using.vendor}')
+
+
+def full_scans(captured_queries, tables, using=connection):
+    """
+    Return (sql, plan) for every captured SELECT that reads one of `tables`
+    with a full table scan. `captured_queries` is
+    CaptureQueriesContext.captured_queries; parameters are already inlined in
+    those strings, so the SQL is re-planned as-is.
+    """
+    pattern = SQLITE_FULL_SCAN if using.vendor == 'sqlite' else POSTGRES_FULL_SCAN
+    offenders = []
+    for query in captured_queries:
+        sql = query['sql']
+        if not sql.lstrip().upper().startswith('SELECT'):
+            continue
+        if not any(table in sql for table in tables):
+            continue
+        aliases = {alias: table for table, alias in TABLE_ALIAS.findall(sql)}
+        plan = explain(sql, using=using)
+        for line in plan:
+            match = pattern.search(line.strip())
+            if match and aliases.get(match.group(1), match.group(1)) in tables:
+                offenders.append((sql, plan))
+                break
+    return offenders
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner that runs the suite against TEST_CACHES"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES=TEST_CACHES)
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
+
+
+class QueryBudgetTestMixin:
+    """TestCase mixin enforcing the query budgets recorded by QueryBudgetMiddleware"""
+
+    def assertWithinQueryBudget(self, response):
+        recorder = getattr(response, 'query_recorder', None)
+        if recorder is None:
+            self.fail('Response was not recorded; is QueryBudgetMiddleware installed?')
+        budget = response.query_budget
+        if budget is not None and recorder.count > budget:
+            self.fail(f"Over query budget of {budget}: {recorder.summary(limit=5)}")
+        return recorder
+
+
+class _StubServer(ThreadingHTTPServer):
+    # Concurrency benchmarks open far more than the default 5 pending connections
+    request_queue_size = 256
+
+
+class AzamPayStub:
+    """
+    Local HTTP stand-in for the AzamPay token, partner and checkout APIs.
+    Use as a context manager and point AZAMPAY_AUTH_BASE and
+    AZAMPAY_CHECKOUT_BASE at `url`. `latency` (seconds) is added to every
+    response to approximate the real round trip.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = []
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.handle(self)
+
+            def do_POST(self):
+                stub.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = _StubServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = json.loads(handler.rfile.read(length) or b'{}')
+        self.requests.append((handler.command, handler.path, body))
+        if self.latency:
+            time.sleep(self.latency)
+
+        if handler.path.endswith('/AppRegistration/GenerateToken'):
+            expire = (datetime.now(dt_timezone.utc) + timedelta(hours=1)).isoformat()
+            payload = {'data': {'accessToken': 'stub-token', 'expire': expire}, 'success': True}
+        elif handler.path.endswith('/Partner/GetPaymentPartners'):
+            payload = [
+                {'paymentPartnerId': str(uuid.uuid4()), 'partnerName': name, 'provider': provider,
+                 'paymentVendorId': str(uuid.uuid4()), 'currency': 'TZS', 'logoUrl': ''}
+                for name, provider in [('M-Pesa', 'Mpesa'), ('Airtel Money', 'Airtel'), ('CRDB Bank', 'CRDB')]
+            ]
+        elif '/checkout' in handler.path:
+            payload = {'success': True, 'transactionId': uuid.uuid4().hex, 'message': 'Request in progress'}
+        else:
+            handler.send_error(404)
+            return
+
+        data = json.dumps(payload).encode()
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+
+class SMTPStub:
+    """
+    Local SMTP stand-in that accepts everything and keeps it in `messages`
+    as (sender, recipients, raw bytes). Point EMAIL_HOST/EMAIL_PORT at
+    `host`/`port`. `session_latency` is added when a connection is opened
+    and `latency` per message, to approximate the handshake and per-message
+    round trips of a real provider. `connections` counts SMTP sessions.
+    """
+
+    def __init__(self, latency=0.0, session_latency=0.0):
+        self.latency = latency
+        self.session_latency = session_latency
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                stub.session(self.rfile, self.wfile)
+
+        self.server = _SMTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def session(self, rfile, wfile):
+        def reply(line):
+            wfile.write(line.encode() + b'\r\n')
+            wfile.flush()
+
+        with self.lock:
+            self.connections += 1
+        if self.session_latency:
+            time.sleep(self.session_latency)
+        reply('220 stub ESMTP')
+        sender, recipients = None, []
+        for raw in rfile:
+            command = raw.decode(errors='replace').strip()
+            verb = command[:4].upper()
+            if verb == 'EHLO':
+                reply('250-stub')
+                reply('250 8BITMIME')
+            elif verb in ('HELO', 'NOOP'):
+                reply('250 OK')
+            elif verb == 'MAIL':
+                sender, recipients = command.partition(':')[2].strip(), []
+                reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.partition(':')[2].strip())
+                reply('250 OK')
+            elif verb == 'DATA':
+                reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for line in rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(line[1:] if line.startswith(b'..') else line)
+                if self.latency:
+                    time.sleep(self.latency)
+                with self.lock:
+                    self.messages.append((sender, recipients, b''.join(lines)))
+                sender, recipients = None, []
+                reply('250 OK queued')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                reply('250 OK')
+            elif verb == 'QUIT':
+                reply('221 Bye')
+                return
+            else:
+                reply('502 Command not implemented')
@@ -0,0 +1,266 @@
+import tempfile
+from datetime import datetime, timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends import cached_db
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Task
+
+from . import changelists
+from .cache_tags import TaggedCache, case_tag
+from .changelists import EstimatedCountPaginator, IndexedDatesQuerySet, distinct_values
+from .sessions import SessionStore, is_cookie_key
+
+
+class ServerTimingTests(TestCase):
+    """Server-Timing reveals backend timings, so it is opt-in"""
+
+    def test_not_sent_by_default(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_sent_when_enabled(self):
+        response = self.client.get('/')
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+
+class TaggedCacheTests(SimpleTestCase):
+    """An entry is served until one of its tags is invalidated"""
+
+    def setUp(self):
+        cache.clear()
+        self.tagged = TaggedCache(cache)
+        self.computed = 0
+
+    def compute(self):
+        self.computed += 1
+        return self.computed
+
+    def test_cached_until_invalidated(self):
+        tags = [case_tag(1), 'home']
+        self.assertEqual(self.tagged.get_or_set('page', self.compute, tags), 1)
+        self.assertEqual(self.tagged.get_or_set('page', self.compute, tags), 1)
+        self.tagged.invalidate('home')
+        self.assertEqual(self.tagged.get_or_set('page', self.compute, tags), 2)
+        self.tagged.invalidate(case_tag(1), case_tag(2))
+        self.assertEqual(self.tagged.get('page', tags), None)
+
+    def test_other_tags_are_untouched(self):
+        self.tagged.set('one', 'a', [case_tag(1)])
+        self.tagged.set('two', 'b', [case_tag(2)])
+        self.tagged.invalidate(case_tag(1))
+        self.assertIsNone(self.tagged.get('one', [case_tag(1)]))
+        self.assertEqual(self.tagged.get('two', [case_tag(2)]), 'b')
+
+    def test_invalidation_while_computing_leaves_value_stale(self):
+        def compute():
+            self.tagged.invalidate('home')
+            return 'old'
+        self.tagged.get('page', ['home'])
+        self.assertEqual(self.tagged.get_or_set('page', compute, ['home']), 'old')
+        self.assertIsNone(self.tagged.get('page', ['home']))
+
+    def test_invalidate_writes_a_fresh_version(self):
+        self.tagged.set('page', 'a', ['home'])
+        with mock.patch.object(cache, 'incr', side_effect=AssertionError('read-modify-write')):
+            self.tagged.invalidate('home')
+            self.tagged.invalidate('home')
+        self.assertIsNone(self.tagged.get('page', ['home']))
+
+    def test_evicted_version_never_revives_old_entries(self):
+        self.tagged.set('page', 'a', ['home'])
+        cache.delete('tag-version:home')
+        self.assertIsNone(self.tagged.get('page', ['home']))
+        self.assertEqual(self.tagged.get_or_set('page', 'b', ['home']), 'b')
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tagged = TaggedCache(FileBasedCache(directory, {}))
+            tagged.set('page', 'a', ['home'])
+            self.assertEqual(tagged.get('page', ['home']), 'a')
+            tagged.invalidate('home')
+            self.assertIsNone(tagged.get('page', ['home']))
+
+    @mock.patch('rhci_platform.cache_tags.reading_from_replica', return_value=True)
+    def test_replica_reads_are_not_stored_right_after_invalidation(self, replica):
+        self.tagged.invalidate('home')
+        self.assertEqual(self.tagged.get_or_set('page', self.compute, ['home']), 1)
+        self.assertEqual(self.tagged.get_or_set('page', self.compute, ['home']), 2)
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            self.tagged.get_or_set('page', self.compute, ['home'])
+            self.assertEqual(self.tagged.get_or_set('page', self.compute, ['home']), 3)
+
+
+@override_settings(SESSION_ENGINE='rhci_platform.sessions')
+class SessionEngineTests(TestCase):
+    """Anonymous sessions live in the cookie; logging in moves the session to the database"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.donor = User.objects.create_user('donor', 'donor@example.com', 'secret-pass')
+
+    def test_anonymous_session_is_cookie_only(self):
+        session = SessionStore()
+        session['next'] = '/donations/'
+        with self.assertNumQueries(0):
+            session.save()
+        self.assertTrue(is_cookie_key(session.session_key))
+        self.assertFalse(Session.objects.exists())
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(session.session_key)['next'], '/donations/')
+
+    def test_tampered_cookie_starts_empty(self):
+        session = SessionStore()
+        session['next'] = '/donations/'
+        session.save()
+        tampered = SessionStore(session.session_key[:-2] + 'xx')
+        self.assertEqual(dict(tampered.items()), {})
+        self.assertIsNone(tampered.session_key)
+
+    def test_anonymous_pages_store_no_rows(self):
+        self.client.get('/')
+        self.client.post(reverse('users:login'), {'username': 'donor@example.com', 'password': 'wrong'})
+        self.assertFalse(Session.objects.exists())
+
+    def test_login_moves_session_to_database(self):
+        # The key generated while cycling is never stored, so nothing is deleted
+        with mock.patch.object(cached_db.SessionStore, 'delete') as delete:
+            response = self.client.post(reverse('users:login'), {
+                'username': 'donor@example.com', 'password': 'secret-pass'})
+        self.assertEqual(response.status_code, 302)
+        delete.assert_not_called()
+        key = self.client.cookies['sessionid'].value
+        self.assertFalse(is_cookie_key(key))
+        self.assertEqual(Session.objects.get().session_key, key)
+
+    def test_logout_removes_the_row(self):
+        self.client.post(reverse('users:login'), {'username': 'donor@example.com', 'password': 'secret-pass'})
+        self.assertEqual(Session.objects.count(), 1)
+        self.client.get(reverse('users:logout'))
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse('_auth_user_id' in self.client.session)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    """Large unfiltered lists use the table estimate; filtered lists count up to COUNT_LIMIT"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Task.objects.bulk_create([Task(name='a' if n % 2 else 'b') for n in range(6)])
+
+    def paginate(self, object_list):
+        return EstimatedCountPaginator(object_list, 2)
+
+    def test_estimate_rows(self):
+        self.assertGreaterEqual(changelists.estimate_rows(Task), 6)
+
+    @mock.patch.object(changelists, 'estimate_rows', return_value=250_000)
+    def test_large_table_uses_the_estimate(self, estimate):
+        paginator = self.paginate(Task.objects.order_by('id'))
+        with self.assertNumQueries(0):
+            self.assertEqual(paginator.count, 250_000)
+        self.assertEqual(paginator.estimated, 'about')
+        self.assertEqual(paginator.num_pages, 125_000)
+
+    def test_small_or_unknown_table_is_counted(self):
+        for estimate in (changelists.ESTIMATE_THRESHOLD - 1, None):
+            with self.subTest(estimate=estimate), \
+                    mock.patch.object(changelists, 'estimate_rows', return_value=estimate):
+                paginator = self.paginate(Task.objects.order_by('id'))
+                self.assertEqual(paginator.count, 6)
+                self.assertIsNone(paginator.estimated)
+
+    @mock.patch.object(changelists, 'COUNT_LIMIT', 3)
+    @mock.patch.object(changelists, 'estimate_rows', side_effect=AssertionError('filtered lists are counted'))
+    def test_filtered_count_is_capped(self, estimate):
+        below = self.paginate(Task.objects.filter(name='c').order_by('id'))
+        self.assertEqual((below.count, below.estimated), (0, None))
+        at_cap = self.paginate(Task.objects.filter(name='a').order_by('id'))
+        self.assertEqual((at_cap.count, at_cap.estimated), (3, 'at least'))
+        capped = self.paginate(Task.objects.filter(name__in=['a', 'b']).order_by('id'))
+        self.assertEqual((capped.count, capped.estimated), (3, 'at least'))
+
+    def test_lists_are_counted(self):
+        paginator = self.paginate(list(range(5)))
+        self.assertEqual((paginator.count, paginator.estimated), (5, None))
+
+
+@override_settings(TIME_ZONE='Africa/Dar_es_Salaam')
+class IndexedDatesTests(TestCase):
+    """The date hierarchy finds the same periods as Django's DISTINCT query"""
+
+    @classmethod
+    def setUpTestData(cls):
+        tz = timezone.get_fixed_timezone(180)  # Africa/Dar_es_Salaam, no DST
+        moments = [
+            datetime(2025, 12, 31, 23, 30), datetime(2026, 1, 1, 0, 30),
+            datetime(2026, 1, 31, 23, 59), datetime(2026, 3, 1, 0, 0),
+        ]
+        # Stored in UTC, so the first two share a UTC day but not a local one
+        Task.objects.bulk_create([Task(name='dated', run_after=timezone.make_aware(m, tz)) for m in moments])
+
+    def indexed(self, **filters):
+        queryset = Task.objects.filter(**filters)
+        return IndexedDatesQuerySet(model=Task, query=queryset.query)
+
+    def local(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def test_years(self):
+        self.assertEqual(list(self.indexed().datetimes('run_after', 'year')),
+                         [self.local(2025, 1, 1), self.local(2026, 1, 1)])
+
+    def test_months_across_a_year_end(self):
+        self.assertEqual(list(self.indexed().datetimes('run_after', 'month')),
+                         [self.local(2025, 12, 1), self.local(2026, 1, 1), self.local(2026, 3, 1)])
+
+    def test_days_within_a_month(self):
+        periods = self.indexed(run_after__gte=self.local(2026, 1, 1), run_after__lt=self.local(2026, 2, 1))
+        self.assertEqual(list(periods.datetimes('run_after', 'day')),
+                         [self.local(2026, 1, 1), self.local(2026, 1, 31)])
+        self.assertEqual(list(periods.datetimes('run_after', 'day', order='DESC')),
+                         [self.local(2026, 1, 31), self.local(2026, 1, 1)])
+
+    def test_matches_django(self):
+        for kind in ('year', 'month', 'day'):
+            with self.subTest(kind=kind):
+                self.assertEqual(list(self.indexed().datetimes('run_after', kind)),
+                                 list(Task.objects.datetimes('run_after', kind)))
+
+    def test_no_rows(self):
+        self.assertEqual(self.indexed(name='none').datetimes('run_after', 'month'), [])
+
+
+class DistinctValuesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now().replace(microsecond=0)
+        cls.moments = [now - timedelta(hours=n) for n in range(3)]
+        Task.objects.bulk_create(
+            [Task(name=name, locked_at=locked_at) for name, locked_at in [
+                ('b', cls.moments[0]), ('a', cls.moments[1]), ('b', None),
+                ('c', cls.moments[1]), ('a', cls.moments[2]), ('c', None),
+            ]])
+
+    def test_values_in_order(self):
+        self.assertEqual(distinct_values(Task.objects.all(), 'name'), ['a', 'b', 'c'])
+        self.assertEqual(distinct_values(Task.objects.filter(name__gt='a'), 'name'), ['b', 'c'])
+
+    def test_null_comes_first_once(self):
+        self.assertEqual(distinct_values(Task.objects.all(), 'locked_at'), [None, *reversed(self.moments)])
+        self.assertEqual(distinct_values(Task.objects.filter(name='a'), 'locked_at'), self.moments[:0:-1])
+        self.assertEqual(distinct_values(Task.objects.filter(locked_at__isnull=True), 'locked_at'), [None])
+
+    def test_limit(self):
+        self.assertEqual(distinct_values(Task.objects.all(), 'name', limit=2), ['a', 'b'])
+        self.assertEqual(distinct_values(Task.objects.all(), 'locked_at', limit=2), [None, self.moments[2]])
+        self.assertEqual(distinct_values(Task.objects.none(), 'name'), [])
@@ -0,0 +1,28 @@
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+@contextmanager
+def write_transaction(using=None):
+    """
+    transaction.atomic() for code paths that will write.
+
+    On the tuned SQLite backend the outermost block starts with BEGIN
+    IMMEDIATE, so concurrent writers queue on busy_timeout instead of
+    deadlocking on a read-to-write lock upgrade. Elsewhere it is a plain
+    atomic block.
+    """
+    connection = transaction.get_connection(using)
+    immediate = hasattr(connection, 'begin_immediate') and not connection.in_atomic_block
+    if immediate:
+        connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            if immediate:
+                # BEGIN has been issued; later savepoints are unaffected
+                connection.begin_immediate = False
+            yield
+    finally:
+        if immediate:
+            connection.begin_immediate = False
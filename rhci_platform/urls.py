@@ -3,10 +3,15 @@ from django.urls import path, include
 from django.contrib.auth import views as auth_views
 from django.conf import settings
 from django.conf.urls.static import static
+from apps.beneficiaries import views as beneficiaries_views
+from rhci_platform import admin_views
 
 urlpatterns = [
     # Admin URLs
     path('admin/', admin.site.urls),
+
+    # Prometheus metrics (staff or METRICS_TOKEN)
+    path('metrics/', admin_views.metrics, name='metrics'),
     
     # Django auth URLs with your custom templates
     path('login/', auth_views.LoginView.as_view(
@@ -42,7 +47,19 @@ urlpatterns = [
     # Donations app URLs
     path('donations/', include('apps.donations.urls', namespace='donations')),
     
+    # Beneficiaries URLs (protected medical record downloads)
+    path('beneficiaries/', include('apps.beneficiaries.urls')),
+
+    # Medical records are never served from the public media path
+    path(f"{settings.MEDIA_URL.lstrip('/')}medical_records/<path:name>",
+         beneficiaries_views.medical_record_media, name='medical_record_media'),
+
     # Core app URLs
     path('', include('core.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+# Uploaded media is only served by Django during development; in production
+# the front proxy serves /media/ (except medical records, see above)
+if settings.DEBUG:
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Raised when a chunk or a completed upload cannot be accepted"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_content_range(header):
+    """Return (start, end, total) from a `Content-Range: bytes a-b/n` header"""
+    match = CONTENT_RANGE_RE.match((header or '').strip())
+    if not match:
+        raise UploadError('Content-Range header required (bytes start-end/total)')
+    start, end, total = (int(x) for x in match.groups())
+    if end < start:
+        raise UploadError('Invalid Content-Range')
+    return start, end, total
+
+
+def temp_path(session):
+    upload_dir = settings.CHUNKED_UPLOAD_DIR
+    os.makedirs(upload_dir, exist_ok=True)
+    return os.path.join(upload_dir, f'{session.id}.part')
+
+
+def write_chunk(session, stream, start, end, total):
+    """
+    Write bytes `start`..`end` read from `stream` into the session's part file.
+
+    Chunks are copied to disk in small blocks so worker memory stays flat. A
+    chunk that overlaps data already received (a client retry) only appends
+    the new tail. Returns the new number of received bytes.
+    """
+    if total != session.total_size:
+        raise UploadError('Total size does not match the upload session')
+    if end >= session.total_size:
+        raise UploadError('Chunk extends past the end of the file')
+    if start > session.received_bytes:
+        # A gap would corrupt the file; tell the client where to resume
+        raise UploadError('Chunk starts after the resume offset', status=409)
+    length = end - start + 1
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError('Chunk too large', status=413)
+
+    skip = session.received_bytes - start
+    path = temp_path(session)
+    written = 0
+    with open(path, 'ab') as fh:
+        fh.truncate(session.received_bytes)
+        remaining = length
+        while remaining > 0:
+            block = stream.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            if skip >= len(block):
+                skip -= len(block)
+                continue
+            block = block[skip:]
+            skip = 0
+            fh.write(block)
+            written += len(block)
+    if remaining:
+        # Connection dropped mid-chunk: keep nothing from this chunk
+        with open(path, 'ab') as fh:
+            fh.truncate(session.received_bytes)
+        raise UploadError('Incomplete chunk body')
+    return session.received_bytes + written
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(READ_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def verify(session):
+    """Check the assembled part file against the declared size and SHA-256"""
+    path = temp_path(session)
+    if session.received_bytes != session.total_size or os.path.getsize(path) != session.total_size:
+        raise UploadError('Upload is not complete', status=409)
+    if file_sha256(path) != session.sha256.lower():
+        raise UploadError('Checksum mismatch', status=422)
+    return path
+
+
+def attach(session, path):
+    """Move the verified file into storage on the record or case it belongs to"""
+    from apps.beneficiaries.models import MedicalRecord
+
+    with open(path, 'rb') as fh:
+        content = File(fh, name=session.filename)
+        if session.target == 'medical_record':
+            record = MedicalRecord(
+                case=session.case,
+                record_type=session.record_type,
+                notes=session.notes,
+                uploaded_by=session.user,
+            )
+            record.file.save(session.filename, content, save=True)
+            session.medical_record = record
+        else:
+            field = 'case_image' if session.target == 'case_image' else 'photo'
+            getattr(session.case, field).save(session.filename, content, save=False)
+            session.case.save(update_fields=[field, 'updated_at'])
+    os.remove(path)
+
+
+def discard(session):
+    path = temp_path(session)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,127 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Compressed files are sent as the archive they are, never with a
+# Content-Encoding the browser would undo (same types as FileResponse)
+ENCODED_TYPES = {
+    'br': 'application/x-brotli',
+    'bzip2': 'application/x-bzip',
+    'compress': 'application/x-compress',
+    'gzip': 'application/gzip',
+    'xz': 'application/x-xz',
+}
+
+
+def _file_chunks(path, start, length, chunk_size):
+    """Yield `length` bytes of the file at `path` starting from `start`"""
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = fh.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _parse_range(header, size):
+    """Return (start, end) for a single `bytes=` range, or None if unusable"""
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and start > int(last):
+        return None
+    end = int(last) if last else size - 1
+    return start, min(end, size - 1)
+
+
+def _content_disposition(filename, as_attachment):
+    disposition = 'attachment' if as_attachment else 'inline'
+    try:
+        filename.encode('ascii')
+        return f'{disposition}; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"{disposition}; filename*=utf-8''{quote(filename)}"
+
+
+def serve_file(request, field_file, as_attachment=False):
+    """
+    Send a stored file without buffering it in worker memory.
+
+    With SENDFILE_BACKEND = 'xsendfile' or 'nginx' the response carries only a
+    header and the front proxy streams the bytes. Otherwise the file is
+    streamed in chunks, honouring a single HTTP Range request.
+    """
+    try:
+        path = field_file.path
+    except (NotImplementedError, ValueError):
+        raise Http404("File is not available")
+    if not os.path.isfile(path):
+        raise Http404("File does not exist")
+
+    size = os.path.getsize(path)
+    content_type, encoding = mimetypes.guess_type(path)
+    content_type = ENCODED_TYPES.get(encoding, content_type) or 'application/octet-stream'
+    filename = os.path.basename(path)
+    backend = getattr(settings, 'SENDFILE_BACKEND', '')
+
+    if backend in ('xsendfile', 'nginx'):
+        response = HttpResponse(content_type=content_type)
+        if backend == 'nginx':
+            relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            response['X-Accel-Redirect'] = quote(
+                settings.SENDFILE_INTERNAL_URL.rstrip('/') + '/' + relative
+            )
+        else:
+            response['X-Sendfile'] = path
+        response['Content-Disposition'] = _content_disposition(filename, as_attachment)
+        # Let the proxy compute the body length
+        del response['Content-Length']
+        return response
+
+    chunk_size = getattr(settings, 'SENDFILE_CHUNK_SIZE', 64 * 1024)
+    # Malformed ranges are ignored and the whole file is sent
+    byte_range = _parse_range(request.META.get('HTTP_RANGE'), size) if size else None
+
+    if byte_range and byte_range[0] >= size:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _file_chunks(path, start, length, chunk_size),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response.block_size = chunk_size
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(os.path.getmtime(path))
+    response['Content-Disposition'] = _content_disposition(filename, as_attachment)
+    response['Cache-Control'] = 'private, no-store'
+    return response
@@ -0,0 +1,65 @@
+(function($) {
+    'use strict';
+    // Panels of rhci_platform.lazy_inlines: a page of rows is fetched when a
+    // panel is first opened, and page links and saves replace it in place.
+
+    function initWidgets(body) {
+        // What inlines.js, autocomplete.js and DateTimeShortcuts do on page load
+        body.find('.js-inline-admin-formset').each(function() {
+            const data = $(this).data(),
+                inlineOptions = data.inlineFormset,
+                selector = inlineOptions.name + '-group .tabular.inline-related tbody:first > tr.form-row';
+            $(selector).tabularFormset(selector, inlineOptions.options);
+        });
+        body.find('.admin-autocomplete').not('[name*=__prefix__]').djangoAdminSelect2();
+        if (window.DateTimeShortcuts) {
+            body.find('input.vDateField').not('[name*=__prefix__]').each(function() {
+                DateTimeShortcuts.addCalendar(this);
+            });
+            body.find('input.vTimeField').not('[name*=__prefix__]').each(function() {
+                DateTimeShortcuts.addClock(this);
+            });
+        }
+    }
+
+    function load(panel, url, options) {
+        const body = panel.find('.lazy-inline-body');
+        panel.data('current', url);
+        return fetch(url, Object.assign({headers: {'X-Requested-With': 'XMLHttpRequest'}}, options))
+            .then(function(response) {
+                if (!response.ok) {
+                    throw new Error(response.status + ' ' + response.statusText);
+                }
+                return response.text();
+            })
+            .then(function(html) {
+                body.html(html);
+                initWidgets(body);
+            })
+            .catch(function(error) {
+                body.html($('<p class="errornote"></p>').text('Could not load this section: ' + error.message));
+            });
+    }
+
+    $(document).ready(function() {
+        $('details.lazy-inline').each(function() {
+            const panel = $(this),
+                base = panel.data('url');
+
+            panel.on('toggle', function() {
+                if (this.open && !panel.data('current')) {
+                    load(panel, base);
+                }
+            });
+            panel.on('click', 'a.lazy-inline-page', function(event) {
+                event.preventDefault();
+                load(panel, new URL($(this).attr('href'), new URL(base, window.location)).href);
+            });
+            panel.on('submit', 'form.lazy-inline-form', function(event) {
+                event.preventDefault();
+                const url = new URL($(this).attr('action'), new URL(base, window.location)).href;
+                load(panel, url, {method: 'POST', body: new FormData(this)});
+            });
+        });
+    });
+})(django.jQuery);